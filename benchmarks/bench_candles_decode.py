@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+''' Benchmark for the decoding of candles responses
+
+Compares the decoding of a raw candles response with v20 model objects
+(``Candlestick.from_dict`` followed by ``dict()``, one dict per candle) to
+the decoding into the columnar ``OandaCandles`` and the loading of the
+decoded candles into the lines of the data feed:
+
+    python benchmarks/bench_candles_decode.py --candles 5000
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import time as _time
+import tracemalloc
+
+import v20
+
+from btoandav20.stores import OandaCandles
+
+from bench_feed import START, drive, make_feed
+
+
+def make_body(count, secs=60):
+    '''Returns the raw json of a candles response like OANDA sends it'''
+    candles = []
+    for i in range(count):
+        o = 1.1 + (i % 100) * 0.00001
+        candle = {'time': '{:.9f}'.format(START + i * secs),
+                  'volume': 10 + i % 50, 'complete': True}
+        for side, adj in (('bid', 0.0), ('mid', 0.00005), ('ask', 0.0001)):
+            candle[side] = {k: '{:.5f}'.format(o + adj + x)
+                            for k, x in (('o', 0.0), ('h', 0.0002),
+                                         ('l', -0.0002), ('c', 0.0001))}
+        candles.append(candle)
+    return json.dumps({'instrument': 'EUR_USD', 'granularity': 'M1',
+                       'candles': candles})
+
+
+def decode_v20(body, ctx):
+    '''Decoding of the store before the columnar candles'''
+    jbody = json.loads(body)
+    candles = [ctx.instrument.Candlestick.from_dict(d, ctx)
+               for d in jbody.get('candles')]
+    return [candle.dict() for candle in candles if candle.complete]
+
+
+def decode_columnar(body, ctx):
+    '''Decoding of the store into columnar candles'''
+    page = OandaCandles()
+    for candle in json.loads(body)['candles']:
+        if candle['complete']:
+            page.append(candle)
+    return [page]
+
+
+DECODERS = {
+    'v20': decode_v20,
+    'columnar': decode_columnar,
+}
+
+
+def run(name, body, count, repeat):
+    ctx = v20.Context('localhost', datetime_format='UNIX')
+    decode = DECODERS[name]
+
+    best = None
+    for _ in range(repeat):
+        tstart = _time.perf_counter()
+        decode(body, ctx)
+        seconds = _time.perf_counter() - tstart
+        best = seconds if best is None else min(best, seconds)
+
+    tracemalloc.start()
+    messages = decode(body, ctx)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    data = make_feed('historback', 'bid', False, messages)
+    tstart = _time.perf_counter()
+    drive(data, count)
+    load = _time.perf_counter() - tstart
+
+    return dict(
+        decoder=name,
+        candles=count,
+        loaded=len(data),
+        decode_per_sec=count / best,
+        load_per_sec=count / load,
+        total_per_sec=count / (best + load),
+        decoded_bytes=current,
+        decode_peak_bytes=peak,
+    )
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    body = make_body(args.candles)
+    results = []
+    for name in DECODERS:
+        res = run(name, body, args.candles, args.repeat)
+        results.append(res)
+        if not args.json:
+            print('{decoder:<9} decode {decode_per_sec:>10.0f} candles/sec  '
+                  'load {load_per_sec:>10.0f} candles/sec  '
+                  'total {total_per_sec:>10.0f} candles/sec  '
+                  '{decoded_bytes:>10} bytes'.format(**res))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the decoding of candles responses')
+
+    parser.add_argument('--candles', default=5000, type=int,
+                        required=False, action='store',
+                        help='Number of candles in the response')
+
+    parser.add_argument('--repeat', default=5, type=int,
+                        required=False, action='store',
+                        help='Number of decoding runs, the best is reported')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+''' Memory of a large historical candle download
+
+Downloads ``--candles`` S5 candles with ``OandaV20Store.iter_candles`` while
+the consumer spends ``--consume-us`` microseconds per candle, which is
+slower than the download. The resident memory and the count of candles held
+by the store are sampled during the download. With ``--buffer -1`` the
+candles are buffered without a limit like before the bounded candle channel.
+With ``--rows`` the candles are iterated as dicts instead of columnar:
+
+    python benchmarks/bench_candles_memory.py --candles 10000000
+    python benchmarks/bench_candles_memory.py --candles 10000000 --buffer -1
+    python benchmarks/bench_candles_memory.py --candles 10000000 --rows
+
+By default the candles responses are generated in-process (5000 candles per
+response), with ``--server`` they are requested from the local stand-in
+server, which is a lot slower.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import time as _time
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+import btoandav20
+
+from bench_soak import rss
+from oandav20server import OandaV20Server, parse_time
+
+
+StoreCls = btoandav20.stores.OandaV20Store
+
+SECS = 5  # S5 candles
+START = 1500000000
+
+
+class Response(object):
+    '''Stands in for a v20 response of the candles endpoint'''
+
+    status = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, field, status=None):
+        return self.body[field]
+
+
+def request_candles(dataname, **kwargs):
+    '''Returns a candles response of up to 5000 candles like OANDA'''
+    start = int(parse_time(kwargs['from']))
+    if kwargs.get('includeFirst') is False:
+        start += SECS
+    candles = []
+    for i in range(5000):
+        t = start + i * SECS
+        o = 1.1 + (t // SECS % 100) * 0.00001
+        candles.append({
+            'time': '{}.000000000'.format(t), 'volume': 10, 'complete': True,
+            'mid': {'o': '{:.5f}'.format(o), 'h': '{:.5f}'.format(o + 0.0002),
+                    'l': '{:.5f}'.format(o - 0.0002),
+                    'c': '{:.5f}'.format(o + 0.0001)}})
+    return Response({'candles': candles})
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    srv = None
+    kwargs = dict(account='bench', token='bench',
+                  candles_buffer=None if args.buffer < 0 else args.buffer)
+    if args.server:
+        srv = OandaV20Server().start()
+        kwargs.update(srv.store_params())
+    StoreCls._singleton = None
+    store = StoreCls(**kwargs)
+    if srv is None:
+        store._request_candles = request_candles
+
+    dtbegin = datetime.utcfromtimestamp(START)
+    if srv is not None:
+        # the stand-in has no candles in the future
+        dtbegin = datetime.utcnow() - timedelta(seconds=args.candles * SECS)
+        # start on a candle to request exactly the given count
+        dtbegin = dtbegin.replace(second=dtbegin.second // SECS * SECS,
+                                  microsecond=0)
+    dtend = dtbegin + timedelta(seconds=(args.candles - 1) * SECS)
+
+    channels = []
+    candles = store.candles
+
+    def candles_wrapper(*cargs, **ckwargs):
+        q = candles(*cargs, **ckwargs)
+        channels.append(q)
+        return q
+
+    store.candles = candles_wrapper
+
+    rss_start = rss()
+    samples = []
+    count = 0
+    tnext = 0
+    tstart = _time.perf_counter()
+    pending = 0  # candles consumed since the last sleep
+    for msg in store.iter_candles('EUR_USD', dtbegin, dtend,
+                                  bt.TimeFrame.Seconds, 5, 'M',
+                                  columnar=not args.rows):
+        size = 1 if args.rows else len(msg)
+        count += size
+        pending += size
+        if pending >= 1000:
+            # the consumer is slower than the download
+            _time.sleep(pending * args.consume_us / 1e6)
+            pending = 0
+        if count >= tnext:
+            tnext += args.step
+            samples.append(dict(candles=count, rss=rss(),
+                                held=channels[0].candles()))
+            if not args.json:
+                print('{:>10} candles: rss {:>8.1f}MB, {:>9} candles '
+                      'held'.format(count, samples[-1]['rss'] / 1024.0 ** 2,
+                                    samples[-1]['held']))
+    seconds = _time.perf_counter() - tstart
+    if srv is not None:
+        srv.stop()
+
+    res = dict(
+        candles=count,
+        buffer=kwargs['candles_buffer'],
+        rows=args.rows,
+        seconds=seconds,
+        candles_per_sec=count / seconds,
+        rss_start=rss_start,
+        rss_max=max(x['rss'] for x in samples),
+        held_max=max(x['held'] for x in samples),
+        samples=samples)
+    if args.json:
+        print(json.dumps(res, indent=2))
+        return
+    print('{} candles in {:.1f}s ({:.0f}/s), buffer {}: rss {:.1f}MB at '
+          'start, max {:.1f}MB, max {} candles held'.format(
+              count, seconds, res['candles_per_sec'], res['buffer'],
+              rss_start / 1024.0 ** 2, res['rss_max'] / 1024.0 ** 2,
+              res['held_max']))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Memory of a large historical candle download')
+
+    parser.add_argument('--candles', default=10000000, type=int,
+                        required=False, action='store',
+                        help='Candles to download')
+
+    parser.add_argument('--buffer', default=50000, type=int, required=False,
+                        action='store',
+                        help='candles_buffer of the store, -1 for no limit')
+
+    parser.add_argument('--consume-us', default=20.0, type=float,
+                        required=False, action='store',
+                        help='Microseconds the consumer spends per candle')
+
+    parser.add_argument('--step', default=1000000, type=int, required=False,
+                        action='store', help='Candles between samples')
+
+    parser.add_argument('--rows', required=False, action='store_true',
+                        help='Iterate candles as dicts instead of columnar')
+
+    parser.add_argument('--server', required=False, action='store_true',
+                        help='Request the candles from the stand-in server')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+''' Benchmark for the ingestion of the data feed
+
+Drives the state machine of ``OandaV20Data._load`` (``_ST_LIVE``,
+``_ST_HISTORBACK`` and ``_ST_FROM``) with synthetic queues of pricing and
+candle dicts without any connection to OANDA. For every scenario the
+throughput, the latency per message and the allocations per message are
+reported. Results can be written as json and compared against a previous
+run to track regressions:
+
+    python benchmarks/bench_feed.py --out feed-0.2.1.json
+    python benchmarks/bench_feed.py --compare feed-0.2.1.json
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import platform
+import sys
+import time as _time
+import tracemalloc
+from datetime import datetime
+
+import backtrader as bt
+from backtrader.utils.py3 import queue
+
+import btoandav20
+from btoandav20.stores.oandachannel import OandaCandleChannel
+from btoandav20.stores.oandaperiods import OandaPeriods
+from btoandav20.version import __version__
+
+
+DataCls = btoandav20.feeds.OandaV20Data
+
+CONTRACTDETAILS = {
+    'name': 'EUR_USD',
+    'displayPrecision': 5,
+    'pipLocation': -4,
+}
+
+# price variants: name -> data params
+VARIANTS = {
+    'bid': dict(bidask=True, useask=False),
+    'ask': dict(bidask=True, useask=True),
+    'mid': dict(bidask=False),
+}
+
+START = 1600000000.0
+
+
+def make_ticks(count):
+    ticks = []
+    for i in range(count):
+        bid = 1.1 + (i % 100) * 0.00001
+        ticks.append({
+            'type': 'PRICE',
+            'instrument': 'EUR_USD',
+            'time': '{:.9f}'.format(START + i * 0.25),
+            'tradeable': True,
+            'bids': [{'price': bid, 'liquidity': 1000000}],
+            'asks': [{'price': bid + 0.0001, 'liquidity': 1000000}],
+            'closeoutBid': bid,
+            'closeoutAsk': bid + 0.0001,
+        })
+    return ticks
+
+
+def make_candles(count, secs):
+    candles = []
+    for i in range(count):
+        o = 1.1 + (i % 100) * 0.00001
+        candle = {'time': '{:.9f}'.format(START + i * secs),
+                  'volume': 10 + i % 50, 'complete': True}
+        for side, adj in (('bid', 0.0), ('mid', 0.00005), ('ask', 0.0001)):
+            candle[side] = {'o': o + adj, 'h': o + adj + 0.0002,
+                            'l': o + adj - 0.0002, 'c': o + adj + 0.0001}
+        candles.append(candle)
+    return candles
+
+
+class SyntheticData(bt.feed.DataBase):
+    '''Data feed delivering prepared candles, used for ``backfill_from``'''
+
+    lines = ('mid_close', 'bid_close', 'ask_close',)
+
+    params = (('candles', None),)
+
+    def start(self):
+        super(SyntheticData, self).start()
+        self._idx = 0
+
+    def _load(self):
+        if self._idx >= len(self.p.candles):
+            return False
+        c = self.p.candles[self._idx]
+        self._idx += 1
+        self.l.datetime[0] = bt.date2num(
+            datetime.utcfromtimestamp(float(c['time'])))
+        self.l.open[0] = c['bid']['o']
+        self.l.high[0] = c['bid']['h']
+        self.l.low[0] = c['bid']['l']
+        self.l.close[0] = c['bid']['c']
+        self.l.volume[0] = c['volume']
+        self.l.openinterest[0] = 0.0
+        for side in ('mid', 'bid', 'ask'):
+            getattr(self.l, '{}_close'.format(side))[0] = c[side]['c']
+        return True
+
+
+def make_feed(scenario, variant, adjstarttime, messages):
+    '''Creates a started feed in the state of the scenario without
+    connecting the store'''
+    kwargs = dict(dataname='EUR_USD', timeframe=bt.TimeFrame.Minutes,
+                  compression=1, qcheck=0.0, adjstarttime=adjstarttime)
+    kwargs.update(VARIANTS[variant])
+    if scenario == 'live_candles':
+        kwargs['candles'] = True
+    elif scenario == 'historback':
+        kwargs['historical'] = True
+    elif scenario == 'from':
+        backfill = SyntheticData(candles=messages)
+        kwargs['backfill_from'] = backfill
+
+    data = DataCls(**kwargs)
+    cerebro = bt.Cerebro()
+    data.setenvironment(cerebro)
+    # start the feed like OandaV20Data.start without using the store
+    bt.feed.DataBase.start(data)
+    data._start_finish()
+    data._statelivereconn = False
+    data._storedmsg = dict()
+    data._histcandles = None
+    data._histidx = 0
+    data._builder = None
+    data._periods = OandaPeriods(
+        data._timeframe, data._compression, data.p.sessionstart)
+    data._ticks = None
+    data._reconns = data.p.reconnections
+    data.contractdetails = CONTRACTDETAILS
+    data._load_tick = data._tick_loader()
+    data.qlive = queue.Queue()
+
+    if scenario in ('live_ticks', 'live_candles'):
+        for msg in messages:
+            data.qlive.put(msg)
+        data._state = data._ST_LIVE
+    elif scenario == 'historback':
+        data.qhist = OandaCandleChannel()
+        for msg in messages:
+            data.qhist.put(msg)
+        data.qhist.put({})
+        data._state = data._ST_HISTORBACK
+    elif scenario == 'from':
+        backfill.setenvironment(cerebro)
+        backfill._start()
+        data._state = data._ST_FROM
+    return data
+
+
+def drive(data, count):
+    '''Loads count messages into the lines, returns latencies in ns'''
+    latencies = []
+    perf = _time.perf_counter_ns
+    for _ in range(count):
+        t0 = perf()
+        ret = data.load()
+        latencies.append(perf() - t0)
+        if not ret:
+            break
+    return latencies
+
+
+def percentile(values, perc):
+    idx = min(len(values) - 1, int(round(perc / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def run(scenario, variant, adjstarttime, count):
+    if scenario == 'live_ticks':
+        messages = make_ticks(count)
+    else:
+        messages = make_candles(count, 60)
+
+    # timing run
+    data = make_feed(scenario, variant, adjstarttime, messages)
+    tstart = _time.perf_counter()
+    latencies = drive(data, count)
+    seconds = _time.perf_counter() - tstart
+    loaded = len(data)
+
+    # allocation run
+    data = make_feed(scenario, variant, adjstarttime, messages)
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    drive(data, count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+
+    latencies.sort()
+    return dict(
+        scenario=scenario,
+        variant=variant,
+        adjstarttime=adjstarttime,
+        messages=count,
+        loaded=loaded,
+        seconds=seconds,
+        msgs_per_sec=count / seconds,
+        latency_ns=dict(
+            p50=percentile(latencies, 50),
+            p90=percentile(latencies, 90),
+            p99=percentile(latencies, 99),
+            max=latencies[-1]),
+        alloc_bytes_per_msg=current / count,
+        alloc_peak_bytes=peak,
+        alloc_blocks_per_msg=blocks / count,
+    )
+
+
+def scenarios():
+    for variant in VARIANTS:
+        yield 'live_ticks', variant, False
+    for scenario in ('live_candles', 'historback', 'from'):
+        for variant in VARIANTS:
+            for adjstarttime in (False, True):
+                if scenario == 'from' and adjstarttime:
+                    continue  # backfill_from does not adjust start times
+                yield scenario, variant, adjstarttime
+
+
+def key(res):
+    return '{scenario}/{variant}/adj={adjstarttime}'.format(**res)
+
+
+def compare(results, baseline, threshold):
+    '''Prints scenarios slower than the baseline, returns regressions'''
+    base = {key(x): x for x in baseline['results']}
+    regressions = 0
+    for res in results:
+        old = base.get(key(res))
+        if old is None:
+            continue
+        change = res['msgs_per_sec'] / old['msgs_per_sec'] - 1.0
+        flag = ''
+        if change < -threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('{:<36} {:>+8.1%}{}'.format(key(res), change, flag))
+    return regressions
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    results = []
+    for scenario, variant, adjstarttime in scenarios():
+        res = run(scenario, variant, adjstarttime, args.messages)
+        results.append(res)
+        if not args.json:
+            print('{:<36} {:>10.0f} msgs/sec  p50 {:>6.1f}us  '
+                  'p99 {:>6.1f}us  {:>7.1f} bytes/msg'.format(
+                      key(res), res['msgs_per_sec'],
+                      res['latency_ns']['p50'] / 1000.0,
+                      res['latency_ns']['p99'] / 1000.0,
+                      res['alloc_bytes_per_msg']))
+
+    output = dict(
+        benchmark='feed',
+        version=__version__,
+        backtrader=bt.__version__,
+        python=platform.python_version(),
+        created=datetime.utcnow().isoformat(),
+        results=results)
+    if args.json:
+        print(json.dumps(output, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the ingestion of the data feed')
+
+    parser.add_argument('--messages', default=50000, type=int,
+                        required=False, action='store',
+                        help='Number of messages per scenario')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    parser.add_argument('--out', default=None, required=False,
+                        action='store', help='Write results to json file')
+
+    parser.add_argument('--compare', default=None, required=False,
+                        action='store',
+                        help='Compare against results of a json file')
+
+    parser.add_argument('--threshold', default=0.1, type=float,
+                        required=False, action='store',
+                        help='Slowdown which is reported as regression')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
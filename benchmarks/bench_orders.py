@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+''' Load generator for the order path of the broker and store
+
+Sends market, limit (cancelled after ``--cancel-after`` seconds) and bracket
+orders with ``OandaV20Broker.buy/sell/cancel`` at a fixed rate to the
+local stand-in server and measures every stage of an order:
+
+  - queue: ``order_create`` until a worker takes the order
+  - request: rest request of the order create
+  - stream: time of the transaction on the server until the store receives
+    it from the transaction stream
+  - accept: ``order_create`` until the order is accepted
+  - fill: ``order_create`` until the order is completed
+  - notify: broker notification until the consumer (the strategy) gets it
+
+Latency percentiles of every stage and the throughput are reported:
+
+    python benchmarks/bench_orders.py --rate 50 --seconds 20
+    python benchmarks/bench_orders.py --rate 200 --latency 0.02 --json
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import collections
+import json
+import random
+import threading
+import time as _time
+
+import backtrader as bt
+
+import btoandav20
+
+from oandav20server import OandaV20Server
+from bench_soak import make_data
+
+
+BrokerCls = btoandav20.brokers.OandaV20Broker
+
+INSTRUMENTS = ['EUR_USD', 'GBP_USD', 'AUD_USD', 'NZD_USD', 'USD_CAD',
+               'USD_CHF', 'USD_JPY', 'EUR_GBP']
+
+STAGES = ['queue', 'request', 'stream', 'accept', 'fill', 'notify']
+
+
+def percentile(values, perc):
+    idx = min(len(values) - 1, int(round(perc / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+class Recorder(object):
+    '''Records the stage times of orders by wrapping the store and broker
+    methods of the order path'''
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.store = store = broker.o
+        self.lock = threading.Lock()
+        self.created = dict()  # order_create time by oref
+        self.stages = collections.defaultdict(list)  # seconds by stage
+        self.notified = collections.deque()  # (time, order) of notifs
+        self.counts = collections.Counter()
+
+        order_create = store.order_create
+        order_send = store._order_create
+        transaction = store._transaction
+        notify = broker.notify
+
+        def order_create_wrapper(order, stopside=None, takeside=None,
+                                 **kwargs):
+            now = _time.monotonic()
+            for o in (order, stopside, takeside):
+                if o is not None:
+                    self.created[o.ref] = now
+            return order_create(order, stopside, takeside, **kwargs)
+
+        def order_send_wrapper(msg):
+            tstart = _time.monotonic()
+            self.add('queue', tstart - self.created.get(msg[0], tstart))
+            try:
+                return order_send(msg)
+            finally:
+                self.add('request', _time.monotonic() - tstart)
+
+        def transaction_wrapper(trans):
+            # transaction times of the stand-in are unix epoch seconds
+            self.add('stream', _time.time() - float(trans['time']))
+            return transaction(trans)
+
+        def notify_wrapper(order):
+            now = _time.monotonic()
+            created = self.created.get(order.ref)
+            if created is not None:
+                if order.status == order.Accepted:
+                    self.add('accept', now - created)
+                elif order.status == order.Completed:
+                    self.add('fill', now - created)
+            self.counts[order.getstatusname()] += 1
+            self.notified.append(now)
+            return notify(order)
+
+        store.order_create = order_create_wrapper
+        store._order_create = order_send_wrapper
+        store._transaction = transaction_wrapper
+        broker.notify = notify_wrapper
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage].append(seconds)
+
+    def consume(self):
+        '''Gets the notifications of the broker like cerebro does for the
+        strategy'''
+        while True:
+            order = self.broker.get_notification()
+            if order is None:
+                return
+            self.add('notify', _time.monotonic() - self.notified.popleft())
+
+    def results(self):
+        res = dict()
+        with self.lock:
+            for stage in STAGES:
+                values = sorted(self.stages[stage])
+                if not values:
+                    continue
+                res[stage] = dict(
+                    count=len(values),
+                    p50=percentile(values, 50),
+                    p90=percentile(values, 90),
+                    p99=percentile(values, 99),
+                    max=values[-1])
+        return res
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    srv = OandaV20Server(heartbeat=1.0, latency=args.latency,
+                         fill_latency=args.fill_latency)
+    srv.start()
+    broker = BrokerCls(use_positions=False,
+                       order_workers=args.workers,
+                       request_rate=args.request_rate or None,
+                       **srv.store_params())
+    rec = Recorder(broker)
+    broker.start()
+    # orders sent before the transaction stream is connected are missed
+    while not srv._trans_subs:
+        _time.sleep(0.01)
+
+    datas = []
+    for name in INSTRUMENTS[:args.instruments]:
+        data = make_data()
+        data._dataname = name
+        data.contractdetails = dict(data.contractdetails, name=name)
+        datas.append(data)
+
+    rnd = random.Random(args.seed)
+    mix = (['market'] * args.market + ['limit'] * args.limit
+           + ['bracket'] * args.bracket)
+    cancels = []  # (due time, order) of limit orders to cancel
+    orders = 0
+    tstart = _time.monotonic()
+    tend = tstart + args.seconds
+    tnext = tstart
+    try:
+        while True:
+            now = _time.monotonic()
+            rec.consume()
+            while cancels and cancels[0][0] <= now:
+                broker.cancel(cancels.pop(0)[1])
+            if now >= tend:
+                break
+            if now < tnext:
+                _time.sleep(min(tnext - now, 0.001))
+                continue
+            tnext += 1.0 / args.rate
+
+            data = rnd.choice(datas)
+            price = srv.get_instrument(data._dataname).mid
+            kind = rnd.choice(mix)
+            side = broker.buy if rnd.random() < 0.5 else broker.sell
+            if kind == 'market':
+                side(None, data, 100, exectype=bt.Order.Market)
+            elif kind == 'limit':
+                # far away from the price, stays pending until cancelled
+                order = broker.buy(None, data, 100, price=price * 0.5,
+                                   exectype=bt.Order.Limit)
+                cancels.append((now + args.cancel_after, order))
+            else:
+                parent = broker.buy(None, data, 100,
+                                    exectype=bt.Order.Market,
+                                    transmit=False)
+                broker.sell(None, data, 100, price=price * 0.9,
+                            exectype=bt.Order.Stop, parent=parent,
+                            transmit=False)
+                broker.sell(None, data, 100, price=price * 1.1,
+                            exectype=bt.Order.Limit, parent=parent,
+                            transmit=True)
+            orders += 1
+
+        # wait for the last orders
+        tdrain = _time.monotonic() + args.drain
+        while _time.monotonic() < tdrain:
+            rec.consume()
+            _time.sleep(0.001)
+    finally:
+        seconds = _time.monotonic() - tstart
+        broker.stop()
+        srv.stop()
+
+    res = dict(
+        orders=orders,
+        seconds=args.seconds,
+        orders_per_sec=orders / args.seconds,
+        completed=rec.counts['Completed'],
+        accepted=rec.counts['Accepted'],
+        rejected=rec.counts['Rejected'],
+        completed_per_sec=rec.counts['Completed'] / seconds,
+        stages=rec.results(),
+    )
+    if args.json:
+        print(json.dumps(res, indent=2))
+        return
+    print('{} orders in {:.1f}s ({:.1f}/s), {} accepted, {} completed, '
+          '{} rejected'.format(res['orders'], args.seconds,
+                               res['orders_per_sec'], res['accepted'],
+                               res['completed'], res['rejected']))
+    for stage in STAGES:
+        stats = res['stages'].get(stage)
+        if stats is None:
+            continue
+        print('  {:<8} {:>6} p50 {:>8.2f}ms p90 {:>8.2f}ms p99 {:>8.2f}ms '
+              'max {:>8.2f}ms'.format(
+                  stage, stats['count'], stats['p50'] * 1000.0,
+                  stats['p90'] * 1000.0, stats['p99'] * 1000.0,
+                  stats['max'] * 1000.0))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Load generator for the order path')
+
+    parser.add_argument('--rate', default=20.0, type=float, required=False,
+                        action='store', help='Orders per second')
+
+    parser.add_argument('--seconds', default=10.0, type=float,
+                        required=False, action='store',
+                        help='Seconds to send orders')
+
+    parser.add_argument('--drain', default=2.0, type=float, required=False,
+                        action='store',
+                        help='Seconds to wait for the last orders')
+
+    parser.add_argument('--instruments', default=4, type=int,
+                        required=False, action='store',
+                        help='Count of instruments to trade (max 8)')
+
+    parser.add_argument('--market', default=6, type=int, required=False,
+                        action='store', help='Weight of market orders')
+
+    parser.add_argument('--limit', default=2, type=int, required=False,
+                        action='store', help='Weight of cancelled limit orders')
+
+    parser.add_argument('--bracket', default=2, type=int, required=False,
+                        action='store', help='Weight of bracket orders')
+
+    parser.add_argument('--cancel-after', default=0.5, type=float,
+                        required=False, action='store',
+                        help='Seconds until limit orders get cancelled')
+
+    parser.add_argument('--workers', default=4, type=int, required=False,
+                        action='store', help='Order workers of the store')
+
+    parser.add_argument('--request-rate', default=100, type=float,
+                        required=False, action='store',
+                        help='Request rate of the store, 0 for no limit')
+
+    parser.add_argument('--latency', default=0.0, type=float,
+                        required=False, action='store',
+                        help='Latency of the stand-in server')
+
+    parser.add_argument('--fill-latency', default=0.0, type=float,
+                        required=False, action='store',
+                        help='Seconds until the stand-in fills market orders')
+
+    parser.add_argument('--seed', default=None, type=int, required=False,
+                        action='store', help='Seed for the order mix')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+''' Benchmark of the candle period boundaries
+
+Reports the cost per time of ``OandaPeriods`` for all granularities of
+OANDA, for single times and for arrays of times. The boundaries are checked
+by ``tests/test_periods.py``:
+
+    python benchmarks/bench_periods.py --samples 20000
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import random
+import time as _time
+from datetime import datetime, timezone
+
+from btoandav20.stores import OandaV20Store
+from btoandav20.stores.oandaperiods import OandaPeriods
+
+
+def epoch(dt):
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def make_times(count, seed):
+    '''Returns random epoch times'''
+    rnd = random.Random(seed)
+    begin, end = epoch(datetime(1990, 1, 1)), epoch(datetime(2040, 1, 1))
+    return [rnd.uniform(begin, end) for _ in range(count)]
+
+
+def timeit(func, times):
+    tstart = _time.perf_counter_ns()
+    func(times)
+    return (_time.perf_counter_ns() - tstart) / len(times)
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    times = make_times(args.samples, args.seed)
+    results = []
+    for tf, comp in sorted(OandaV20Store._GRANULARITIES):
+        periods = OandaPeriods(tf, comp)
+        res = dict(granularity=OandaV20Store._GRANULARITIES[(tf, comp)])
+        res['period_ns'] = timeit(lambda x: list(map(periods.period, x)),
+                                  times)
+        res['start_offset_ns'] = timeit(
+            lambda x: [periods.start(ts, -1) for ts in x], times)
+        res['ends_ns'] = timeit(periods.ends, times)
+        results.append(res)
+        if not args.json:
+            print('{:<4} period {:>5.0f}ns, start with offset {:>5.0f}ns, '
+                  'ends {:>5.0f}ns per time'.format(
+                      res['granularity'], res['period_ns'],
+                      res['start_offset_ns'], res['ends_ns']))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the candle period boundaries')
+
+    parser.add_argument('--samples', default=20000, type=int,
+                        required=False, action='store',
+                        help='Random times per granularity')
+
+    parser.add_argument('--seed', default=0, type=int, required=False,
+                        action='store', help='Seed of the random times')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
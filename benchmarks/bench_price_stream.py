@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+''' Benchmark for the shared price stream of the store
+
+Replaces the price stream context of the store with a synthetic stream
+which produces pricing lines for all requested instruments and measures how
+many ticks per second are fanned out to the feed queues and how many threads
+are used to do so. A run fails if the ticks are not received within
+``--timeout`` seconds.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import sys
+import threading
+import time as _time
+
+import btoandav20
+
+
+StoreCls = btoandav20.stores.OandaV20Store
+
+
+class FakeStreamResponse(object):
+    '''Emulates ``v20.response.Response`` of a pricing stream'''
+
+    def __init__(self, ctx, instruments, ticks):
+        self.ctx = ctx
+        self.instruments = instruments.split(',')
+        self.ticks = ticks
+
+    def parts(self):
+        '''Yields the ticks, then heartbeats like a stream without prices
+        until the store reconnects'''
+        ts = 1600000000.0
+        for i in range(self.ticks):
+            instrument = self.instruments[i % len(self.instruments)]
+            line = json.dumps({
+                'type': 'PRICE',
+                'instrument': instrument,
+                'time': '{:.9f}'.format(ts + i * 0.001),
+                'tradeable': True,
+                'bids': [{'price': '1.10000', 'liquidity': 1000000}],
+                'asks': [{'price': '1.10010', 'liquidity': 1000000}],
+                'closeoutBid': '1.09990',
+                'closeoutAsk': '1.10020'})
+            # parse the line the same way v20 does it
+            yield ('pricing.ClientPrice',
+                   self.ctx.pricing.ClientPrice.from_dict(
+                       json.loads(line), self.ctx))
+        while True:
+            _time.sleep(0.01)
+            yield ('pricing.PricingHeartbeat', None)
+
+
+class FakeStreamContext(object):
+    '''Emulates the pricing endpoint of a ``v20.Context``'''
+
+    def __init__(self, ctx, ticks):
+        self.ctx = ctx
+        self.ticks = ticks
+        self.pricing = self
+        self.connections = 0
+
+    def stream(self, account, instruments):
+        self.connections += 1
+        return FakeStreamResponse(self.ctx, instruments, self.ticks)
+
+
+def run(store, count, ticks, timeout):
+    instruments = ['INST_{}'.format(i) for i in range(count)]
+    fake = FakeStreamContext(store._oapi_prices, ticks)
+    store._oapi_prices = fake
+
+    threads = threading.active_count()
+    tstart = _time.perf_counter()
+    queues = [store.streaming_prices(x) for x in instruments]
+    stream_threads = threading.active_count() - threads
+    received = 0
+    deadline = tstart + timeout
+    while received < ticks and _time.perf_counter() < deadline:
+        for q in queues:
+            while not q.empty():
+                msg = q.get()
+                if 'msg' in msg:
+                    continue
+                received += 1
+    tend = _time.perf_counter()
+
+    for q in queues:
+        store.streaming_prices_stop(q)
+    # the stream thread ends with the next heartbeat
+    while store._price_thread is not None and \
+            _time.perf_counter() < deadline + 1.0:
+        _time.sleep(0.01)
+    store._oapi_prices = fake.ctx
+    if received < ticks:
+        raise RuntimeError(
+            '{} of {} ticks received within {} seconds'.format(
+                received, ticks, timeout))
+
+    return dict(
+        instruments=count,
+        ticks=received,
+        seconds=tend - tstart,
+        ticks_per_sec=received / (tend - tstart),
+        stream_threads=max(stream_threads, 0),
+        connections=fake.connections,
+    )
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    store = StoreCls(token='', account='bench')
+    results = []
+    for count in args.instruments:
+        try:
+            res = run(store, count, args.ticks, args.timeout)
+        except RuntimeError as e:
+            print('{} instruments: {}'.format(count, e))
+            sys.exit(1)
+        results.append(res)
+        if not args.json:
+            print('{instruments:>4} instruments: {ticks_per_sec:>10.0f} '
+                  'ticks/sec, {stream_threads} stream thread(s), '
+                  '{connections} connection(s)'.format(**res))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the shared price stream of the store')
+
+    parser.add_argument('--ticks', default=100000, type=int,
+                        required=False, action='store',
+                        help='Number of ticks to stream per run')
+
+    parser.add_argument('--instruments', default=[1, 50], type=int,
+                        required=False, nargs='+',
+                        help='Number of subscribed instruments per run')
+
+    parser.add_argument('--timeout', default=60.0, type=float,
+                        required=False, action='store',
+                        help='Seconds to wait for the ticks of a run')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+''' Benchmark for the transaction processing of the store
+
+Drives ``OandaV20Store._transaction`` with synthetic transactions of
+orders which open a trade on fill and close it with a later order, without
+any connection to OANDA. The time per transaction and per cancel lookup is
+measured after every step of registered orders, with indexed lookups both
+stay constant while the session grows:
+
+    python benchmarks/bench_registry.py --orders 100000
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import time as _time
+
+import btoandav20
+
+
+StoreCls = btoandav20.stores.OandaV20Store
+
+
+class Params(object):
+    use_positions = False
+
+
+class Broker(object):
+    '''Receives the order notifications of the store'''
+
+    p = Params()
+
+    def __init__(self):
+        self.count = 0
+
+    def _notify(self, oref, *args, **kwargs):
+        self.count += 1
+
+    _accept = _fill = _cancel = _expire = _reject = _notify
+
+
+class Queue(object):
+    '''Stands in for the account queue of the store'''
+
+    def put(self, item):
+        pass
+
+
+def make_transactions(store, oref, tid):
+    '''Returns the transactions of an order opening a trade and of an order
+    closing it, tid is the first free transaction id'''
+    oid, close_oid = str(tid), str(tid + 2)
+    client_id = store._orders.new_client_id(oref)
+    close_client_id = store._orders.new_client_id(oref + 1)
+    return [
+        {'type': 'MARKET_ORDER', 'id': oid, 'instrument': 'EUR_USD',
+         'units': '100', 'clientExtensions': {'id': client_id}},
+        {'type': 'ORDER_FILL', 'id': str(tid + 1), 'orderID': oid,
+         'instrument': 'EUR_USD', 'units': '100', 'price': '1.1',
+         'reason': 'MARKET_ORDER', 'accountBalance': '100000.0',
+         'tradeOpened': {'tradeID': str(tid + 1), 'units': '100'}},
+        {'type': 'MARKET_ORDER', 'id': close_oid, 'instrument': 'EUR_USD',
+         'units': '-100', 'clientExtensions': {'id': close_client_id}},
+        {'type': 'ORDER_FILL', 'id': str(tid + 3), 'orderID': close_oid,
+         'instrument': 'EUR_USD', 'units': '-100', 'price': '1.1',
+         'reason': 'MARKET_ORDER', 'accountBalance': '100000.0',
+         'tradesClosed': [{'tradeID': str(tid + 1), 'units': '100'}]},
+    ]
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    store = StoreCls()
+    store.broker = Broker()
+    store.q_account = Queue()
+
+    results = []
+    oref, tid = 1, 1
+    steps = sorted(set(int(args.orders * x / args.steps)
+                       for x in range(1, args.steps + 1)))
+    for count in steps:
+        trans = []
+        while oref < count:
+            trans.extend(make_transactions(store, oref, tid))
+            oref += 2
+            tid += 4
+        # measure the last transactions of this step
+        batch = trans[-args.batch * 4:]
+        for t in trans[:-args.batch * 4]:
+            store._transaction(t)
+        tstart = _time.perf_counter()
+        for t in batch:
+            store._transaction(t)
+        trans_time = (_time.perf_counter() - tstart) / max(len(batch), 1)
+
+        lookups = range(max(1, oref - args.batch * 2), oref)
+        tstart = _time.perf_counter()
+        for x in lookups:
+            store._orders.oid(x)
+        lookup_time = (_time.perf_counter() - tstart) / len(lookups)
+
+        res = dict(orders=oref - 1, ids=len(store._orders),
+                   transaction_us=trans_time * 1e6,
+                   lookup_us=lookup_time * 1e6)
+        results.append(res)
+        if not args.json:
+            print('{:>8} orders: {:>6.2f}us per transaction, {:>6.3f}us per '
+                  'cancel lookup'.format(
+                      res['orders'], res['transaction_us'],
+                      res['lookup_us']))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the transaction processing of the store')
+
+    parser.add_argument('--orders', default=100000, type=int, required=False,
+                        action='store', help='Orders of the session')
+
+    parser.add_argument('--steps', default=5, type=int, required=False,
+                        action='store', help='Measurements during the session')
+
+    parser.add_argument('--batch', default=1000, type=int, required=False,
+                        action='store',
+                        help='Order pairs measured per step')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+''' Benchmark for the rest request scheduler of the store
+
+Runs a large concurrent candle download against the local stand-in server
+with a rate limit while orders and account requests are sent. For every
+request rate of the store the latency of the orders, the count of rate
+limited responses and the wait times per priority class are reported:
+
+    python benchmarks/bench_scheduler.py --rates 0 40
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import threading
+import time as _time
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+import btoandav20
+from btoandav20.stores.oandascheduler import OandaRequestScheduler
+
+from oandav20server import OandaV20Server
+
+
+StoreCls = btoandav20.stores.OandaV20Store
+
+
+def percentile(values, perc):
+    idx = min(len(values) - 1, int(round(perc / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def run(store, srv, rate, args):
+    store._scheduler = OandaRequestScheduler(rate=rate or None)
+    limited = srv.stats['rate_limited']
+    now = datetime.utcnow()
+    q = store.candles('EUR_USD', now - timedelta(days=args.days), now,
+                      bt.TimeFrame.Seconds, 5, 'ABM', columnar=True)
+    done = threading.Event()
+    latencies = []
+    statuses = []
+
+    def orders():
+        while not done.is_set():
+            tstart = _time.perf_counter()
+            response = store._rest(
+                'order', store.oapi.order.create, store.p.account,
+                order={'type': 'MARKET', 'instrument': 'EUR_USD',
+                       'units': '1'})
+            latencies.append(_time.perf_counter() - tstart)
+            statuses.append(response.status)
+            store._rest('account', store.oapi.account.summary,
+                        store.p.account)
+            _time.sleep(args.interval)
+
+    t = threading.Thread(target=orders)
+    t.start()
+    tstart = _time.perf_counter()
+    candles = 0
+    while True:
+        msg = q.get()
+        if not msg:
+            break
+        candles += len(msg)
+    seconds = _time.perf_counter() - tstart
+    done.set()
+    t.join()
+
+    latencies.sort()
+    return dict(
+        rate=rate,
+        candles=candles,
+        seconds=seconds,
+        orders=len(latencies),
+        orders_failed=sum(1 for x in statuses if x != 201),
+        order_latency=dict(
+            p50=percentile(latencies, 50),
+            p99=percentile(latencies, 99),
+            max=latencies[-1]),
+        rate_limited=srv.stats['rate_limited'] - limited,
+        classes=store.get_request_stats(),
+    )
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    srv = OandaV20Server(rate_limit=args.limit, latency=args.latency)
+    srv.start()
+    store = StoreCls(candles_workers=args.workers, candles_window=100,
+                     **srv.store_params())
+    results = []
+    try:
+        for rate in args.rates:
+            res = run(store, srv, rate, args)
+            results.append(res)
+            if not args.json:
+                print('rate {:>5}: {:>6} candles in {:>5.2f}s, orders p50 '
+                      '{:>6.1f}ms p99 {:>6.1f}ms, {} failed, {} rate '
+                      'limited'.format(
+                          rate or 'none', res['candles'], res['seconds'],
+                          res['order_latency']['p50'] * 1000.0,
+                          res['order_latency']['p99'] * 1000.0,
+                          res['orders_failed'], res['rate_limited']))
+                for prio, stats in res['classes'].items():
+                    if not stats['requests']:
+                        continue
+                    print('  {:<8} {:>5} requests, wait avg {:>7.1f}ms '
+                          'max {:>7.1f}ms'.format(
+                              prio, stats['requests'],
+                              stats['wait_avg'] * 1000.0,
+                              stats['wait_max'] * 1000.0))
+    finally:
+        srv.stop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the rest request scheduler of the store')
+
+    parser.add_argument('--rates', default=[0, 40], type=float, nargs='+',
+                        required=False,
+                        help='Request rates of the store, 0 for no limit')
+
+    parser.add_argument('--limit', default=50, type=float, required=False,
+                        action='store',
+                        help='Rate limit of the stand-in server')
+
+    parser.add_argument('--latency', default=0.005, type=float,
+                        required=False, action='store',
+                        help='Latency of the stand-in server')
+
+    parser.add_argument('--workers', default=8, type=int, required=False,
+                        action='store', help='Workers of the candle download')
+
+    parser.add_argument('--days', default=2, type=int, required=False,
+                        action='store', help='Days of S5 candles to download')
+
+    parser.add_argument('--interval', default=0.1, type=float,
+                        required=False, action='store',
+                        help='Seconds between orders')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
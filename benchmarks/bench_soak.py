@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+''' Soak test for the order bookkeeping of the broker and store
+
+Runs order lifecycles and reports the resident memory and the count of
+kept orders every ``--step`` lifecycles. A lifecycle opens a trade with a
+market order, closes it with a second market order and cancels a limit
+order. By default the transactions are generated in-process and passed to
+the store like the transaction stream would, with ``--server`` the orders
+are sent to the local stand-in server, which runs in the same process and
+keeps all transactions, so its memory is part of the reported memory:
+
+    python benchmarks/bench_soak.py --lifecycles 1000000
+    python benchmarks/bench_soak.py --lifecycles 1000000 --retention -1
+    python benchmarks/bench_soak.py --server --lifecycles 5000
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import gc
+import json
+import os
+import resource
+import time as _time
+
+import backtrader as bt
+from backtrader.utils.py3 import queue
+
+import btoandav20
+
+from oandav20server import OandaV20Server
+
+
+StoreCls = btoandav20.stores.OandaV20Store
+BrokerCls = btoandav20.brokers.OandaV20Broker
+
+
+class Data(bt.feeds.DataBase):
+    '''Data with one bar to create orders for'''
+
+    def _load(self):
+        return False
+
+
+class Queue(object):
+    '''Stands in for the account queue of the store'''
+
+    def put(self, item):
+        pass
+
+
+def rss():
+    '''Returns the resident memory of the process in bytes'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # max resident memory, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_data():
+    data = Data(dataname='EUR_USD')
+    data.setenvironment(bt.Cerebro())
+    data._start()
+    data.forward()
+    data.lines.datetime[0] = bt.date2num(bt.datetime.datetime.utcnow())
+    data.lines.close[0] = 1.1
+    data.contractdetails = {'name': 'EUR_USD', 'displayPrecision': 5,
+                            'pipLocation': -4}
+    return data
+
+
+class Local(object):
+    '''Creates the transactions of the orders of the broker in-process'''
+
+    def __init__(self, store, broker):
+        self.store = store
+        self.broker = broker
+        store.broker = broker
+        store.q_account = Queue()
+        store.q_ordercreate = queue.Queue()
+        store.q_orderclose = queue.Queue()
+        self.tid = 0
+        self.trade = None
+
+    def _id(self):
+        self.tid += 1
+        return str(self.tid)
+
+    def created(self):
+        '''Returns the create transaction of the last created order'''
+        oref, okwargs = self.store.q_ordercreate.get_nowait()
+        trans = {'type': okwargs['type'] + '_ORDER', 'id': self._id(),
+                 'instrument': okwargs['instrument'],
+                 'units': str(okwargs['units']),
+                 'clientExtensions': okwargs['clientExtensions']}
+        self.store._transaction(trans)
+        return trans
+
+    def fill(self, create):
+        trans = {'type': 'ORDER_FILL', 'id': self._id(),
+                 'orderID': create['id'], 'instrument': 'EUR_USD',
+                 'units': create['units'], 'price': '1.1',
+                 'reason': 'MARKET_ORDER', 'accountBalance': '100000.0'}
+        if self.trade is None:
+            self.trade = trans['id']
+            trans['tradeOpened'] = {'tradeID': trans['id'],
+                                    'units': create['units']}
+        else:
+            trans['tradesClosed'] = [{'tradeID': self.trade,
+                                      'units': create['units']}]
+            self.trade = None
+        self.store._transaction(trans)
+
+    def cancel(self, create):
+        self.store.q_orderclose.get_nowait()
+        self.store._transaction({
+            'type': 'ORDER_CANCEL', 'id': self._id(),
+            'orderID': create['id'], 'reason': 'CLIENT_REQUEST'})
+
+    def lifecycle(self, data):
+        self.broker.buy(None, data, 100, exectype=bt.Order.Market)
+        self.fill(self.created())
+        self.broker.sell(None, data, 100, exectype=bt.Order.Market)
+        self.fill(self.created())
+        order = self.broker.buy(None, data, 100, price=1.0,
+                                exectype=bt.Order.Limit)
+        create = self.created()
+        self.broker.cancel(order)
+        self.cancel(create)
+
+
+class Server(object):
+    '''Sends the orders of the broker to the stand-in server'''
+
+    timeout = 10.0
+
+    def __init__(self, store, broker, srv):
+        self.broker = broker
+        broker.start()
+        # orders sent before the transaction stream is connected are missed
+        tend = _time.monotonic() + self.timeout
+        while not srv._trans_subs and _time.monotonic() < tend:
+            _time.sleep(0.01)
+
+    def wait(self, order, status):
+        tend = _time.monotonic() + self.timeout
+        while order.status != status:
+            if _time.monotonic() > tend:
+                raise RuntimeError('order {} not {}'.format(
+                    order.ref, order.Status[status]))
+            _time.sleep(0.0005)
+
+    def lifecycle(self, data):
+        order = self.broker.buy(None, data, 100, exectype=bt.Order.Market)
+        self.wait(order, order.Completed)
+        order = self.broker.sell(None, data, 100, exectype=bt.Order.Market)
+        self.wait(order, order.Completed)
+        order = self.broker.buy(None, data, 100, price=1.0,
+                                exectype=bt.Order.Limit)
+        self.wait(order, order.Accepted)
+        self.broker.cancel(order)
+        self.wait(order, order.Cancelled)
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    kwargs = dict(
+        order_retention=None if args.retention < 0 else args.retention,
+        order_archive=args.archive)
+    srv = None
+    if args.server:
+        srv = OandaV20Server(heartbeat=1.0)
+        srv.start()
+        kwargs.update(srv.store_params())
+    broker = BrokerCls(use_positions=False, **kwargs)
+    store = broker.o
+    data = make_data()
+    if srv is not None:
+        runner = Server(store, broker, srv)
+    else:
+        runner = Local(store, broker)
+
+    results = []
+    tstart = _time.perf_counter()
+    try:
+        for i in range(1, args.lifecycles + 1):
+            runner.lifecycle(data)
+            # notifications are consumed by cerebro on every next
+            broker.notifs.clear()
+            store.notifs.clear()
+            if i % args.step and i != args.lifecycles:
+                continue
+            gc.collect()
+            res = dict(lifecycles=i,
+                       seconds=_time.perf_counter() - tstart,
+                       rss=rss(),
+                       orders=len(broker.orders),
+                       brackets=len(broker.brackets),
+                       ids=len(store._orders))
+            results.append(res)
+            if not args.json:
+                print('{:>9} lifecycles {:>8.1f}s: rss {:>7.1f}MB, {:>8} '
+                      'orders, {:>8} ids'.format(
+                          i, res['seconds'], res['rss'] / 1024.0 ** 2,
+                          res['orders'], res['ids']))
+    finally:
+        if srv is not None:
+            broker.stop()
+            srv.stop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Soak test for the order bookkeeping')
+
+    parser.add_argument('--lifecycles', default=1000000, type=int,
+                        required=False, action='store',
+                        help='Order lifecycles to run')
+
+    parser.add_argument('--step', default=100000, type=int, required=False,
+                        action='store', help='Lifecycles between reports')
+
+    parser.add_argument('--retention', default=1000, type=int,
+                        required=False, action='store',
+                        help='Done orders kept, -1 keeps all')
+
+    parser.add_argument('--archive', default=None, required=False,
+                        action='store', help='File to archive orders to')
+
+    parser.add_argument('--server', required=False, action='store_true',
+                        help='Send the orders to the stand-in server')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
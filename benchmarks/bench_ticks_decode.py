@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+''' Benchmark for the loading of ticks
+
+Compares the generic ``OandaV20Data._load_tick``, which resolves the price
+side and the lines and converts the time with ``datetime`` per tick, to the
+loader specialized for the params of the feed at ``start``. The cost per
+tick is measured for the loader alone and for ``load`` of the feed, the
+loaded lines of both are compared. The arithmetic num dates may differ from
+``date2num`` by the resolution of a num date (about 10us):
+
+    python benchmarks/bench_ticks_decode.py --ticks 50000
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import time as _time
+
+import backtrader as bt
+
+import btoandav20
+
+from bench_feed import VARIANTS, drive, make_feed, make_ticks
+
+
+DataCls = btoandav20.feeds.OandaV20Data
+
+LINES = ('datetime', 'open', 'high', 'low', 'close', 'volume',
+         'openinterest', 'mid_close', 'bid_close', 'ask_close')
+
+
+def make_data(variant, ticks, generic):
+    data = make_feed('live_ticks', variant, False, ticks)
+    if generic:
+        del data._load_tick  # use the method of the class
+    return data
+
+
+def time_loader(variant, ticks, generic):
+    '''Returns ns per tick of the loader alone, the lines are extended
+    beforehand and only advanced for the ticks'''
+    data = make_data(variant, [], generic)
+    data.forward(size=len(ticks))
+    load_tick = data._load_tick
+    advance = data.lines.advance
+    perf = _time.perf_counter_ns
+    data.lines.home()
+    t0 = perf()
+    for msg in ticks:
+        advance()
+    tadvance = perf() - t0
+    data.lines.home()
+    t0 = perf()
+    for msg in ticks:
+        advance()
+        load_tick(msg)
+    return (perf() - t0 - tadvance) / len(ticks)
+
+
+def time_load(variant, ticks, generic):
+    '''Returns ns per tick of ``load`` of the feed and the loaded data'''
+    data = make_data(variant, ticks, generic)
+    perf = _time.perf_counter_ns
+    t0 = perf()
+    drive(data, len(ticks))
+    return (perf() - t0) / len(ticks), data
+
+
+def lines_of(data):
+    return dict((x, list(getattr(data.lines, x).array)) for x in LINES)
+
+
+def dates_differing(a, b):
+    '''Returns the count of datetimes not converting to the same datetime'''
+    return sum(bt.num2date(x) != bt.num2date(y) for x, y in zip(a, b))
+
+
+def runbench(args=None):
+    args = parse_args(args)
+    ticks = make_ticks(args.ticks)
+    results = []
+    for variant in VARIANTS:
+        res = dict(variant=variant, ticks=args.ticks)
+        for name, generic in (('generic', True), ('specialized', False)):
+            res[name] = dict(
+                loader_ns=min(time_loader(variant, ticks, generic)
+                              for _ in range(args.repeat)))
+            runs = [time_load(variant, ticks, generic)
+                    for _ in range(args.repeat)]
+            res[name]['load_ns'] = min(x[0] for x in runs)
+            res[name]['lines'] = lines_of(runs[0][1])
+        generic, special = res['generic'].pop('lines'), \
+            res['specialized'].pop('lines')
+        res['prices_equal'] = all(generic[x] == special[x]
+                                  for x in LINES if x != 'datetime')
+        res['dates_differing'] = dates_differing(
+            generic['datetime'], special['datetime'])
+        res['max_date_diff_us'] = max(
+            abs(x - y) for x, y in zip(generic['datetime'],
+                                       special['datetime'])) * 86400e6
+        res['speedup'] = res['generic']['loader_ns'] / \
+            res['specialized']['loader_ns']
+        results.append(res)
+        if not args.json:
+            print('{:<4} loader {:>6.0f}ns -> {:>5.0f}ns ({:.1f}x), load '
+                  '{:>6.0f}ns -> {:>5.0f}ns, prices equal {}, dates differing '
+                  '{} (max {:.1f}us)'.format(
+                      variant, res['generic']['loader_ns'],
+                      res['specialized']['loader_ns'], res['speedup'],
+                      res['generic']['load_ns'],
+                      res['specialized']['load_ns'], res['prices_equal'],
+                      res['dates_differing'], res['max_date_diff_us']))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the loading of ticks')
+
+    parser.add_argument('--ticks', default=50000, type=int, required=False,
+                        action='store', help='Ticks to load')
+
+    parser.add_argument('--repeat', default=3, type=int, required=False,
+                        action='store', help='Runs, the fastest is reported')
+
+    parser.add_argument('--json', required=False, action='store_true',
+                        help='Print results as json')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runbench()
@@ -0,0 +1,1128 @@
+#!/usr/bin/env python
+
+''' Local stand-in for the OANDA v20 api
+
+Implements the endpoints used by ``OandaV20Store`` so the store, feed and
+broker can be exercised offline, ex. for load and latency tests. The server
+runs in-process in its own threads and serves rest and stream requests on
+the same port.
+
+    server = OandaV20Server(tick_rate=10, fill_latency=0.05)
+    server.start()
+    store = OandaV20Store(**server.store_params())
+    ...
+    server.stop()
+
+Prices are a random walk per instrument, candles are generated in a
+deterministic way from the instrument and the candle time, so repeated
+requests return the same candles. Any instrument name requested will be
+created on demand.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import math
+import queue
+import random
+import re
+import threading
+import time as _time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# candle granularities in seconds (months are approximated by 30 days)
+GRANULARITIES = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M3': 180, 'M4': 240, 'M5': 300, 'M10': 600,
+    'M15': 900, 'M30': 1800, 'H1': 3600, 'H2': 7200, 'H3': 10800,
+    'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200, 'D': 86400,
+    'W': 604800, 'M': 2592000,
+}
+
+# default instruments with start price and pip location
+INSTRUMENTS = {
+    'EUR_USD': (1.1000, -4),
+    'GBP_USD': (1.3000, -4),
+    'AUD_USD': (0.7000, -4),
+    'NZD_USD': (0.6500, -4),
+    'USD_CAD': (1.3000, -4),
+    'USD_CHF': (0.9500, -4),
+    'USD_JPY': (110.00, -2),
+    'EUR_GBP': (0.8500, -4),
+    'EUR_JPY': (121.00, -2),
+    'GBP_JPY': (143.00, -2),
+}
+
+# order types which are created with a trade
+TRADE_ORDERS = ('TAKE_PROFIT', 'STOP_LOSS', 'TRAILING_STOP_LOSS')
+
+
+class Instrument(object):
+    '''Price state of one instrument'''
+
+    def __init__(self, name, price=1.0, pip_location=-4):
+        self.name = name
+        self.pip_location = pip_location
+        self.precision = -pip_location + 1
+        self.pip = 10 ** pip_location
+        self.mid = price
+        self.spread = self.pip * 1.2
+        self.time = _time.time()
+
+    @property
+    def bid(self):
+        return round(self.mid - self.spread / 2, self.precision)
+
+    @property
+    def ask(self):
+        return round(self.mid + self.spread / 2, self.precision)
+
+    def walk(self, rnd):
+        self.mid = max(self.pip, self.mid + rnd.gauss(0, self.pip))
+        self.time = _time.time()
+
+
+class OandaV20Server(object):
+    '''Stand-in server for the OANDA v20 rest and stream api
+
+    Params:
+
+      - ``host`` (default: ``127.0.0.1``): host to bind to
+
+      - ``port`` (default: ``0``): port to bind to, ``0`` picks a free port
+
+      - ``account`` (default: ``101-000-0000000-001``): account id
+
+      - ``currency`` (default: ``USD``): account currency
+
+      - ``balance`` (default: ``100000.0``): starting balance
+
+      - ``margin_rate`` (default: ``0.02``): margin rate of the account
+
+      - ``tick_rate`` (default: ``4.0``): price updates per second and
+        instrument
+
+      - ``heartbeat`` (default: ``5.0``): seconds between heartbeats of
+        streams
+
+      - ``latency`` (default: ``0.0``): seconds to delay rest responses
+
+      - ``fill_latency`` (default: ``0.0``): seconds between accepting and
+        filling a market order
+
+      - ``error_rate`` (default: ``0.0``): probability of a rest request to
+        fail with ``error_status``
+
+      - ``error_status`` (default: ``503``): http status of injected errors
+
+      - ``rate_limit`` (default: ``None``): rest requests per second, more
+        requests fail with status 429 like on OANDA, ``None`` for no limit
+
+      - ``stream_drop`` (default: ``None``): seconds after which streams get
+        disconnected, ``None`` keeps them open
+
+      - ``seed`` (default: ``None``): seed for the random walk and errors
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0,
+                 account='101-000-0000000-001', currency='USD',
+                 balance=100000.0, margin_rate=0.02, tick_rate=4.0,
+                 heartbeat=5.0, latency=0.0, fill_latency=0.0,
+                 error_rate=0.0, error_status=503, rate_limit=None,
+                 stream_drop=None, seed=None):
+        self.host = host
+        self.port = port
+        self.account = account
+        self.currency = currency
+        self.balance = balance
+        self.margin_rate = margin_rate
+        self.tick_rate = tick_rate
+        self.heartbeat = heartbeat
+        self.latency = latency
+        self.fill_latency = fill_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.stream_drop = stream_drop
+        self._requests = collections.deque()  # times of the last requests
+
+        self._rnd = random.Random(seed)
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._running = False
+        self._httpd = None
+
+        self.instruments = dict()
+        for name, (price, pip_location) in INSTRUMENTS.items():
+            self.instruments[name] = Instrument(name, price, pip_location)
+
+        self.transactions = list()  # all transactions, index is id - 1
+        self.orders = dict()  # pending orders by order id
+        self.client_orders = dict()  # order ids by client id
+        self.trades = collections.defaultdict(list)  # open trades by inst
+        self._schedule = list()  # heap of (due time, seq, callable)
+        self._seq = itertools.count()
+
+        self._price_subs = list()  # (instruments, queue) of price streams
+        self._trans_subs = list()  # queues of transaction streams
+
+        self.stats = collections.Counter()  # request counters
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def store_params(self):
+        '''Returns the params to connect a ``OandaV20Store`` to the server'''
+        return dict(
+            token='stand-in',
+            account=self.account,
+            oapi_url=self.url,
+            oapi_stream_url=self.url)
+
+    def start(self):
+        handler = type(str('Handler'), (V20RequestHandler,), {'server_': self})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._running = True
+        for target in (self._httpd.serve_forever, self._t_engine):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for _, q in self._price_subs:
+            q.put(None)
+        for q in self._trans_subs:
+            q.put(None)
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def rate_limited(self):
+        '''Counts a rest request, returns ``True`` if the rate limit of the
+        last second is exceeded'''
+        now = _time.monotonic()
+        with self._lock:
+            while self._requests and self._requests[0] <= now - 1.0:
+                self._requests.popleft()
+            if len(self._requests) >= self.rate_limit:
+                return True
+            self._requests.append(now)
+            return False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------------------------------------------------------------------
+    # prices and candles
+
+    def get_instrument(self, name):
+        with self._lock:
+            inst = self.instruments.get(name)
+            if inst is None:
+                inst = Instrument(name)
+                self.instruments[name] = inst
+            return inst
+
+    def client_price(self, inst, timefmt):
+        factor = self.home_factor(inst.name.partition('_')[2]) or 1.0
+        return {
+            'type': 'PRICE',
+            'instrument': inst.name,
+            'time': timefmt(inst.time),
+            'tradeable': True,
+            'bids': [{'price': '{:.{}f}'.format(inst.bid, inst.precision),
+                      'liquidity': 10000000}],
+            'asks': [{'price': '{:.{}f}'.format(inst.ask, inst.precision),
+                      'liquidity': 10000000}],
+            'closeoutBid': '{:.{}f}'.format(inst.bid, inst.precision),
+            'closeoutAsk': '{:.{}f}'.format(inst.ask, inst.precision),
+            'quoteHomeConversionFactors': {
+                'positiveUnits': '{:.8f}'.format(factor),
+                'negativeUnits': '{:.8f}'.format(factor),
+            },
+        }
+
+    def home_factor(self, currency):
+        '''Returns the factor converting the currency into the account
+        currency, crosses are converted over one other currency'''
+        def direct(src, dst):
+            if src == dst:
+                return 1.0
+            inst = self.instruments.get(src + '_' + dst)
+            if inst is not None:
+                return inst.mid
+            inst = self.instruments.get(dst + '_' + src)
+            if inst is not None:
+                return 1.0 / inst.mid
+            return None
+
+        factor = direct(currency, self.currency)
+        if factor is not None:
+            return factor
+        for name in list(self.instruments):
+            for other in name.split('_'):
+                first = direct(currency, other)
+                second = direct(other, self.currency)
+                if first is not None and second is not None:
+                    return first * second
+        return None
+
+    def home_conversions(self):
+        currencies = set([self.currency])
+        for name in list(self.instruments):
+            currencies.update(name.split('_'))
+        res = []
+        for currency in sorted(currencies):
+            factor = self.home_factor(currency)
+            if factor is None:
+                continue
+            res.append({'currency': currency,
+                        'accountGain': '{:.8f}'.format(factor),
+                        'accountLoss': '{:.8f}'.format(factor),
+                        'positionValue': '{:.8f}'.format(factor)})
+        return res
+
+    def candle(self, inst, granularity, t, price, timefmt, now):
+        '''Returns a deterministic candle of the instrument at time t'''
+        secs = GRANULARITIES[granularity]
+        seed = zlib.crc32('{}{}{}'.format(inst.name, granularity, t).encode())
+        rnd = random.Random(seed)
+        base = INSTRUMENTS.get(inst.name, (1.0, -4))[0]
+        pip = inst.pip
+        o = base * (1 + 0.02 * math.sin(t / 86400.0)) + rnd.gauss(0, pip)
+        c = o + rnd.gauss(0, pip * 5)
+        h = max(o, c) + abs(rnd.gauss(0, pip * 2))
+        lo = min(o, c) - abs(rnd.gauss(0, pip * 2))
+        candle = {
+            'time': timefmt(t),
+            'volume': rnd.randint(1, 500),
+            'complete': t + secs <= now,
+        }
+        spread = inst.spread / 2
+        for key, side, adj in (('M', 'mid', 0), ('B', 'bid', -spread),
+                               ('A', 'ask', spread)):
+            if key in price:
+                candle[side] = {
+                    x: '{:.{}f}'.format(v + adj, inst.precision)
+                    for x, v in (('o', o), ('h', h), ('l', lo), ('c', c))}
+        return candle
+
+    def candles(self, name, params, timefmt):
+        inst = self.get_instrument(name)
+        granularity = params.get('granularity', 'S5')
+        if granularity not in GRANULARITIES:
+            return 400, {'errorMessage': 'Invalid granularity'}
+        secs = GRANULARITIES[granularity]
+        price = params.get('price', 'M')
+        count = int(params.get('count', 500))
+        now = _time.time()
+        dtfrom = parse_time(params.get('from'))
+        dtto = parse_time(params.get('to'))
+        if dtfrom is not None and dtto is not None:
+            # count is ignored when using from and to
+            count = 5000
+            if (dtto - dtfrom) / secs > count:
+                return 400, {'errorMessage': 'Maximum value for count is '
+                                             'exceeded'}
+        if count > 5000:
+            return 400, {'errorMessage': 'Maximum value for count is 5000'}
+        include_first = params.get('includeFirst', 'true').lower() != 'false'
+        if dtfrom is None:
+            end = dtto if dtto is not None else now
+            start = (int(end) // secs - count + 1) * secs
+        else:
+            start = int(math.ceil(dtfrom / secs)) * secs
+            if not include_first and start == dtfrom:
+                start += secs
+        end = min(dtto if dtto is not None else now, now)
+        candles = []
+        t = start
+        while t <= end and len(candles) < count:
+            candles.append(self.candle(inst, granularity, t, price, timefmt,
+                                       now))
+            t += secs
+        return 200, {'instrument': name, 'granularity': granularity,
+                     'candles': candles}
+
+    def latest_candles(self, params, timefmt):
+        '''Returns the current and the last complete candles of every
+        instrument:granularity:price specification'''
+        res = []
+        for spec in params.get('candleSpecifications', '').split(','):
+            if not spec:
+                continue
+            name, _, rest = spec.partition(':')
+            granularity, _, price = rest.partition(':')
+            status, body = self.candles(
+                name, dict(granularity=granularity, price=price or 'M',
+                           count=params.get('units', 2)), timefmt)
+            if status != 200:
+                return status, body
+            res.append(body)
+        return 200, {'latestCandles': res}
+
+    # ---------------------------------------------------------------------
+    # engine
+
+    def schedule(self, delay, func):
+        with self._cond:
+            heapq.heappush(self._schedule,
+                           (_time.time() + delay, next(self._seq), func))
+            self._cond.notify_all()
+
+    def _t_engine(self):
+        '''Moves prices, runs scheduled actions and triggers orders'''
+        interval = 1.0 / self.tick_rate if self.tick_rate > 0 else None
+        nexttick = _time.time()
+        with self._cond:
+            while self._running:
+                now = _time.time()
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, _, func = heapq.heappop(self._schedule)
+                    func()
+                if interval is not None and now >= nexttick:
+                    self._tick()
+                    nexttick = max(nexttick + interval, now)
+                waits = [self._schedule[0][0] - now] if self._schedule else []
+                if interval is not None:
+                    waits.append(nexttick - now)
+                self._cond.wait(max(0, min(waits)) if waits else None)
+
+    def _tick(self):
+        instruments = set()
+        for names, _ in self._price_subs:
+            instruments.update(names)
+        for name in instruments:
+            inst = self.get_instrument(name)
+            inst.walk(self._rnd)
+            for names, q in self._price_subs:
+                if name in names:
+                    q.put(inst)
+        self._check_orders()
+
+    # ---------------------------------------------------------------------
+    # account, orders and transactions
+
+    def _add_transaction(self, trans):
+        trans['id'] = str(len(self.transactions) + 1)
+        trans['accountID'] = self.account
+        trans['time'] = _time.time()
+        trans.setdefault('batchID', trans['id'])
+        self.transactions.append(trans)
+        for q in self._trans_subs:
+            q.put(trans)
+        return trans
+
+    @property
+    def last_transaction_id(self):
+        return str(len(self.transactions))
+
+    def summary(self):
+        with self._lock:
+            margin_used = 0.0
+            upl = 0.0
+            for name, trades in self.trades.items():
+                inst = self.get_instrument(name)
+                for t in trades:
+                    margin_used += abs(t['units']) * inst.mid * \
+                        self.margin_rate
+                    upl += (inst.mid - t['price']) * t['units']
+            return {
+                'id': self.account,
+                'alias': 'stand-in',
+                'currency': self.currency,
+                'balance': '{:.4f}'.format(self.balance),
+                'NAV': '{:.4f}'.format(self.balance + upl),
+                'unrealizedPL': '{:.4f}'.format(upl),
+                'marginRate': str(self.margin_rate),
+                'marginUsed': '{:.4f}'.format(margin_used),
+                'marginAvailable': '{:.4f}'.format(
+                    self.balance + upl - margin_used),
+                'openTradeCount': sum(len(x) for x in self.trades.values()),
+                'openPositionCount': len(
+                    [x for x in self.trades.values() if x]),
+                'pendingOrderCount': len(self.orders),
+                'lastTransactionID': self.last_transaction_id,
+            }
+
+    def positions(self, names=None):
+        '''Returns the open positions or the positions of names, including
+        closed ones'''
+        with self._lock:
+            positions = []
+            for name in sorted(self.trades) if names is None else names:
+                trades = self.trades.get(name)
+                if not trades and names is None:
+                    continue
+                positions.append(self._position(name, trades or []))
+            return positions
+
+    def _position(self, name, trades):
+        units = sum(t['units'] for t in trades)
+        empty = {'units': '0', 'averagePrice': '0'}
+        side = empty
+        if units:
+            avg = sum(t['units'] * t['price'] for t in trades) / units
+            side = {'units': str(units), 'averagePrice': str(avg),
+                    'tradeIDs': [t['id'] for t in trades]}
+        return {
+            'instrument': name,
+            'long': side if units > 0 else empty,
+            'short': side if units < 0 else empty,
+        }
+
+    def changes(self, since):
+        '''Returns the changes of the account since a transaction id'''
+        with self._lock:
+            trans = self.transactions[since:]
+            names = sorted(set(t['instrument'] for t in trans
+                               if t['type'] == 'ORDER_FILL'))
+            summary = self.summary()
+            state = {k: summary[k] for k in (
+                'NAV', 'unrealizedPL', 'marginUsed', 'marginAvailable')}
+            changes = {
+                'ordersCreated': [], 'ordersCancelled': [],
+                'ordersFilled': [], 'ordersTriggered': [],
+                'tradesOpened': [], 'tradesReduced': [], 'tradesClosed': [],
+                'positions': self.positions(names),
+                'transactions': trans,
+            }
+            return changes, state
+
+    def instrument_details(self, names):
+        details = []
+        for name in names:
+            inst = self.get_instrument(name)
+            details.append({
+                'name': name,
+                'type': 'CURRENCY',
+                'displayName': name.replace('_', '/'),
+                'pipLocation': inst.pip_location,
+                'displayPrecision': inst.precision,
+                'tradeUnitsPrecision': 0,
+                'minimumTradeSize': '1',
+                'maximumTrailingStopDistance': '1.00000',
+                'minimumTrailingStopDistance': '0.00050',
+                'maximumPositionSize': '0',
+                'maximumOrderUnits': '100000000',
+                'marginRate': str(self.margin_rate),
+            })
+        return details
+
+    def find_order(self, spec):
+        if spec.startswith('@'):
+            spec = self.client_orders.get(spec[1:])
+        return self.orders.get(spec)
+
+    def create_order(self, spec, replaces=None):
+        '''Creates a order, returns status and response body'''
+        with self._lock:
+            otype = spec.get('type', 'MARKET')
+            ttype = '{}_ORDER'.format(otype)
+            try:
+                if otype in TRADE_ORDERS:
+                    units = 0.0
+                else:
+                    units = float(spec['units'])
+                    if not units:
+                        raise ValueError('units')
+                price = spec.get('price')
+                if otype not in ('MARKET', 'TRAILING_STOP_LOSS'):
+                    price = float(price)
+            except (KeyError, TypeError, ValueError):
+                trans = self._add_transaction({
+                    'type': '{}_REJECT'.format(ttype),
+                    'instrument': spec.get('instrument'),
+                    'units': str(spec.get('units')),
+                    'rejectReason': 'BAD_REQUEST'})
+                return 400, {'orderRejectTransaction': trans,
+                             'lastTransactionID': self.last_transaction_id,
+                             'errorMessage': 'Invalid order'}
+            trans = {
+                'type': ttype,
+                'instrument': spec.get('instrument'),
+                'units': str(int(units)),
+                'timeInForce': spec.get(
+                    'timeInForce', 'FOK' if otype == 'MARKET' else 'GTC'),
+                'reason': 'CLIENT_ORDER',
+            }
+            if replaces is not None:
+                trans['replacesOrderID'] = replaces
+                trans['reason'] = 'REPLACEMENT'
+            for key in ('price', 'distance', 'tradeID', 'gtdTime',
+                        'clientExtensions', 'stopLossOnFill',
+                        'takeProfitOnFill', 'trailingStopLossOnFill'):
+                if spec.get(key) is not None:
+                    trans[key] = spec[key]
+            if otype in TRADE_ORDERS:
+                trade = self._find_trade(trans.get('tradeID'))
+                if trade is None:
+                    return 404, {'errorMessage': 'Trade not found'}
+                trans['instrument'] = trade['instrument']
+            trans = self._add_transaction(trans)
+            self._add_order(trans)
+            if otype == 'MARKET':
+                self.schedule(self.fill_latency,
+                              lambda: self._fill_market(trans['id']))
+            return 201, {'orderCreateTransaction': trans,
+                         'relatedTransactionIDs': [trans['id']],
+                         'lastTransactionID': self.last_transaction_id}
+
+    def _add_order(self, trans):
+        order = dict(trans)
+        order['units'] = float(trans['units'])
+        if 'price' in trans:
+            order['price'] = float(trans['price'])
+        if order['type'] == 'TRAILING_STOP_LOSS_ORDER':
+            order['distance'] = float(trans['distance'])
+        self.orders[trans['id']] = order
+        if 'clientExtensions' in trans:
+            self.client_orders[trans['clientExtensions']['id']] = trans['id']
+        return order
+
+    def _remove_order(self, oid):
+        order = self.orders.pop(oid, None)
+        if order is not None and 'clientExtensions' in order:
+            self.client_orders.pop(order['clientExtensions']['id'], None)
+        return order
+
+    def replace_order(self, spec_id, spec):
+        with self._lock:
+            order = self.find_order(spec_id)
+            if order is None:
+                return 404, {'errorMessage': 'Order not found'}
+            cancel = self._cancel_order(order['id'],
+                                        'CLIENT_REQUEST_REPLACED')
+            status, body = self.create_order(spec, replaces=order['id'])
+            body['orderCancelTransaction'] = cancel
+            return status, body
+
+    def cancel_order(self, spec_id):
+        with self._lock:
+            order = self.find_order(spec_id)
+            if order is None:
+                return 404, {'errorMessage': 'Order not found',
+                             'lastTransactionID': self.last_transaction_id}
+            cancel = self._cancel_order(order['id'], 'CLIENT_REQUEST')
+            return 200, {'orderCancelTransaction': cancel,
+                         'relatedTransactionIDs': [cancel['id']],
+                         'lastTransactionID': self.last_transaction_id}
+
+    def _cancel_order(self, oid, reason):
+        self._remove_order(oid)
+        return self._add_transaction({
+            'type': 'ORDER_CANCEL', 'orderID': oid, 'reason': reason})
+
+    def _find_trade(self, trade_id):
+        for trades in self.trades.values():
+            for t in trades:
+                if t['id'] == trade_id:
+                    return t
+        return None
+
+    def _fill_market(self, oid):
+        order = self.orders.get(oid)
+        if order is None:
+            return
+        inst = self.get_instrument(order['instrument'])
+        price = inst.ask if order['units'] > 0 else inst.bid
+        self._fill(order, price, 'MARKET_ORDER')
+
+    def _check_orders(self):
+        for order in list(self.orders.values()):
+            if order['id'] not in self.orders:
+                continue  # removed while checking
+            otype = order['type']
+            if otype == 'MARKET_ORDER':
+                continue
+            inst = self.get_instrument(order['instrument'])
+            units = order['units']
+            if otype in ('STOP_LOSS_ORDER', 'TAKE_PROFIT_ORDER',
+                         'TRAILING_STOP_LOSS_ORDER'):
+                trade = self._find_trade(order['tradeID'])
+                if trade is None:
+                    self._cancel_order(order['id'], 'LINKED_TRADE_CLOSED')
+                    continue
+                units = -trade['units']
+            buy = units > 0
+            current = inst.ask if buy else inst.bid
+            if otype == 'TRAILING_STOP_LOSS_ORDER':
+                trigger = current + order['distance'] if buy else \
+                    current - order['distance']
+                if 'price' not in order:
+                    order['price'] = trigger
+                elif buy:
+                    order['price'] = min(order['price'], trigger)
+                else:
+                    order['price'] = max(order['price'], trigger)
+            price = order['price']
+            if otype in ('LIMIT_ORDER', 'TAKE_PROFIT_ORDER'):
+                triggered = current <= price if buy else current >= price
+            else:
+                triggered = current >= price if buy else current <= price
+            if triggered:
+                order['units'] = units
+                self._fill(order, current, otype)
+
+    def _fill(self, order, price, reason):
+        self._remove_order(order['id'])
+        name = order['instrument']
+        units = order['units']
+        trans = {
+            'type': 'ORDER_FILL',
+            'orderID': order['id'],
+            'instrument': name,
+            'units': str(int(units)),
+            'price': str(price),
+            'fullVWAP': str(price),
+            'reason': reason,
+        }
+        if 'clientExtensions' in order:
+            trans['clientOrderID'] = order['clientExtensions']['id']
+        trades = self.trades[name]
+        if order.get('tradeID') is not None:
+            # orders of a trade close the trade itself first
+            trades.sort(key=lambda t: t['id'] != order['tradeID'])
+        closed = []
+        pl = 0.0
+        remaining = units
+        while remaining and trades and (trades[0]['units'] > 0) != \
+                (remaining > 0):
+            t = trades[0]
+            if abs(t['units']) <= abs(remaining):
+                tpl = (price - t['price']) * t['units']
+                closed.append({'tradeID': t['id'],
+                               'units': str(int(-t['units'])),
+                               'price': str(price),
+                               'realizedPL': str(tpl)})
+                remaining += t['units']
+                pl += tpl
+                trades.pop(0)
+            else:
+                tpl = (price - t['price']) * -remaining
+                trans['tradeReduced'] = {'tradeID': t['id'],
+                                         'units': str(int(remaining)),
+                                         'price': str(price),
+                                         'realizedPL': str(tpl)}
+                t['units'] += remaining
+                pl += tpl
+                remaining = 0
+        if closed:
+            trans['tradesClosed'] = closed
+        self.balance += pl
+        trans['pl'] = str(pl)
+        trans['accountBalance'] = str(self.balance)
+        trade = None
+        if remaining:
+            # the trade id matches the id of the fill transaction
+            trade = {'id': str(len(self.transactions) + 1),
+                     'instrument': name, 'units': remaining, 'price': price}
+            trans['tradeOpened'] = {'tradeID': trade['id'],
+                                    'units': str(int(remaining)),
+                                    'price': str(price)}
+        self._add_transaction(trans)
+        if trade is not None:
+            trades.append(trade)
+            self._add_dependent(trade, order)
+        for t in closed:
+            self._cancel_dependent(t['tradeID'])
+
+    def _add_dependent(self, trade, order):
+        '''Creates the orders on fill of a trade'''
+        for key, otype in (('takeProfitOnFill', 'TAKE_PROFIT'),
+                           ('stopLossOnFill', 'STOP_LOSS'),
+                           ('trailingStopLossOnFill', 'TRAILING_STOP_LOSS')):
+            details = order.get(key)
+            if not details:
+                continue
+            dep = {
+                'type': '{}_ORDER'.format(otype),
+                'instrument': trade['instrument'],
+                'tradeID': trade['id'],
+                'units': '0',
+                'timeInForce': 'GTC',
+                'reason': 'ON_FILL',
+            }
+            for x in ('price', 'distance', 'clientExtensions'):
+                if details.get(x) is not None:
+                    dep[x] = details[x]
+            dep = self._add_transaction(dep)
+            self._add_order(dep)
+
+    def _cancel_dependent(self, trade_id):
+        for order in list(self.orders.values()):
+            if order.get('tradeID') == trade_id:
+                self._cancel_order(order['id'], 'LINKED_TRADE_CLOSED')
+
+    def transactions_range(self, from_id, to_id):
+        with self._lock:
+            return self.transactions[max(0, from_id - 1):to_id]
+
+    # ---------------------------------------------------------------------
+    # streams
+
+    def subscribe_prices(self, names):
+        q = queue.Queue()
+        with self._lock:
+            for name in names:
+                self.get_instrument(name)
+            self._price_subs.append((frozenset(names), q))
+        return q
+
+    def unsubscribe_prices(self, q):
+        with self._lock:
+            self._price_subs = [x for x in self._price_subs if x[1] is not q]
+
+    def subscribe_transactions(self):
+        q = queue.Queue()
+        with self._lock:
+            self._trans_subs.append(q)
+        return q
+
+    def unsubscribe_transactions(self, q):
+        with self._lock:
+            self._trans_subs = [x for x in self._trans_subs if x is not q]
+
+
+def parse_time(value):
+    '''Parses a UNIX or RFC3339 time param to epoch seconds'''
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    date, _, frac = value.rstrip('Z').partition('.')
+    dt = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    return dt.replace(tzinfo=timezone.utc).timestamp() + \
+        float('0.{}'.format(frac or '0'))
+
+
+def format_unix(ts):
+    return '{:.9f}'.format(ts)
+
+
+def format_rfc3339(ts):
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f000Z')
+
+
+class V20RequestHandler(BaseHTTPRequestHandler):
+    '''Routes the requests of a v20 client to the server'''
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, without this every response on
+    # a kept alive connection waits for the delayed ack of the client
+    disable_nagle_algorithm = True
+    server_ = None  # set by OandaV20Server.start
+
+    _ROUTES = [
+        ('GET', r'/v3/accounts/([^/]+)/summary$', 'summary'),
+        ('GET', r'/v3/accounts/([^/]+)/changes$', 'changes'),
+        ('GET', r'/v3/accounts/([^/]+)/instruments$', 'instruments'),
+        ('GET', r'/v3/accounts/([^/]+)/openPositions$', 'open_positions'),
+        ('GET', r'/v3/accounts/([^/]+)/pricing$', 'pricing'),
+        ('GET', r'/v3/accounts/([^/]+)/pricing/stream$', 'pricing_stream'),
+        ('GET', r'/v3/accounts/([^/]+)/transactions/stream$',
+         'transaction_stream'),
+        ('GET', r'/v3/accounts/([^/]+)/transactions/sinceid$',
+         'transactions_since'),
+        ('GET', r'/v3/accounts/([^/]+)/transactions/idrange$',
+         'transactions_range'),
+        ('GET', r'/v3/accounts/([^/]+)/candles/latest$', 'latest_candles'),
+        ('GET', r'/v3/instruments/([^/]+)/candles$', 'candles'),
+        ('POST', r'/v3/accounts/([^/]+)/orders$', 'order_create'),
+        ('PUT', r'/v3/accounts/([^/]+)/orders/([^/]+)/cancel$',
+         'order_cancel'),
+        ('PUT', r'/v3/accounts/([^/]+)/orders/([^/]+)$', 'order_replace'),
+    ]
+
+    def log_message(self, format, *args):
+        pass  # keep quiet
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def _route(self, method):
+        srv = self.server_
+        url = urlparse(self.path)
+        self.params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.headers.get('Accept-Datetime-Format') == 'UNIX':
+            self.timefmt = format_unix
+        else:
+            self.timefmt = format_rfc3339
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.body = json.loads(body.decode('utf-8')) if body else {}
+
+        for rmethod, pattern, name in self._ROUTES:
+            if rmethod != method:
+                continue
+            match = re.match(pattern, url.path)
+            if match is None:
+                continue
+            args = match.groups()
+            srv.stats[name] += 1
+            if not name.endswith('_stream'):
+                if srv.rate_limit and srv.rate_limited():
+                    srv.stats['rate_limited'] += 1
+                    return self._send(429, {
+                        'errorMessage': 'Requests exceeded'})
+                if srv.latency:
+                    _time.sleep(srv.latency)
+                if srv.error_rate and srv._rnd.random() < srv.error_rate:
+                    srv.stats['errors'] += 1
+                    return self._send(srv.error_status, {
+                        'errorMessage': 'Injected error'})
+            if name != 'candles' and args[0] != srv.account:
+                return self._send(404, {'errorMessage': 'Invalid account'})
+            return getattr(self, 'r_' + name)(*args)
+        self._send(404, {'errorMessage': 'Unknown endpoint'})
+
+    def _send(self, status, body):
+        data = json.dumps(body, default=self._default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _default(self, obj):
+        return str(obj)
+
+    def _trans(self, trans):
+        trans = dict(trans)
+        trans['time'] = self.timefmt(trans['time'])
+        return trans
+
+    def _names(self):
+        return [x for x in self.params.get('instruments', '').split(',') if x]
+
+    def r_summary(self, account):
+        srv = self.server_
+        self._send(200, {'account': srv.summary(),
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def r_changes(self, account):
+        srv = self.server_
+        since = int(self.params.get('sinceTransactionID', 0))
+        changes, state = srv.changes(since)
+        changes['transactions'] = [
+            self._trans(x) for x in changes['transactions']]
+        self._send(200, {'changes': changes, 'state': state,
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def r_instruments(self, account):
+        srv = self.server_
+        names = self._names() or sorted(srv.instruments)
+        self._send(200, {'instruments': srv.instrument_details(names),
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def r_open_positions(self, account):
+        srv = self.server_
+        self._send(200, {'positions': srv.positions(),
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def r_pricing(self, account):
+        srv = self.server_
+        prices = [srv.client_price(srv.get_instrument(x), self.timefmt)
+                  for x in self._names()]
+        body = {'prices': prices, 'time': self.timefmt(_time.time())}
+        if self.params.get('includeHomeConversions', '').lower() == 'true':
+            body['homeConversions'] = srv.home_conversions()
+        self._send(200, body)
+
+    def r_latest_candles(self, account):
+        status, body = self.server_.latest_candles(self.params, self.timefmt)
+        self._send(status, body)
+
+    def r_candles(self, name):
+        status, body = self.server_.candles(name, self.params, self.timefmt)
+        self._send(status, body)
+
+    def r_order_create(self, account):
+        status, body = self.server_.create_order(self.body.get('order', {}))
+        self._send(status, self._bodytrans(body))
+
+    def r_order_replace(self, account, spec):
+        status, body = self.server_.replace_order(
+            spec, self.body.get('order', {}))
+        self._send(status, self._bodytrans(body))
+
+    def r_order_cancel(self, account, spec):
+        status, body = self.server_.cancel_order(spec)
+        self._send(status, self._bodytrans(body))
+
+    def _bodytrans(self, body):
+        return {k: self._trans(v) if isinstance(v, dict) and 'time' in v
+                else v for k, v in body.items()}
+
+    def r_transactions_since(self, account):
+        srv = self.server_
+        since = int(self.params.get('id', 0))
+        trans = srv.transactions_range(since + 1, len(srv.transactions))
+        self._send(200, {'transactions': [self._trans(x) for x in trans],
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def r_transactions_range(self, account):
+        srv = self.server_
+        trans = srv.transactions_range(int(self.params.get('from', 1)),
+                                       int(self.params.get('to', 0)))
+        self._send(200, {'transactions': [self._trans(x) for x in trans],
+                         'lastTransactionID': srv.last_transaction_id})
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_line(self, obj):
+        data = json.dumps(obj, default=self._default).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _run_stream(self, q, first, convert, heartbeat):
+        srv = self.server_
+        tstart = _time.time()
+        try:
+            self._start_stream()
+            for item in first:
+                self._write_line(item)
+            while srv._running:
+                if srv.stream_drop is not None and \
+                        _time.time() - tstart >= srv.stream_drop:
+                    break
+                try:
+                    item = q.get(timeout=srv.heartbeat)
+                except queue.Empty:
+                    self._write_line(heartbeat())
+                    continue
+                if item is None:
+                    break
+                self._write_line(convert(item))
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        self.close_connection = True
+
+    def r_pricing_stream(self, account):
+        srv = self.server_
+        names = self._names()
+        q = srv.subscribe_prices(names)
+        snapshot = self.params.get('snapshot', 'True').lower() != 'false'
+        first = []
+        if snapshot:
+            first = [srv.client_price(srv.get_instrument(x), self.timefmt)
+                     for x in names]
+        try:
+            self._run_stream(
+                q, first,
+                lambda inst: srv.client_price(inst, self.timefmt),
+                lambda: {'type': 'HEARTBEAT',
+                         'time': self.timefmt(_time.time())})
+        finally:
+            srv.unsubscribe_prices(q)
+
+    def r_transaction_stream(self, account):
+        srv = self.server_
+        q = srv.subscribe_transactions()
+        try:
+            self._run_stream(
+                q, [], self._trans,
+                lambda: {'type': 'HEARTBEAT',
+                         'lastTransactionID': srv.last_transaction_id,
+                         'time': self.timefmt(_time.time())})
+        finally:
+            srv.unsubscribe_transactions(q)
+
+
+def runserver(args=None):
+    args = parse_args(args)
+    server = OandaV20Server(
+        host=args.host, port=args.port, tick_rate=args.tick_rate,
+        latency=args.latency, fill_latency=args.fill_latency,
+        error_rate=args.error_rate, rate_limit=args.rate_limit,
+        stream_drop=args.stream_drop,
+        seed=args.seed)
+    server.start()
+    print('Serving OANDA v20 stand-in on {}'.format(server.url))
+    print('Store params: {}'.format(server.store_params()))
+    try:
+        while True:
+            _time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def parse_args(pargs=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Local stand-in server for the OANDA v20 api')
+
+    parser.add_argument('--host', default='127.0.0.1', required=False,
+                        action='store', help='Host to bind to')
+
+    parser.add_argument('--port', default=8080, type=int, required=False,
+                        action='store', help='Port to bind to')
+
+    parser.add_argument('--tick-rate', default=4.0, type=float,
+                        required=False, action='store',
+                        help='Price updates per second and instrument')
+
+    parser.add_argument('--latency', default=0.0, type=float,
+                        required=False, action='store',
+                        help='Seconds to delay rest responses')
+
+    parser.add_argument('--fill-latency', default=0.0, type=float,
+                        required=False, action='store',
+                        help='Seconds to delay the fill of market orders')
+
+    parser.add_argument('--error-rate', default=0.0, type=float,
+                        required=False, action='store',
+                        help='Probability of a rest request to fail')
+
+    parser.add_argument('--rate-limit', default=None, type=float,
+                        required=False, action='store',
+                        help='Rest requests per second before failing')
+
+    parser.add_argument('--stream-drop', default=None, type=float,
+                        required=False, action='store',
+                        help='Seconds after which streams get disconnected')
+
+    parser.add_argument('--seed', default=None, type=int, required=False,
+                        action='store', help='Seed for random values')
+
+    if pargs is not None:
+        return parser.parse_args(pargs)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    runserver()
@@ -2,6 +2,8 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import collections
+import threading
+import time as _time
 
 from backtrader import BrokerBase, Order, BuyOrder, SellOrder
 from backtrader.utils.py3 import with_metaclass
@@ -22,6 +24,37 @@ class OandaV20CommInfo(CommInfoBase):
         return abs(size) * price
 
 
+class OandaV20Basket(object):
+    '''Orders submitted together with ``OandaV20Broker.basket``
+
+    Keeps the time from submitting to accepting (or rejecting) of every
+    order of the basket.
+    '''
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.submitted = dict()  # submit time by order ref
+        self.latency = dict()  # seconds from submit to accept by order ref
+        self.accepted = list()  # refs of accepted orders
+        self.rejected = list()  # refs of rejected orders
+
+    def done(self):
+        '''Returns if all orders of the basket were accepted or rejected'''
+        return len(self.accepted) + len(self.rejected) == len(self.orders)
+
+    def report(self):
+        '''Returns the latency of every order and a summary'''
+        latency = sorted(self.latency.values())
+        return dict(
+            orders=len(self.orders),
+            accepted=len(self.accepted),
+            rejected=len(self.rejected),
+            latency=dict(self.latency),
+            latency_max=latency[-1] if latency else None,
+            latency_avg=sum(latency) / len(latency) if latency else None,
+        )
+
+
 class MetaOandaV20Broker(BrokerBase.__class__):
     def __init__(self, name, bases, dct):
         '''Class has already been created ... register'''
@@ -43,11 +76,17 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
 
         Set to ``False`` during instantiation to disregard any existing
         position
+
+    Done orders are evicted by the retention params of the store
+    (``order_retention``, ``order_retention_age`` and ``order_archive``),
+    orders of a bracket are evicted once all orders of it are done.
     '''
     params = dict(
         use_positions=True,
     )
 
+    _BASKET_UNSUPPORTED = ('owner', 'parent', 'transmit', 'oco')
+
     def __init__(self, **kwargs):
         super(OandaV20Broker, self).__init__()
         self.o = oandav20store.OandaV20Store(**kwargs)
@@ -57,6 +96,11 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
 
         self.opending = collections.defaultdict(list)  # pending transmission
         self.brackets = dict()  # confirmed brackets
+        self.retired = collections.OrderedDict()  # done orders by order id
+        self.baskets = dict()  # baskets waiting for accepts by order ref
+        # guards orders, brackets and retired, orders are evicted by the
+        # threads of the store
+        self._orders_lock = threading.RLock()
 
         self.startingcash = self.cash = 0.0
         self.startingvalue = self.value = 0.0
@@ -140,49 +184,72 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
         return pos
 
     def orderstatus(self, order):
-        o = self.orders[order.ref]
+        o = self.orders.get(order.ref, order)  # evicted orders are done
         return o.status
 
     def _submit(self, oref):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:  # evicted, order is done
+            return
+        basket = self.baskets.get(oref)
+        if basket is not None:
+            basket.submitted.setdefault(oref, _time.monotonic())
         order.submit()
         self.notify(order)
 
     def _reject(self, oref):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:  # evicted, order is done
+            return
+        basket = self.baskets.pop(oref, None)
+        if basket is not None:
+            basket.rejected.append(oref)
         order.reject()
         self.notify(order)
 
     def _accept(self, oref):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:  # evicted, order is done
+            return
+        basket = self.baskets.pop(oref, None)
+        if basket is not None:
+            basket.accepted.append(oref)
+            submitted = basket.submitted.get(oref)
+            if submitted is not None:
+                basket.latency[oref] = _time.monotonic() - submitted
         order.accept()
         self.notify(order)
 
     def _cancel(self, oref):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:  # evicted, order is done
+            return
         order.cancel()
         self.notify(order)
 
     def _expire(self, oref):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:  # evicted, order is done
+            return
         order.expire()
         self.notify(order)
 
     def _bracketize(self, order):
         pref = getattr(order.parent, 'ref', order.ref)  # parent ref or self
-        br = self.brackets.pop(pref, None)  # to avoid recursion
-        if br is None:
-            return
+        with self._orders_lock:
+            br = self.brackets.pop(pref, None)  # to avoid recursion
+            if br is None:
+                return
 
-        if len(br) == 3:  # all 3 orders in place, parent was filled
-            br = br[1:]  # discard index 0, parent
-            for o in br:
-                o and o.activate()  # simulate activate for children
-            self.brackets[pref] = br  # not done - reinsert children
+            if len(br) == 3:  # all 3 orders in place, parent was filled
+                br = br[1:]  # discard index 0, parent
+                for o in br:
+                    o and o.activate()  # simulate activate for children
+                self.brackets[pref] = br  # not done - reinsert children
 
-        elif len(br) == 2:  # filling a children
-            oidx = br.index(order)  # find index to filled (0 or 1)
-            self._cancel(br[1 - oidx].ref)  # cancel remaining (1 - 0 -> 1)
+            elif len(br) == 2:  # filling a children
+                oidx = br.index(order)  # find index to filled (0 or 1)
+                self._cancel(br[1 - oidx].ref)  # cancel remaining (1 - 0 -> 1)
 
     def _fill_external(self, data, size, price):
         if size == 0:
@@ -213,7 +280,13 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
         self.notify(order)
 
     def _fill(self, oref, size, price, reason, **kwargs):
-        order = self.orders[oref]
+        order = self.orders.get(oref)
+        if order is None:
+            msg = ('Order fill received for {}, with price {} and size {} '
+                   'but order was already evicted. Unknown situation {}')
+            msg = msg.format(oref, price, size, reason)
+            self.o.put_notification(msg)
+            return
         if not order.alive():  # can be a bracket
             pref = getattr(order.parent, 'ref', order.ref)
             if pref not in self.brackets:
@@ -280,15 +353,17 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
                 else:
                     takeside = order
                     stopside = child
-                for o in parent, stopside, takeside:
-                    if o is not None:
-                        self.orders[o.ref] = o  # write them down
-                self.brackets[pref] = [parent, stopside, takeside]
+                with self._orders_lock:
+                    for o in parent, stopside, takeside:
+                        if o is not None:
+                            self.orders[o.ref] = o  # write them down
+                    self.brackets[pref] = [parent, stopside, takeside]
                 self.o.order_create(parent, stopside, takeside)
                 return takeside or stopside
 
             else:  # Parent order, which is being transmitted
-                self.orders[order.ref] = order
+                with self._orders_lock:
+                    self.orders[order.ref] = order
                 return self.o.order_create(order)
 
         # Not transmitting
@@ -302,14 +377,11 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
             parent=None, transmit=True,
             **kwargs):
 
-        order = BuyOrder(owner=owner, data=data,
-                         size=size, price=price, pricelimit=plimit,
-                         exectype=exectype, valid=valid, tradeid=tradeid,
-                         trailamount=trailamount, trailpercent=trailpercent,
-                         parent=parent, transmit=transmit)
-
-        order.addinfo(**kwargs)
-        order.addcomminfo(self.getcommissioninfo(data))
+        order = self._create_order(
+            BuyOrder, owner, data, size, price=price, plimit=plimit,
+            exectype=exectype, valid=valid, tradeid=tradeid,
+            trailamount=trailamount, trailpercent=trailpercent,
+            parent=parent, transmit=transmit, **kwargs)
         return self._transmit(order)
 
     def sell(self, owner, data,
@@ -319,18 +391,73 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
              parent=None, transmit=True,
              **kwargs):
 
-        order = SellOrder(owner=owner, data=data,
-                          size=size, price=price, pricelimit=plimit,
-                          exectype=exectype, valid=valid, tradeid=tradeid,
-                          trailamount=trailamount, trailpercent=trailpercent,
-                          parent=parent, transmit=transmit)
+        order = self._create_order(
+            SellOrder, owner, data, size, price=price, plimit=plimit,
+            exectype=exectype, valid=valid, tradeid=tradeid,
+            trailamount=trailamount, trailpercent=trailpercent,
+            parent=parent, transmit=transmit, **kwargs)
+        return self._transmit(order)
+
+    def _create_order(self, ordercls, owner, data,
+                      size, price=None, plimit=None,
+                      exectype=None, valid=None, tradeid=0,
+                      trailamount=None, trailpercent=None,
+                      parent=None, transmit=True,
+                      **kwargs):
+        '''Creates an order of ``buy``, ``sell`` and ``basket``, other
+        kwargs are added to the info of the order'''
+        order = ordercls(owner=owner, data=data,
+                         size=size, price=price, pricelimit=plimit,
+                         exectype=exectype, valid=valid, tradeid=tradeid,
+                         trailamount=trailamount, trailpercent=trailpercent,
+                         parent=parent, transmit=transmit)
 
         order.addinfo(**kwargs)
         order.addcomminfo(self.getcommissioninfo(data))
-        return self._transmit(order)
+        return order
+
+    def basket(self, owner, orders):
+        '''Creates and transmits a list of orders at once, ex. to rebalance
+
+        Every entry of orders is a dict with the args of ``buy`` (positive
+        ``size``) or ``sell`` (negative ``size``), at least ``data`` and
+        ``size``. Orders of different instruments are sent in parallel.
+        The orders of a basket are independent, ``parent``, ``transmit``
+        and ``oco`` are not supported.
+        Returns a ``OandaV20Basket`` with the orders in the same sequence
+        and the latency from submit to accept of every order'''
+        legs = []
+        for kwargs in orders:
+            kwargs = dict(kwargs)
+            unsupported = [x for x in self._BASKET_UNSUPPORTED if x in kwargs]
+            if unsupported:
+                raise ValueError('Basket orders do not support {}'.format(
+                    ', '.join(unsupported)))
+            if kwargs.get('data') is None or not kwargs.get('size'):
+                raise ValueError(
+                    'Basket orders need data and a size other than 0')
+            legs.append(kwargs)
+
+        created = []
+        for kwargs in legs:
+            size = kwargs.pop('size')
+            ordercls = BuyOrder if size > 0 else SellOrder
+            created.append(self._create_order(
+                ordercls, owner, size=abs(size), **kwargs))
+
+        basket = OandaV20Basket(created)
+        for order in created:
+            self.baskets[order.ref] = basket
+        for order in created:
+            # the order may be accepted before order_create returns
+            basket.submitted[order.ref] = _time.monotonic()
+            self._transmit(order)
+        return basket
 
     def cancel(self, order):
-        o = self.orders[order.ref]
+        o = self.orders.get(order.ref)
+        if o is None:  # evicted, order is done
+            return
         if o.status == Order.Cancelled:  # already cancelled
             return
 
@@ -338,6 +465,73 @@ class OandaV20Broker(with_metaclass(MetaOandaV20Broker, BrokerBase)):
 
     def notify(self, order):
         self.notifs.append(order.clone())
+        if not order.alive() and order.ref in self.orders:
+            self._retire(order)
+
+    def _retire(self, order):
+        '''Queues a done order for eviction and evicts the orders exceeding
+        the retention'''
+        if (self.o.p.order_retention is None and
+                self.o.p.order_retention_age is None):
+            return
+        with self._orders_lock:
+            self.retired.setdefault(order.ref, _time.monotonic())
+            self._evict()
+
+    def _evict(self):
+        '''Evicts the done orders exceeding the retention, also called by the
+        account poll of the store to evict by age without new done orders'''
+        count = self.o.p.order_retention
+        age = self.o.p.order_retention_age
+        if count is None and age is None:
+            return
+        with self._orders_lock:
+            now = _time.monotonic()
+            # every order is looked at once, orders of an active bracket
+            # are queued again
+            for _ in range(len(self.retired)):
+                oref, rtime = next(iter(self.retired.items()))
+                if not ((count is not None and len(self.retired) > count)
+                        or (age is not None and now - rtime > age)):
+                    break
+                del self.retired[oref]
+                o = self.orders.get(oref)
+                if o is None:
+                    continue
+                pref = getattr(o.parent, 'ref', oref)
+                br = self.brackets.get(pref)
+                if br is not None:
+                    if self._bracket_alive(br):
+                        self.retired[oref] = now
+                        continue
+                    del self.brackets[pref]
+                del self.orders[oref]
+                self.o.order_evict(oref, self._order_record(o))
+
+    def _bracket_alive(self, br):
+        '''Returns if orders of a bracket can still be executed'''
+        if len(br) == 3 and not br[0].alive():
+            # the children of a parent which was not filled are never
+            # created on the server
+            return br[0].status == Order.Completed
+        return any(o is not None and o.alive() for o in br)
+
+    def _order_record(self, order):
+        '''Returns a dict describing a done order for the archive'''
+        if self.o.p.order_archive is None:
+            return None
+        return dict(
+            ref=order.ref,
+            parent=getattr(order.parent, 'ref', None),
+            instrument=order.data._dataname,
+            type=order.ordtypename(),
+            exectype=order.getordername(),
+            status=order.getstatusname(),
+            size=order.created.size,
+            price=order.created.price,
+            executed_size=order.executed.size,
+            executed_price=order.executed.price,
+        )
 
     def get_notification(self):
         if not self.notifs:
@@ -23,10 +23,28 @@ class OandaV20BacktestCommInfo(CommInfoBase):
         '''Returns the needed size to meet a cash operation at a given price'''
         size = super(OandaV20BacktestCommInfo, self).getsize(price, cash)
         size *= self.p.margin
-        if not self.p.acc_counter_currency:
-            size /= price
+        size *= self.getconversion(price)
         return int(size)
 
+    def getconversion(self, price):
+        '''Returns the factor converting amounts in the counter currency into
+        the account currency
+
+        Uses the conversion table of the store of a live oanda data feed,
+        else ``acc_counter_currency`` decides between the counter and the
+        base currency with the price of the data feed. Backtests do not use
+        the table, its rates are current rates of OANDA'''
+        if (self.data is not None
+                and self.data.islive()
+                and hasattr(self.data, 'o')
+                and hasattr(self.data.o, 'get_conversion')):
+            factor = self.data.o.get_conversion(self.data.p.dataname, price)
+            if factor:
+                return factor
+        if self.p.acc_counter_currency:
+            return 1.0
+        return 1.0 / price
+
     def _getcommission(self, size, price, pseudoexec):
         '''
         This scheme will apply half the commission when buying and half when selling.
@@ -44,8 +62,5 @@ class OandaV20BacktestCommInfo(CommInfoBase):
         else:
             spread = self.p.spread
         multiplier = float(10 ** self.p.pip_location)
-        if self.p.acc_counter_currency:
-            comm = abs(spread * (size * multiplier))
-        else:
-            comm = abs(spread * ((size / price) * multiplier))
+        comm = abs(spread * (size * self.getconversion(price) * multiplier))
         return comm / 2
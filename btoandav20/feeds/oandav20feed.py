@@ -1,7 +1,8 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
-from datetime import datetime, timedelta, timezone, time
+from array import array
+from datetime import datetime, timezone
 
 import time as _time
 import threading
@@ -11,6 +12,13 @@ from backtrader import TimeFrame, date2num, num2date
 from backtrader.utils.py3 import queue, with_metaclass
 
 from btoandav20.stores import oandav20store
+from btoandav20.stores.oandabars import OandaBarBuilder
+from btoandav20.stores.oandacandles import OandaCandles
+from btoandav20.stores.oandaperiods import OandaPeriods
+from btoandav20.stores.oandaticks import OandaTickQueue
+
+# num date of the epoch, epoch seconds / 86400 are added for the num date
+EPOCHNUM = date2num(datetime(1970, 1, 1))
 
 
 class MetaOandaV20Data(DataBase.__class__):
@@ -94,6 +102,30 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
         The delay in seconds when new candles should be fetched after a
         period is over
 
+      - ``candles_stream`` (default: ``False``)
+
+        With ``candles`` build the candles from the shared price stream
+        instead of fetching them after every period. A candle is delivered
+        as soon as its period is over, the first candle is continued from
+        the backfill
+
+      - ``candles_check`` (default: ``True``)
+
+        Compare the candles built with ``candles_stream`` with the candles
+        of OANDA in the background, ``candles_delay`` seconds after their
+        period. Differences are notified by the store and counted in
+        ``candles_checked`` and ``candles_differing``
+
+
+      - ``conflate`` (default: ``None``)
+
+        Conflate the prices of the price stream which were not loaded yet,
+        so a strategy slower than the price stream always gets the latest
+        price. ``last`` keeps only the latest price, ``ohlc`` loads the
+        latest price as close with the open, high and low of the prices
+        since the last loaded bar (the volume is the count of prices). The
+        prices are counted in ``qlive.dropped`` or ``qlive.merged``. Only
+        used without ``candles``
 
       - ``adjstarttime`` (default: ``False``)
 
@@ -143,6 +175,9 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
         useask=False,
         candles=False,
         candles_delay=1,
+        candles_stream=False,  # build candles from the price stream
+        candles_check=True,    # compare built candles with OANDA candles
+        conflate=None,        # conflate prices: None, 'last' or 'ohlc'
         adjstarttime=False,   # adjust start time of candle
         # TODO readd tmout - set timeout in store
         reconnect=True,
@@ -156,8 +191,8 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
 
     def islive(self):
         '''Returns ``True`` to notify ``Cerebro`` that preloading and runonce
-        should be deactivated'''
-        return True
+        should be deactivated, historical data feeds are not live'''
+        return not self.p.historical
 
     def __init__(self, **kwargs):
         self.o = self._store(**kwargs)
@@ -178,6 +213,19 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
         self._statelivereconn = False  # if reconnecting in live state
         self._storedmsg = dict()  # keep pending live message (under None)
         self.qlive = queue.Queue()
+        self.qhist = None  # channel of the historical download
+        self._histcandles = None  # pending columnar candles of qhist
+        self._histidx = 0
+        # start and end of the candle periods
+        self._periods = OandaPeriods(
+            self._timeframe, self._compression, self.p.sessionstart)
+        self._builder = None  # builds candles from the price stream
+        self._ticks = None  # queue conflating the prices of the stream
+        if self.p.conflate and not self.p.candles:
+            self._ticks = OandaTickQueue(self.p.conflate)
+        self._qbuilt = None  # built candles to check against OANDA
+        self.candles_checked = 0  # built candles compared with OANDA
+        self.candles_differing = 0  # built candles differing from OANDA
         self._state = self._ST_OVER
         self._reconns = self.p.reconnections
         self.contractdetails = None
@@ -198,6 +246,19 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
             self._state = self._ST_OVER
             return
 
+        # ticks are loaded by a loader specialized for the params
+        self._load_tick = self._tick_loader()
+
+        if (self.p.candles and self.p.candles_stream
+                and not self.p.historical):
+            self._builder = OandaBarBuilder(
+                self._period, cd['displayPrecision'])
+            if self.p.candles_check:
+                self._qbuilt = queue.Queue()
+                t = threading.Thread(target=self._t_check)
+                t.daemon = True
+                t.start()
+
         if self.p.backfill_from is not None:
             self._state = self._ST_FROM
             self._st_start(True)
@@ -225,7 +286,7 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
                 self.p.dataname, dtbegin, dtend,
                 self._timeframe, self._compression,
                 candleFormat=self._candleFormat,
-                includeFirst=True)
+                includeFirst=True, columnar=True)
 
             self._state = self._ST_HISTORBACK
             return True
@@ -237,138 +298,110 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
             self._statelivereconn = self.p.backfill
         if self._statelivereconn:
             self.put_notification(self.DELAYED)
-        if not self.p.candles:
-            # recreate a new stream on call
+        if not self.p.candles or self._builder is not None:
+            # resubscribe to the shared price stream on call
+            self.o.streaming_prices_stop(self.qlive)
             self.qlive = self.o.streaming_prices(
-                self.p.dataname)
+                self.p.dataname, q=self._ticks)
+            if self._builder is not None:
+                # prices were missed, the backfill continues the candle
+                self._builder.reset()
         elif instart:
-            # poll thread will never die, so no need to recreate it
-            self.poll_thread()
+            # the latest candles poller of the store keeps the queue
+            self.qlive = self.o.polling_candles(
+                self.p.dataname, self._timeframe, self._compression,
+                self._candleFormat, delay=self.p.candles_delay)
         self._state = self._ST_LIVE
         return True  # no return before - implicit continue
 
-    def poll_thread(self):
-        t = threading.Thread(target=self._t_poll)
-        t.daemon = True
-        t.start()
+    def _period(self, ts):
+        '''Returns start and end of the candle period holding the epoch time
+        ts as epoch times'''
+        return self._periods.period(ts)
 
-    def _t_poll(self):
-        dtstart = self._getstarttime(
-            self._timeframe,
-            self._compression,
-            offset=1)
+    def _load_built(self, candle):
+        '''Loads a candle built from the price stream and passes it on to
+        the check'''
+        if not self._load_candle(candle):
+            return False
+        if self._qbuilt is not None:
+            self._qbuilt.put(candle)
+        return True
+
+    def _t_check(self):
+        '''Compares the candles built from the price stream with the candles
+        of OANDA'''
+        precision = self.contractdetails['displayPrecision']
+        tolerance = 10 ** -precision / 2
         while True:
-            dtcurr = self._getstarttime(self._timeframe, self._compression)
-            # request candles in live instead of stream
-            if dtcurr > dtstart:
-                if len(self) > 1:
-                    # len == 1 ... forwarded for the 1st time
-                    dtbegin = self.datetime.datetime(-1)
-                elif self.fromdate > float('-inf'):
-                    dtbegin = num2date(self.fromdate, tz=timezone.utc)
-                else:  # 1st bar and no begin set
-                    dtbegin = dtstart
-                self.qlive = self.o.candles(
-                    self.p.dataname, dtbegin, None,
-                    self._timeframe, self._compression,
-                    candleFormat=self._candleFormat,
-                    onlyComplete=True,
-                    includeFirst=False)
-                dtstart = dtbegin
-                # sleep until next call
-                dtnow = datetime.utcnow()
-                dtnext = self._getstarttime(
-                    self._timeframe,
-                    self._compression,
-                    dt=dtnow,
-                    offset=-1)
-                dtdiff = dtnext - dtnow
-                tmout = (dtdiff.days * 24 * 60 * 60) + \
-                    dtdiff.seconds + self.p.candles_delay
-                if tmout <= 0:
-                    tmout = self.p.candles_delay
+            built = [self._qbuilt.get()]
+            while not self._qbuilt.empty():
+                built.append(self._qbuilt.get())
+            if None in built:
+                return  # end of thread
+            # OANDA completes its candle after the end of the period
+            tsend = self._period(float(built[-1]['time']))[1]
+            tmout = tsend + self.p.candles_delay - _time.time()
+            if tmout > 0:
                 _time.sleep(tmout)
 
+            built = dict((float(x['time']), x) for x in built)
+            candles = self.o.iter_candles(
+                self.p.dataname,
+                datetime.utcfromtimestamp(min(built)),
+                datetime.utcfromtimestamp(max(built)),
+                self._timeframe, self._compression,
+                candleFormat=self._candleFormat, columnar=True)
+            for page in candles:
+                for idx, ts in enumerate(page.time):
+                    candle = built.pop(ts, None)
+                    if candle is None:
+                        continue
+                    self.candles_checked += 1
+                    official = page.row(idx)
+                    if any(abs(candle[side][x] - official[side][x])
+                           > tolerance
+                           for side in OandaBarBuilder.SIDES
+                           for x in 'ohlc'):
+                        self.candles_differing += 1
+                        self.o.put_notification(
+                            'Candle {} of {} differs from OANDA: {} != {}'
+                            .format(candle['time'], self.p.dataname,
+                                    candle, official))
+            for ts, candle in built.items():
+                self.candles_checked += 1
+                self.candles_differing += 1
+                self.o.put_notification(
+                    'Candle {} of {} is missing at OANDA: {}'.format(
+                        candle['time'], self.p.dataname, candle))
+
     def _getstarttime(self, timeframe, compression, dt=None, offset=0):
         '''
         This method will return the start of the period based on current
         time (or provided time).
         '''
-        sessionstart = self.p.sessionstart
-        if sessionstart is None:
-            # use UTC 22:00 (5:00 pm New York) as default
-            sessionstart = time(hour=22, minute=0, second=0)
         if dt is None:
             dt = datetime.utcnow()
-        if timeframe == TimeFrame.Seconds:
-            dt = dt.replace(
-                second=(dt.second // compression) * compression,
-                microsecond=0)
-            if offset:
-                dt = dt - timedelta(seconds=compression*offset)
-        elif timeframe == TimeFrame.Minutes:
-            if compression >= 60:
-                hours = 0
-                minutes = 0
-                # get start of day
-                dtstart = self._getstarttime(TimeFrame.Days, 1, dt)
-                # diff start of day with current time to get seconds
-                # since start of day
-                dtdiff = dt - dtstart
-                hours = dtdiff.seconds//((60*60)*(compression//60))
-                minutes = compression % 60
-                dt = dtstart + timedelta(hours=hours, minutes=minutes)
-            else:
-                dt = dt.replace(
-                    minute=(dt.minute // compression) * compression,
-                    second=0,
-                    microsecond=0)
-            if offset:
-                dt = dt - timedelta(minutes=compression*offset)
-        elif timeframe == TimeFrame.Days:
-            if dt.hour < sessionstart.hour:
-                dt = dt - timedelta(days=1)
-            if offset:
-                dt = dt - timedelta(days=offset)
-            dt = dt.replace(
-                hour=sessionstart.hour,
-                minute=sessionstart.minute,
-                second=sessionstart.second,
-                microsecond=sessionstart.microsecond)
-        elif timeframe == TimeFrame.Weeks:
-            if dt.weekday() != 6:
-                # sunday is start of week at 5pm new york
-                dt = dt - timedelta(days=dt.weekday() + 1)
-            if offset:
-                dt = dt - timedelta(days=offset * 7)
-            dt = dt.replace(
-                hour=sessionstart.hour,
-                minute=sessionstart.minute,
-                second=sessionstart.second,
-                microsecond=sessionstart.microsecond)
-        elif timeframe == TimeFrame.Months:
-            if offset:
-                dt = dt - timedelta(days=(min(28 + dt.day, 31)))
-            # last day of month
-            last_day_of_month = dt.replace(day=28) + timedelta(days=4)
-            last_day_of_month = last_day_of_month - timedelta(
-                days=last_day_of_month.day)
-            last_day_of_month = last_day_of_month.day
-            # start of month (1 at 0, 22 last day of prev month)
-            if dt.day < last_day_of_month:
-                dt = dt - timedelta(days=dt.day)
-            dt = dt.replace(
-                hour=sessionstart.hour,
-                minute=sessionstart.minute,
-                second=sessionstart.second,
-                microsecond=sessionstart.microsecond)
-        return dt
+        periods = self._periods
+        if (periods is None or periods.timeframe != timeframe
+                or periods.compression != compression):
+            periods = OandaPeriods(timeframe, compression, self.p.sessionstart)
+        ts = periods.start(dt.replace(tzinfo=timezone.utc).timestamp(), offset)
+        return datetime.utcfromtimestamp(ts)
 
     def stop(self):
         '''
         Stops and tells the store to stop
         '''
         super(OandaV20Data, self).stop()
+        if self.qhist is not None:
+            self.qhist.close()  # stop a download still running
+        if self._qbuilt is not None:
+            self._qbuilt.put(None)  # end of check thread
+        if not self.p.candles or self._builder is not None:
+            self.o.streaming_prices_stop(self.qlive)
+        elif not self.p.historical:
+            self.o.polling_candles_stop(self.qlive)
         self.o.stop()
 
     def replay(self, **kwargs):
@@ -384,6 +417,54 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
         self._timeframe = orig_timeframe
         self._compression = orig_compression
 
+    def preload(self):
+        '''Loads all candles of the historical download into the lines at
+        once. Falls back to loading candle by candle if the data is not
+        historical or filters or a timezone conversion are in place.'''
+        if (self._state != self._ST_HISTORBACK or self._filters
+                or self._ffilters or self._tzinput):
+            return super(OandaV20Data, self).preload()
+
+        if self.p.bidask:
+            side = 'ask' if self.p.useask else 'bid'
+        else:
+            side = 'mid'
+        lines = self.lines
+        columns = (lines.open, lines.high, lines.low, lines.close)
+        dtlast = float('-inf')
+        while True:
+            msg = self.qhist.get()
+            if not isinstance(msg, OandaCandles):
+                # end of histdata, None if the download was given up
+                break
+
+            dts = self._candletimes(msg.time)
+            # keep new candles inside of fromdate and todate
+            idxs = [i for i, dt in enumerate(dts)
+                    if dt > dtlast and self.fromdate <= dt <= self.todate]
+            done = dts[-1] > self.todate
+            if len(idxs) != len(dts):
+                msg = msg.take(idxs)
+                dts = array('d', (dts[i] for i in idxs))
+            if dts:
+                dtlast = dts[-1]
+                lines.datetime.array.extend(dts)
+                lines.volume.array.extend(msg.volume)
+                lines.openinterest.array.extend(array('d', [0.0]) * len(dts))
+                for line, values in zip(columns, getattr(msg, side)):
+                    line.array.extend(values)
+                lines.mid_close.array.extend(msg.mid[3])
+                lines.bid_close.array.extend(msg.bid[3])
+                lines.ask_close.array.extend(msg.ask[3])
+            if done:
+                break
+
+        self.qhist.close()  # stop a download still running
+        self.put_notification(self.DISCONNECTED)
+        self._state = self._ST_OVER
+        self._last()
+        self.home()
+
     def haslivedata(self):
         return bool(self._storedmsg or self.qlive)  # do not return the objs
 
@@ -393,10 +474,20 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
 
         while True:
             if self._state == self._ST_LIVE:
+                timeout = self._qcheck
+                if self._builder is not None:
+                    # wake up at the end of the period of the candle
+                    remaining = self._builder.remaining(_time.time())
+                    if remaining is not None:
+                        timeout = max(0.0, min(timeout, remaining))
                 try:
                     msg = (self._storedmsg.pop(None, None) or
-                           self.qlive.get(timeout=self._qcheck))
+                           self.qlive.get(timeout=timeout))
                 except queue.Empty:
+                    if self._builder is not None:
+                        candle = self._builder.close(_time.time())
+                        if candle is not None and self._load_built(candle):
+                            return True
                     return None
 
                 if 'msg' in msg:
@@ -423,7 +514,11 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
                         if self.qlive.qsize() <= 1:  # very short live queue
                             self.put_notification(self.LIVE)
                     if msg:
-                        if self.p.candles:
+                        if self._builder is not None:
+                            candle = self._builder.add(msg)
+                            ret = (candle is not None
+                                   and self._load_built(candle))
+                        elif self.p.candles:
                             ret = self._load_candle(msg)
                         else:
                             ret = self._load_tick(msg)
@@ -458,18 +553,34 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
                     self.p.dataname, dtbegin, dtend,
                     self._timeframe, self._compression,
                     candleFormat=self._candleFormat,
-                    includeFirst=True, onlyComplete=False)
+                    includeFirst=True, onlyComplete=False, columnar=True)
 
                 self._state = self._ST_HISTORBACK
                 self._statelivereconn = False  # no longer in live
                 continue
 
             elif self._state == self._ST_HISTORBACK:
+                candles = self._histcandles
+                if candles is not None:
+                    idx = self._histidx
+                    if idx < len(candles):
+                        self._histidx = idx + 1
+                        if (self._builder is not None
+                                and not candles.complete[idx]):
+                            # the price stream completes the candle
+                            self._builder.seed(candles.row(idx))
+                            continue
+                        if self._load_candles(candles, idx):
+                            return True  # loading worked
+                        continue  # not loaded ... date may have been seen
+                    self._histcandles = None
+
                 msg = self.qhist.get()
-                if msg is None:
+                if isinstance(msg, OandaCandles):
+                    self._histcandles, self._histidx = msg, 0
                     continue
 
-                elif 'msg' in msg:  # Error
+                elif msg is None or 'msg' in msg:  # Error or given up
                     if not self.p.reconnect or self._reconns == 0:
                         # Can no longer reconnect
                         self.put_notification(self.DISCONNECTED)
@@ -477,6 +588,9 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
                         return False  # failed
 
                     # Can reconnect
+                    if msg is None and self.o.p.reconntimeout:
+                        # do not retry a failed download at once
+                        _time.sleep(self.o.p.reconntimeout)
                     self._reconns -= 1
                     self._st_start(instart=False)
                     continue
@@ -541,28 +655,98 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
                 price[None] = 'bid'
         else:
             price[None] = 'mid'
-        for t in ['open', 'high', 'low', 'close']:
-            getattr(self.l, t)[0] = price[price[None]]
+        conflated = msg.get('conflated')
+        if conflated is None:
+            for t in ['open', 'high', 'low', 'close']:
+                getattr(self.l, t)[0] = price[price[None]]
+        else:
+            # prices merged by the conflating queue since the last bar
+            ohlc = conflated[price[None]]
+            if price[None] == 'mid':
+                precision = self.contractdetails['displayPrecision']
+                ohlc = [round(x, precision) for x in ohlc]
+            for t, x in zip(['open', 'high', 'low', 'close'], ohlc):
+                getattr(self.l, t)[0] = x
         for x in ['mid', 'bid', 'ask']:
             getattr(self.l, f'{x}_close')[0] = price[x]
 
-        self.l.volume[0] = 0.0
+        self.l.volume[0] = 0.0 if conflated is None else conflated['count']
         self.l.openinterest[0] = 0.0
 
         return True
 
-    def _load_candle(self, msg):
-        dtobj = datetime.utcfromtimestamp(float(msg['time']))
+    def _tick_loader(self):
+        '''Returns a function loading a tick like ``_load_tick``
+
+        The price side, the display precision and the lines are resolved
+        once for the params of the feed instead of per tick, the time is
+        converted from epoch seconds to a num date arithmetically'''
+        lines = self.lines
+        ldatetime = lines.datetime
+        lopen, lhigh, llow, lclose = (
+            lines.open, lines.high, lines.low, lines.close)
+        lvolume, loi = lines.volume, lines.openinterest
+        lmid, lbid, lask = lines.mid_close, lines.bid_close, lines.ask_close
+        precision = self.contractdetails['displayPrecision']
+        if not self.p.bidask:
+            side = 2  # index of mid in (bid, ask, mid)
+        else:
+            side = 1 if self.p.useask else 0
+
+        def load_tick(msg):
+            dt = EPOCHNUM + float(msg['time']) / 86400.0
+            if dt <= ldatetime[-1]:
+                return False  # time already seen
+
+            bid = float(msg['bids'][0]['price'])
+            ask = float(msg['asks'][0]['price'])
+            mid = round((bid + ask) / 2, precision)
+            price = (bid, ask, mid)[side]
+            ldatetime[0] = dt
+            lopen[0] = lhigh[0] = llow[0] = lclose[0] = price
+            lmid[0] = mid
+            lbid[0] = bid
+            lask[0] = ask
+            lvolume[0] = 0.0
+            loi[0] = 0.0
+            return True
+
+        if self._ticks is None:
+            return load_tick
+
+        def load_conflated(msg):
+            if not load_tick(msg):
+                return False
+            conflated = msg.get('conflated')
+            if conflated is not None:
+                # prices merged by the conflating queue since the last bar
+                o, h, l, c = conflated[('bid', 'ask', 'mid')[side]]
+                if side == 2:
+                    o, h, l, c = (round(x, precision) for x in (o, h, l, c))
+                lopen[0], lhigh[0], llow[0], lclose[0] = o, h, l, c
+                lvolume[0] = conflated['count']
+            return True
+
+        return load_conflated
+
+    def _candletime(self, ts):
+        '''Returns the datetime of a candle as num'''
         if self.p.adjstarttime:
             # move time to start time of next candle
             # and subtract 0.1 miliseconds (ensures no
             # rounding issues, 10 microseconds is minimum)
-            dtobj = self._getstarttime(
-                self.p.timeframe,
-                self.p.compression,
-                dtobj,
-                -1) - timedelta(microseconds=100)
-        dt = date2num(dtobj)
+            ts = self._periods.end(ts) - 0.0001
+        return date2num(datetime.utcfromtimestamp(ts))
+
+    def _candletimes(self, times):
+        '''Returns the datetimes of candles as array of nums'''
+        if self.p.adjstarttime:
+            times = [x - 0.0001 for x in self._periods.ends(times)]
+        return array('d', (date2num(datetime.utcfromtimestamp(x))
+                           for x in times))
+
+    def _load_candle(self, msg):
+        dt = self._candletime(float(msg['time']))
         if dt <= self.l.datetime[-1]:
             return False  # time already seen
 
@@ -596,3 +780,32 @@ class OandaV20Data(with_metaclass(MetaOandaV20Data, DataBase)):
             getattr(self.l, ident)[0] = price[x]['close']
 
         return True
+
+    def _load_candles(self, candles, idx):
+        '''Loads the candle at idx of columnar candles'''
+        dt = self._candletime(candles.time[idx])
+        if dt <= self.l.datetime[-1]:
+            return False  # time already seen
+
+        # common fields
+        lines = self.lines
+        lines.datetime[0] = dt
+        lines.volume[0] = candles.volume[idx]
+        lines.openinterest[0] = 0.0
+
+        # select default price side for ohlc values
+        if self.p.bidask:
+            side = candles.ask if self.p.useask else candles.bid
+        else:
+            side = candles.mid
+        o, h, l, c = side
+        lines.open[0] = o[idx]
+        lines.high[0] = h[idx]
+        lines.low[0] = l[idx]
+        lines.close[0] = c[idx]
+        # set all close values
+        lines.mid_close[0] = candles.mid[3][idx]
+        lines.bid_close[0] = candles.bid[3][idx]
+        lines.ask_close[0] = candles.ask[3][idx]
+
+        return True
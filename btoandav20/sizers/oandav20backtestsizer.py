@@ -80,17 +80,14 @@ class OandaV20BacktestRiskSizer(bt.Sizer):
 
         mult = float(1 / 10 ** comminfo.p.pip_location)
         price_per_pip = cash_to_use / pips
-        if not comminfo.p.acc_counter_currency and price:
-            # Acc currency is same as base currency
-            pip = price_per_pip * price
-            size = pip * mult
-        elif exchange_rate:
-            # Acc currency is neither same as base or counter currency
+        if exchange_rate:
+            # Exchange rate from acc currency to counter currency given
             pip = price_per_pip * exchange_rate
             size = pip * mult
         else:
-            # Acc currency and counter currency are the same
-            size = price_per_pip * mult
+            # Convert pip value from acc currency to counter currency
+            pip = price_per_pip / comminfo.getconversion(price)
+            size = pip * mult
         size = min(size, avail)
         return int(size)
 
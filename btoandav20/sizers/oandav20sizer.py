@@ -23,8 +23,6 @@ class OandaV20Sizer(bt.Sizer):
             return position.size
 
         name = data.contractdetails['name']
-        sym_src = self.o.get_currency()
-        sym_to = name[-(len(sym_src)):]
 
         cash_to_use = 0
         if self.p.percents != 0:
@@ -37,13 +35,10 @@ class OandaV20Sizer(bt.Sizer):
         price = self.o.get_pricing(name)
         if not price:
             return 0
-        if sym_src != sym_to:
-            # convert cash to target currency
-            convprice = self.o.get_pricing(sym_src + '_' + sym_to)
-            if convprice:
-                cash_to_use = (
-                    cash_to_use
-                    / (1 / float(convprice['closeoutAsk'])))
+        factor = self.o.get_conversion(name)
+        if factor:
+            # convert cash to quote currency
+            cash_to_use = cash_to_use / factor
 
         if self.p.percents != 0:
             size = avail * (self.p.percents / 100)
@@ -98,8 +93,6 @@ class OandaV20RiskSizer(bt.Sizer):
             return position.size
 
         name = data.contractdetails['name']
-        sym_src = self.o.get_currency()
-        sym_to = name[-(len(sym_src)):]
 
         cash_to_use = 0
         if self.p.percents != 0:
@@ -112,13 +105,10 @@ class OandaV20RiskSizer(bt.Sizer):
         price = self.o.get_pricing(name)
         if not price:
             return 0
-        if sym_src != sym_to:
-            # convert cash to target currency
-            convprice = self.o.get_pricing(sym_src + '_' + sym_to)
-            if convprice:
-                cash_to_use = (
-                    cash_to_use
-                    / (1 / float(convprice['closeoutAsk'])))
+        factor = self.o.get_conversion(name)
+        if factor:
+            # convert cash to quote currency
+            cash_to_use = cash_to_use / factor
 
         price_per_pip = cash_to_use / pips
         mult = float(1 / 10 ** data.contractdetails['pipLocation'])
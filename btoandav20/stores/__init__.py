@@ -3,3 +3,5 @@ from __future__ import (absolute_import, division, print_function,
 
 from .oandav20store import OandaV20Store
 from .oandaposition import OandaPosition
+from .oandacandles import OandaCandles
+from .oandaconversions import OandaHomeConversions
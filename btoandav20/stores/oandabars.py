@@ -0,0 +1,108 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+
+class OandaBarBuilder(object):
+    '''Builds bid, ask and mid candles from the prices of the price stream.
+
+    Prices are added in the order of the stream, a candle is returned as
+    soon as a price of a later period arrives or ``close`` is called after
+    the end of its period. The candles have the format of the candles of
+    the store (``v20.instrument.Candlestick.dict()`` with float prices), the
+    volume is the count of prices like the volume of OANDA. Periods without
+    prices have no candle.
+
+    The boundaries of a period are only calculated when a price of a new
+    period arrives, adding a price to the current candle is constant time.
+
+    Params:
+
+      - ``period``: callable ``period(ts)`` returning the start and end of
+        the period holding the epoch time ts as epoch times
+
+      - ``precision``: decimals of the mid price
+
+    Member Attributes:
+
+      - ``start``, ``end``: period of the current or last candle
+
+      - ``late``: count of prices dropped because their candle was already
+        returned
+    '''
+
+    SIDES = ('bid', 'ask', 'mid')
+
+    def __init__(self, period, precision):
+        self._period = period
+        self.precision = precision
+        self.late = 0
+        self.reset()
+
+    def reset(self):
+        '''Drops the current candle'''
+        self.start = self.end = None
+        self._ohlc = None  # [open, high, low, close] by side
+        self._volume = 0
+
+    def seed(self, candle):
+        '''Continues an incomplete candle, e.g. of a backfill, with the next
+        prices of the same period'''
+        self.start, self.end = self._period(float(candle['time']))
+        self._ohlc = dict(
+            (side, [float(candle[side][x]) for x in 'ohlc'])
+            for side in self.SIDES)
+        self._volume = int(candle.get('volume', 0))
+
+    def add(self, price):
+        '''Adds a price of the price stream, returns the candle of the
+        previous period if the price starts a new one else ``None``'''
+        ts = float(price['time'])
+        bid = float(price['bids'][0]['price'])
+        ask = float(price['asks'][0]['price'])
+        mid = round((bid + ask) / 2, self.precision)
+
+        candle = None
+        ohlc = self._ohlc
+        if ohlc is not None and ts >= self.end:
+            candle = self.close()
+            ohlc = None
+        if ohlc is None:
+            if self.end is not None and ts < self.end:
+                self.late += 1  # candle of the price was already returned
+                return candle
+            self.start, self.end = self._period(ts)
+            self._ohlc = {'bid': [bid, bid, bid, bid],
+                          'ask': [ask, ask, ask, ask],
+                          'mid': [mid, mid, mid, mid]}
+            self._volume = 1
+            return candle
+
+        for side, value in (('bid', bid), ('ask', ask), ('mid', mid)):
+            x = ohlc[side]
+            if value > x[1]:
+                x[1] = value
+            elif value < x[2]:
+                x[2] = value
+            x[3] = value
+        self._volume += 1
+        return candle
+
+    def remaining(self, ts):
+        '''Returns the seconds from ts until the current candle ends,
+        ``None`` without a current candle'''
+        if self._ohlc is None:
+            return None
+        return self.end - ts
+
+    def close(self, ts=None):
+        '''Returns the current candle if its period ended at ts (any time
+        if ``None``) and starts waiting for the next period'''
+        if self._ohlc is None or (ts is not None and ts < self.end):
+            return None
+        candle = {'time': '{:.9f}'.format(self.start),
+                  'volume': self._volume,
+                  'complete': True}
+        for side, x in self._ohlc.items():
+            candle[side] = {'o': x[0], 'h': x[1], 'l': x[2], 'c': x[3]}
+        self._ohlc = None
+        return candle
@@ -0,0 +1,245 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from .oandacandles import OandaCandles
+
+
+class OandaCandleCache(object):
+    '''On-disk cache for historical candles.
+
+    Candles are kept in one sqlite file per instrument, granularity and
+    price component (ex. ``EUR_USD-M1-ABM.sqlite``). Every file keeps the
+    disjoint time ranges it covers. A request is served from disk for the
+    covered parts of its range, only the missing parts of its range get
+    fetched. The request and the covered ranges it overlaps are merged into
+    one covered range. Only complete candles are stored.
+
+    If the size of all files exceeds ``maxsize`` the least recently used
+    files are evicted. If a single file exceeds ``maxsize`` its oldest
+    candles are dropped.
+
+    Params:
+
+      - ``path``: directory of the cache files
+
+      - ``maxsize`` (default: ``None``): max size in bytes of the cache,
+        ``None`` for no limit
+    '''
+
+    batchsize = 1000  # candles per batch read from or written to disk
+
+    def __init__(self, path, maxsize=None):
+        self.path = path
+        self.maxsize = maxsize
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._locks = collections.defaultdict(threading.Lock)
+
+    def candles(self, key, dtbegin, dtend, includeFirst, onlyComplete,
+                fetch, put):
+        '''Passes the candles of the requested range as ``OandaCandles`` to
+        put, missing candles are fetched with
+        ``fetch(dtbegin, dtend, includeFirst, onlyComplete, put)``.
+        Returns ``False`` if fetching failed.'''
+        with self._lock:
+            lock = self._locks[key]
+        with lock:
+            filename = self._filename(key)
+            db = self._open(filename)
+            try:
+                ret = self._candles(db, dtbegin, dtend, includeFirst,
+                                    onlyComplete, fetch, put)
+            finally:
+                db.close()
+            os.utime(filename)  # mark as recently used
+            self._evict(filename)
+        return ret
+
+    def _candles(self, db, dtbegin, dtend, includeFirst, onlyComplete,
+                 fetch, put):
+        start = _timestamp(dtbegin)
+        end = _timestamp(dtend) if dtend is not None else None
+
+        def wanted(t):
+            if t < start or (t == start and not includeFirst):
+                return False
+            return end is None or t <= end
+
+        # covered ranges overlapping the request, in order of time
+        sql = 'SELECT start, end FROM coverage WHERE end >= ?'
+        args = [start]
+        if end is not None:
+            sql += ' AND start <= ?'
+            args.append(end)
+        ranges = db.execute(sql + ' ORDER BY start', args).fetchall()
+
+        # walk the request: fetch the gaps, serve the covered ranges
+        pos, include = start, True  # the first candle is always fetched
+        for cstart, cend in ranges:
+            if cstart > pos:
+                # fetch missing part, up to the first cached candle
+                writer = _Writer(db, put, lambda t, lo=pos, hi=cstart: (
+                    lo < t < hi or t == lo == start) and wanted(t))
+                if not fetch(_datetime(pos), _datetime(cstart), include,
+                             True, writer.put):
+                    return False
+                writer.flush()
+                qstart, op = cstart, '>='
+            elif pos == start:
+                qstart, op = start, '>=' if includeFirst else '>'
+            else:
+                qstart, op = pos, '>'
+
+            # serve the cached part
+            sql = 'SELECT data FROM candles WHERE time {} ? AND time <= ?'
+            sql += ' ORDER BY time'
+            qend = cend if end is None else min(end, cend)
+            cursor = db.execute(sql.format(op), (qstart, qend))
+            while True:
+                rows = cursor.fetchmany(self.batchsize)
+                if not rows:
+                    break
+                put(OandaCandles.from_rows(
+                    json.loads(row[0]) for row in rows))
+            pos, include = cend, False
+
+        last = pos
+        if end is None or end > pos:
+            # fetch missing tail, after the last cached candle
+            writer = _Writer(db, put, lambda t: (
+                t > pos or (include and t == pos)) and wanted(t))
+            if not fetch(_datetime(pos), dtend, include, onlyComplete,
+                         writer.put):
+                return False
+            writer.flush()
+            if writer.last is not None:
+                last = max(last, writer.last)
+
+        # the request and the ranges it overlaps become one range, ranges
+        # not overlapping the request are kept as they are
+        first = min([start] + [x[0] for x in ranges])
+        db.execute('DELETE FROM coverage WHERE start >= ? AND end <= ?',
+                   (first, last))
+        db.execute('INSERT INTO coverage VALUES (?, ?)', (first, last))
+        db.commit()
+        return True
+
+    def _filename(self, key):
+        name = '-'.join(re.sub(r'[^A-Za-z0-9_]', '_', str(x)) for x in key)
+        return os.path.join(self.path, name + '.sqlite')
+
+    def _open(self, filename):
+        db = sqlite3.connect(filename)
+        db.execute('CREATE TABLE IF NOT EXISTS candles '
+                   '(time REAL PRIMARY KEY, data TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS coverage '
+                   '(start REAL, end REAL)')
+        return db
+
+    def _evict(self, current):
+        '''Evicts least recently used files, then the oldest candles of the
+        current file, until the cache fits into maxsize. Files in use by
+        other downloads are kept.'''
+        if self.maxsize is None:
+            return
+        with self._lock:
+            locks = dict((self._filename(key), lock)
+                         for key, lock in self._locks.items())
+            files = []
+            for name in os.listdir(self.path):
+                if not name.endswith('.sqlite'):
+                    continue
+                filename = os.path.join(self.path, name)
+                stat = os.stat(filename)
+                files.append((stat.st_mtime, stat.st_size, filename))
+            total = sum(x[1] for x in files)
+            for _, size, filename in sorted(files):
+                if total <= self.maxsize:
+                    return
+                if filename == current:
+                    continue
+                lock = locks.get(filename)
+                if lock is not None and not lock.acquire(False):
+                    continue  # open by another download
+                try:
+                    os.remove(filename)
+                except OSError:
+                    continue
+                finally:
+                    if lock is not None:
+                        lock.release()
+                total -= size
+        if total > self.maxsize:
+            self._trim(current)
+
+    def _trim(self, filename):
+        '''Drops the older half of the candles in the file'''
+        db = self._open(filename)
+        try:
+            row = db.execute('SELECT time FROM candles ORDER BY time '
+                             'LIMIT 1 OFFSET (SELECT COUNT(*) / 2 '
+                             'FROM candles)').fetchone()
+            if row is None:
+                return
+            db.execute('DELETE FROM candles WHERE time < ?', row)
+            db.execute('DELETE FROM coverage WHERE end < ?', row)
+            db.execute('UPDATE coverage SET start = ? WHERE start < ?',
+                       row * 2)
+            db.commit()
+            db.execute('VACUUM')
+        finally:
+            db.close()
+
+
+class _Writer(object):
+    '''Stores complete candles in batches and passes the wanted candles on'''
+
+    def __init__(self, db, put, wanted, batchsize=1000):
+        self.db = db
+        self._put = put
+        self.wanted = wanted
+        self.batchsize = batchsize
+        self.batch = []
+        self.last = None  # time of the last complete candle
+
+    def put(self, page):
+        wanted = []
+        for i, t in enumerate(page.time):
+            if page.complete[i]:
+                self.batch.append((t, json.dumps(page.row(i))))
+                self.last = t
+            if self.wanted(t):
+                wanted.append(i)
+        if len(self.batch) >= self.batchsize:
+            self.flush()
+        if len(wanted) == len(page):
+            self._put(page)
+        elif wanted:
+            self._put(page.take(wanted))
+
+    def flush(self):
+        if self.batch:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO candles VALUES (?, ?)', self.batch)
+            self.db.commit()
+            self.batch = []
+
+
+def _timestamp(dt):
+    '''Returns epoch seconds of a datetime, naive datetimes are in UTC'''
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _datetime(ts):
+    '''Returns a naive UTC datetime of epoch seconds'''
+    return datetime.utcfromtimestamp(ts)
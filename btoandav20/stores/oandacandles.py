@@ -0,0 +1,94 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from array import array
+
+
+class OandaCandles(object):
+    '''Columnar container for candles.
+
+    Keeps the candles of a response in compact arrays instead of one dict
+    per candle. The candles are decoded from the raw json of the candles
+    endpoint, without creating v20 model objects.
+
+    Member Attributes:
+      - time (array): candle times in epoch seconds
+      - volume (array): candle volumes
+      - complete (array): 1 if the candle is complete else 0
+      - bid, ask, mid (tuple): arrays of open, high, low and close prices
+        of the price component (empty arrays if not requested)
+
+    Use ``row`` or ``rows`` to get candles as dicts in the format of
+    ``v20.instrument.Candlestick.dict()``.
+    '''
+
+    SIDES = ('bid', 'ask', 'mid')
+    OHLC = ('o', 'h', 'l', 'c')
+
+    def __init__(self):
+        self.time = array('d')
+        self.volume = array('d')
+        self.complete = array('b')
+        self.bid = self._ohlc()
+        self.ask = self._ohlc()
+        self.mid = self._ohlc()
+        self.sides = tuple(
+            (side, getattr(self, side)) for side in self.SIDES)
+
+    def _ohlc(self):
+        return tuple(array('d') for _ in self.OHLC)
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, candle):
+        '''Appends a candle as parsed from json, prices may be strings'''
+        self.time.append(float(candle['time']))
+        self.volume.append(float(candle.get('volume', 0)))
+        self.complete.append(1 if candle.get('complete', True) else 0)
+        for side, cols in self.sides:
+            price = candle.get(side)
+            if price is None:
+                continue
+            o, h, l, c = cols
+            o.append(float(price['o']))
+            h.append(float(price['h']))
+            l.append(float(price['l']))
+            c.append(float(price['c']))
+
+    def take(self, indices):
+        '''Returns new candles with the rows of the given indices'''
+        candles = OandaCandles()
+        candles.time.extend(self.time[i] for i in indices)
+        candles.volume.extend(self.volume[i] for i in indices)
+        candles.complete.extend(self.complete[i] for i in indices)
+        for (_, src), (_, dst) in zip(self.sides, candles.sides):
+            if not len(src[0]):
+                continue
+            for s, d in zip(src, dst):
+                d.extend(s[i] for i in indices)
+        return candles
+
+    def row(self, idx):
+        '''Returns the candle at idx as dict'''
+        candle = {
+            'time': '{:.9f}'.format(self.time[idx]),
+            'volume': int(self.volume[idx]),
+            'complete': bool(self.complete[idx]),
+        }
+        for side, cols in self.sides:
+            if len(cols[0]):
+                candle[side] = {k: v[idx] for k, v in zip(self.OHLC, cols)}
+        return candle
+
+    def rows(self):
+        '''Returns an iterator over all candles as dicts'''
+        return (self.row(i) for i in range(len(self)))
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''Creates candles from candle dicts'''
+        candles = cls()
+        for row in rows:
+            candles.append(row)
+        return candles
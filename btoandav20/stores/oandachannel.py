@@ -0,0 +1,110 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import threading
+import time as _time
+
+from backtrader.utils.py3 import queue
+
+
+class OandaChannelClosed(Exception):
+    '''Raised by ``put`` after the consumer closed the channel'''
+
+
+class OandaCandleChannel(object):
+    '''Bounded queue of candles between a download thread and its consumer.
+
+    The channel holds at most ``maxsize`` candles, ``put`` blocks the
+    download while the channel is full, so a consumer slower than the
+    network keeps only ``maxsize`` candles in memory. Items are candle dicts
+    (one candle) or ``OandaCandles`` (one candle per row), other items like
+    the end of transmission do not count.
+
+    ``get``, ``put``, ``qsize`` and ``empty`` behave like ``queue.Queue``.
+    The consumer calls ``close`` when it stops reading, the waiting and
+    following ``put`` raise ``OandaChannelClosed`` to end the download.
+
+    Params:
+
+      - ``maxsize`` (default: ``None``): max count of candles held, ``None``
+        for no limit. A single item larger than ``maxsize`` is let through
+        once the channel is empty
+    '''
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.closed = False
+        self._items = collections.deque()
+        self._candles = 0  # count of candles held
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _count(item):
+        if isinstance(item, dict):
+            return 1 if item else 0
+        try:
+            return len(item)
+        except TypeError:
+            return 0
+
+    def put(self, item, block=True, timeout=None):
+        '''Adds an item, blocks while the channel is full'''
+        count = self._count(item)
+        with self._cond:
+            if count and self.maxsize is not None:
+                tend = None if timeout is None else _time.monotonic() + timeout
+                while (self._candles and not self.closed
+                       and self._candles + count > self.maxsize):
+                    if not block:
+                        raise queue.Full
+                    if tend is None:
+                        self._cond.wait()
+                        continue
+                    remaining = tend - _time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Full
+                    self._cond.wait(remaining)
+            if self.closed:
+                raise OandaChannelClosed()
+            self._items.append((item, count))
+            self._candles += count
+            self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        '''Removes and returns an item, blocks while the channel is empty'''
+        with self._cond:
+            tend = None if timeout is None else _time.monotonic() + timeout
+            while not self._items:
+                if not block:
+                    raise queue.Empty
+                if tend is None:
+                    self._cond.wait()
+                    continue
+                remaining = tend - _time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            item, count = self._items.popleft()
+            self._candles -= count
+            self._cond.notify_all()
+            return item
+
+    def qsize(self):
+        '''Returns the count of items held'''
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def candles(self):
+        '''Returns the count of candles held'''
+        return self._candles
+
+    def close(self):
+        '''Drops all items and ends the download'''
+        with self._cond:
+            self.closed = True
+            self._items.clear()
+            self._candles = 0
+            self._cond.notify_all()
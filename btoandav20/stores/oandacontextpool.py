@@ -0,0 +1,78 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+import weakref
+
+
+class OandaContextPool(object):
+    '''Pool of v20 rest contexts with one context per thread.
+
+    A ``v20.Context`` keeps a ``requests`` session with keep-alive
+    connections, which must not be used by multiple threads at once. Every
+    thread checks out its own context on first use and keeps it until the
+    thread ends, then the context is returned to the pool and reused by
+    the next thread with its connections still open.
+
+    Params:
+
+      - ``factory``: callable returning a new ``v20.Context``
+
+      - ``size`` (default: ``4``): count of idle contexts kept open, also
+        the count of contexts connected by ``warm``
+    '''
+
+    def __init__(self, factory, size=4):
+        self._factory = factory
+        self.size = size
+        self._idle = []  # idle contexts, last returned is reused first
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.created = 0  # count of created contexts
+        self.reused = 0  # count of checkouts served by idle contexts
+
+    def context(self):
+        '''Returns the context of the current thread'''
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = _Holder(self._checkout())
+            # return the context when the thread ends
+            weakref.finalize(holder, self._checkin, holder.ctx)
+            self._local.holder = holder
+        return holder.ctx
+
+    def warm(self, func):
+        '''Connects the idle contexts by calling ``func(ctx)`` for each of
+        them concurrently'''
+        ctxs = [self._checkout() for _ in range(self.size)]
+        threads = [threading.Thread(target=func, args=(ctx,))
+                   for ctx in ctxs]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        for ctx in ctxs:
+            self._checkin(ctx)
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+        return self._factory()
+
+    def _checkin(self, ctx):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(ctx)
+                return
+        ctx._session.close()
+
+
+class _Holder(object):
+    '''Keeps the context of a thread in the thread local storage'''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
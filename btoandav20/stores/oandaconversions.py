@@ -0,0 +1,89 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time as _time
+
+
+class OandaHomeConversions(object):
+    '''Table of factors converting amounts of a currency into the account
+    currency.
+
+    The table is filled from the ``homeConversions`` of pricing requests,
+    which contain the factors of all currencies, and kept current by the
+    ``quoteHomeConversionFactors`` of the prices of the price stream. The
+    currencies of an instrument are taken from its name (``BASE_QUOTE``),
+    so a factor is a lookup of two dicts.
+
+    Params:
+
+      - ``fetch``: callable ``fetch(instrument)`` which requests the prices
+        of the instrument with home conversions and passes them to
+        ``update``
+
+      - ``staleness`` (default: ``10.0``): max age in seconds of factors
+        returned without calling ``fetch``
+    '''
+
+    def __init__(self, fetch, staleness=10.0):
+        self._fetch = fetch
+        self.staleness = staleness
+        self._factors = dict()  # (monotonic time, factor) by currency
+        self._currencies = dict()  # (base, quote) currency by instrument
+
+    def update(self, conversions):
+        '''Sets the factors of a list of ``homeConversions`` dicts'''
+        now = _time.monotonic()
+        for conv in conversions:
+            self._factors[conv['currency']] = (
+                now, float(conv['positionValue']))
+
+    def update_price(self, price):
+        '''Sets the factor of the quote currency of a price dict with
+        ``quoteHomeConversionFactors``'''
+        factors = price.get('quoteHomeConversionFactors')
+        if not factors:
+            return
+        quote = self.currencies(price['instrument'])[1]
+        self._factors[quote] = (
+            _time.monotonic(),
+            (float(factors['positiveUnits'])
+             + float(factors['negativeUnits'])) / 2.0)
+
+    def currencies(self, instrument):
+        '''Returns the base and quote currency of the instrument'''
+        res = self._currencies.get(instrument)
+        if res is None:
+            base, _, quote = instrument.partition('_')
+            res = self._currencies[instrument] = (base, quote)
+        return res
+
+    def rate(self, currency):
+        '''Returns the factor of the currency, ``None`` if the factor is not
+        known or stale'''
+        entry = self._factors.get(currency)
+        if entry is None or (
+                _time.monotonic() - entry[0] > self.staleness):
+            return None
+        return entry[1]
+
+    def factor(self, instrument, price=None):
+        '''Returns the factor converting amounts in the quote currency of the
+        instrument into the account currency, ``None`` if it is not known
+
+        If ``price`` is given, the factor is derived from the factor of the
+        base currency at this price, ex. to convert at the price of a
+        historical bar.'''
+        base, quote = self.currencies(instrument)
+        for fetch in (False, True):
+            if fetch:
+                self._fetch(instrument)
+            rate = self.rate(quote)
+            if rate == 1.0:
+                return rate  # quote currency is the account currency
+            if price:
+                brate = self.rate(base)
+                if brate is not None:
+                    return brate / price
+            if rate is not None:
+                return rate
+        return None
@@ -0,0 +1,92 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import threading
+
+from backtrader.utils.py3 import queue
+
+
+class OandaOrderDispatcher(object):
+    '''Sends orders with a pool of worker threads.
+
+    Orders are grouped by a key (the instrument). Orders with the same key
+    are sent strictly in the order they were put, one after the other,
+    while orders with different keys are sent in parallel by the workers.
+    A slow request only delays the orders of its own instrument.
+
+    Params:
+
+      - ``func``: callable ``func(item)`` sending one order
+
+      - ``key``: callable ``key(item)`` returning the key of an order
+
+      - ``workers`` (default: ``4``): count of worker threads
+
+      - ``error`` (default: ``None``): callable ``error(item, exception)``
+        called when ``func`` raises, the worker goes on with the next order
+    '''
+
+    def __init__(self, func, key, workers=4, error=None):
+        self._func = func
+        self._key = key
+        self._error = error
+        self._lock = threading.Lock()
+        self._pending = dict()  # deque of waiting items by active key
+        self._ready = queue.Queue()  # keys with items and no worker
+        self._threads = []
+        for _ in range(workers):
+            t = threading.Thread(target=self._t_worker)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item):
+        '''Queues an order, ``None`` stops the workers'''
+        if item is None:
+            for _ in self._threads:
+                self._ready.put(None)
+            return
+        key = self._key(item)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                # a worker is busy with the key, it takes the item next
+                pending.append(item)
+                return
+            self._pending[key] = collections.deque([item])
+        self._ready.put(key)
+
+    def qsize(self):
+        '''Returns the count of orders not yet sent'''
+        with self._lock:
+            return sum(len(x) for x in self._pending.values())
+
+    def _t_worker(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                break
+            with self._lock:
+                item = self._pending[key].popleft()
+            try:
+                self._func(item)
+            except Exception as e:
+                # a failed order must not end the worker, later orders of
+                # the key would wait forever
+                if self._error is not None:
+                    try:
+                        self._error(item, e)
+                    except Exception:
+                        pass
+            finally:
+                self._next(key)
+
+    def _next(self, key):
+        '''Releases the key after an order was sent'''
+        with self._lock:
+            if not self._pending[key]:
+                del self._pending[key]
+                return
+        # let other keys go first before the next item of this key
+        self._ready.put(key)
@@ -0,0 +1,91 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import os
+import threading
+import time as _time
+
+
+class OandaInstruments(object):
+    '''Registry of the instrument details of an account.
+
+    All instruments of the account are fetched with one request on first
+    use and served from memory afterwards. With ``path`` the instruments
+    are also kept on disk, so a restart within ``ttl`` makes no request at
+    all. Instruments missing in the registry are fetched on their own.
+
+    Params:
+
+      - ``fetch``: callable ``fetch(names)`` returning a list of instrument
+        dicts, all instruments of the account if names is ``None`` or
+        ``None`` if the request failed
+
+      - ``path`` (default: ``None``): file to keep the instruments in,
+        ``None`` to keep them in memory only
+
+      - ``ttl`` (default: ``86400``): seconds after which the instruments
+        get fetched again
+    '''
+
+    def __init__(self, fetch, path=None, ttl=86400):
+        self._fetch = fetch
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._instruments = dict()  # instrument details by name
+        self._time = None  # time when the instruments were fetched
+
+    def get(self, names=None):
+        '''Returns the instrument dicts of names, all instruments if names
+        is ``None``. Returns ``None`` if none of the instruments is known'''
+        with self._lock:
+            if self._time is None or _time.time() - self._time > self.ttl:
+                self._refresh()
+            if names is None:
+                return list(self._instruments.values()) or None
+            missing = [x for x in names if x not in self._instruments]
+            if missing:
+                for inst in self._fetch(missing) or []:
+                    self._instruments[inst['name']] = inst
+            res = [self._instruments[x] for x in names
+                   if x in self._instruments]
+        return res or None
+
+    def _refresh(self):
+        if self._time is None and self._read():
+            return
+        instruments = self._fetch(None)
+        if instruments is None:
+            return
+        self._instruments = {x['name']: x for x in instruments}
+        self._time = _time.time()
+        self._write()
+
+    def _read(self):
+        '''Reads the instruments from disk, returns ``True`` if they are
+        still valid'''
+        if self.path is None:
+            return False
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if _time.time() - content['time'] > self.ttl:
+            return False
+        self._instruments = {x['name']: x for x in content['instruments']}
+        self._time = content['time']
+        return True
+
+    def _write(self):
+        if self.path is None:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'time': self._time,
+                       'instruments': list(self._instruments.values())}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,167 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from array import array
+from datetime import time
+
+from backtrader import TimeFrame
+
+US = 1000000  # microseconds per second
+DAY = 86400 * US
+WEEK = 7 * DAY
+SUNDAY = 3 * DAY  # the first sunday after the epoch (a thursday)
+
+
+def days_from_civil(year, month, day):
+    '''Returns the days since the epoch of a date of the gregorian
+    calendar'''
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def civil_from_days(days):
+    '''Returns year, month and day of the days since the epoch'''
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (month <= 2), month, day
+
+
+class OandaPeriods(object):
+    '''Start and end of the candle periods of a granularity.
+
+    Maps epoch seconds to the start and end of their candle period in
+    constant time with integer arithmetic on microseconds. The alignment of
+    the periods is precomputed for the granularity:
+
+      - seconds and minutes below an hour are aligned to the minute and
+        hour
+
+      - hours are aligned to the start of the trading day
+
+      - days start at ``sessionstart``, weeks on sunday at ``sessionstart``
+
+      - months start at the session start of the day holding their first
+        day at 00:00 (22:00 UTC of the last day of the previous month by
+        default)
+
+    OANDA has no candles of multiple days, weeks or months, the compression
+    of these timeframes is ignored. Times of other timeframes are returned
+    unchanged.
+
+    Params:
+
+      - ``timeframe``, ``compression``: granularity of the candles
+
+      - ``sessionstart`` (default: ``None``): ``datetime.time`` of the start
+        of the trading day in UTC, ``None`` for 22:00 (5:00 pm New York)
+    '''
+
+    def __init__(self, timeframe, compression, sessionstart=None):
+        if sessionstart is None:
+            sessionstart = time(hour=22, minute=0, second=0)
+        self.timeframe = timeframe
+        self.compression = compression
+        self.sessionstart = sessionstart
+        session = ((sessionstart.hour * 60 + sessionstart.minute) * 60
+                   + sessionstart.second) * US + sessionstart.microsecond
+
+        # periods of a size aligned within containers starting at origin
+        self._size = None
+        self._container = self._origin = 0
+        if timeframe == TimeFrame.Seconds:
+            self._size = compression * US
+            self._container = 60 * US
+        elif timeframe == TimeFrame.Minutes:
+            self._size = compression * 60 * US
+            if compression >= 60:
+                self._container, self._origin = DAY, session
+            else:
+                self._container = 3600 * US
+        elif timeframe == TimeFrame.Days:
+            self._size = self._container = DAY
+            self._origin = session
+        elif timeframe == TimeFrame.Weeks:
+            self._size = self._container = WEEK
+            self._origin = SUNDAY + session
+        self._months = timeframe == TimeFrame.Months
+        self._session = session
+
+    def _start(self, t):
+        '''Returns the start of the period holding t, in microseconds'''
+        if self._months:
+            # the session of the next month may start before its first day
+            year, month = self._month(t)
+            end = self._monthstart(year, month + 1)
+            return end if t >= end else self._monthstart(year, month)
+        if self._size is None:
+            return t
+        origin = self._origin
+        cstart = t - (t - origin) % self._container
+        return t - (t - cstart) % self._size
+
+    def _shift(self, start, count):
+        '''Returns the start of the period count periods after the period
+        starting at start, in microseconds'''
+        if not count:
+            return start
+        if self._months:
+            year, month = self._month(start + DAY)  # session starts early
+            return self._monthstart(year, month + count)
+        if self._size is None:
+            return start
+        return start + count * self._size
+
+    @staticmethod
+    def _month(t):
+        year, month, _ = civil_from_days(t // DAY)
+        return year, month
+
+    def _monthstart(self, year, month):
+        '''Returns the start of the month in microseconds, month may be
+        outside of 1 to 12'''
+        year += (month - 1) // 12
+        month = (month - 1) % 12 + 1
+        first = days_from_civil(year, month, 1) * DAY
+        # session start of the day holding the first at 00:00
+        return first - (first - self._session) % DAY
+
+    @staticmethod
+    def _us(ts):
+        return int(round(ts * US))
+
+    def start(self, ts, offset=0):
+        '''Returns the start of the period holding the epoch time ts as
+        epoch time, ``offset`` periods before (after if negative)'''
+        return self._shift(self._start(self._us(ts)), -offset) / US
+
+    def end(self, ts):
+        '''Returns the end of the period holding the epoch time ts, which is
+        the start of the next period'''
+        return self._shift(self._start(self._us(ts)), 1) / US
+
+    def period(self, ts):
+        '''Returns start and end of the period holding the epoch time ts'''
+        start = self._start(self._us(ts))
+        return start / US, self._shift(start, 1) / US
+
+    def starts(self, times, offset=0):
+        '''Returns the starts of the periods holding the epoch times of the
+        iterable times as ``array('d')``'''
+        start, shift, us = self._start, self._shift, self._us
+        return array('d', (shift(start(us(ts)), -offset) / US
+                           for ts in times))
+
+    def ends(self, times):
+        '''Returns the ends of the periods holding the epoch times of the
+        iterable times as ``array('d')``'''
+        return self.starts(times, offset=-1)
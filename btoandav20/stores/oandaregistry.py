@@ -0,0 +1,123 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+
+
+class OandaOrderRegistry(object):
+    '''Indexes between backtrader orders and OANDA orders and trades.
+
+    Every lookup done while processing a transaction is a dict access, so
+    the cost per transaction does not grow with the count of orders of a
+    session:
+
+      - order or trade id <-> ``oref`` of the backtrader order
+      - ``oref`` <-> trade id of the trade of the order
+      - ``oref`` <-> client id sent with the order
+
+    Orders which are done get removed with ``remove`` to keep the indexes
+    bounded in long running sessions. Changes are guarded by ``lock``, orders
+    are added by the transaction stream and removed by other threads.
+
+    Params:
+
+      - ``prefix``: prefix of the client ids, unique for the store instance
+    '''
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self._orefs = dict()  # oref by order or trade id
+        self._ids = dict()  # order and trade ids by oref, order id first
+        self._trades = dict()  # trade id by oref
+        self._trade_orefs = dict()  # set of orefs by trade id
+        self._client_ids = dict()  # client id by oref
+        self._client_orefs = dict()  # oref by client id
+
+    def __contains__(self, oid):
+        return oid in self._orefs
+
+    def __len__(self):
+        return len(self._orefs)
+
+    def add(self, oid, oref):
+        '''Maps an order or trade id to oref'''
+        with self.lock:
+            self._orefs[oid] = oref
+            self._ids.setdefault(oref, []).append(oid)
+
+    def oref(self, oid):
+        '''Returns the oref of an order or trade id, ``None`` if unknown'''
+        return self._orefs.get(oid)
+
+    def oid(self, oref):
+        '''Returns the order id of oref, ``None`` if unknown'''
+        ids = self._ids.get(oref)
+        if ids is None:
+            return None
+        return ids[0]
+
+    def ids(self, oref):
+        '''Returns the order and trade ids of oref'''
+        with self.lock:
+            return list(self._ids.get(oref, ()))
+
+    def set_trade(self, oref, trade_id):
+        '''Sets the trade of oref'''
+        with self.lock:
+            old = self._trades.get(oref)
+            if old == trade_id:
+                return
+            if old is not None:
+                self._discard_trade(old, oref)
+            self._trades[oref] = trade_id
+            self._trade_orefs.setdefault(trade_id, set()).add(oref)
+
+    def trade(self, oref):
+        '''Returns the trade id of oref, ``None`` if there is no open
+        trade'''
+        return self._trades.get(oref)
+
+    def close_trade(self, trade_id):
+        '''Removes a closed trade from all orefs'''
+        with self.lock:
+            for oref in self._trade_orefs.pop(trade_id, ()):
+                del self._trades[oref]
+
+    def remove(self, oref):
+        '''Removes oref from all indexes'''
+        with self.lock:
+            for oid in self._ids.pop(oref, ()):
+                if self._orefs.get(oid) == oref:
+                    del self._orefs[oid]
+            trade_id = self._trades.pop(oref, None)
+            if trade_id is not None:
+                self._discard_trade(trade_id, oref)
+            client_id = self._client_ids.pop(oref, None)
+            if client_id is not None:
+                del self._client_orefs[client_id]
+
+    def _discard_trade(self, trade_id, oref):
+        orefs = self._trade_orefs[trade_id]
+        orefs.discard(oref)
+        if not orefs:
+            del self._trade_orefs[trade_id]
+
+    def new_client_id(self, oref):
+        '''Returns the client id of oref, creates it for a new order'''
+        with self.lock:
+            client_id = self._client_ids.get(oref)
+            if client_id is None:
+                client_id = '{}-{}'.format(self.prefix, oref)
+                self._client_ids[oref] = client_id
+                self._client_orefs[client_id] = oref
+            return client_id
+
+    def client_id(self, oref):
+        '''Returns the client id of oref, ``None`` if unknown'''
+        return self._client_ids.get(oref)
+
+    def client_oref(self, client_id):
+        '''Returns the oref of a client id, ``None`` if the client id was not
+        created by this registry'''
+        return self._client_orefs.get(client_id)
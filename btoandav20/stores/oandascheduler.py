@@ -0,0 +1,118 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import heapq
+import itertools
+import threading
+import time as _time
+
+
+class OandaRequestScheduler(object):
+    '''Schedules rest requests by priority within a rate limit.
+
+    Every request takes a token of a token bucket before it is sent. The
+    bucket is refilled with ``rate`` tokens per second up to ``burst``
+    tokens. If no token is left, waiting requests are released by their
+    priority class and within a class in the order of arrival:
+
+        order > cancel > account > pricing > candles
+
+    A response with status 429 (too many requests) empties the bucket for
+    one second, the request is sent again up to ``retries`` times.
+
+    Params:
+
+      - ``rate`` (default: ``None``): requests per second, ``None`` for no
+        limit
+
+      - ``burst`` (default: ``None``): size of the bucket, ``None`` to use
+        ``rate``
+    '''
+
+    PRIORITIES = ('order', 'cancel', 'account', 'pricing', 'candles')
+
+    retries = 3  # resends of rate limited requests
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._refilled = _time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq) of waiting requests
+        self._seq = itertools.count()
+        self._stats = {prio: dict(requests=0, queued=0, throttled=0,
+                                  wait_total=0.0, wait_max=0.0)
+                       for prio in self.PRIORITIES}
+
+    def request(self, prio, func, *args, **kwargs):
+        '''Calls func with args and kwargs as soon as the rate limit and the
+        priority class allow it, returns the response of func'''
+        for _ in range(self.retries + 1):
+            self.acquire(prio)
+            response = func(*args, **kwargs)
+            if getattr(response, 'status', None) != 429:
+                break
+            self.throttle(prio)
+        return response
+
+    def acquire(self, prio):
+        '''Blocks until a request of the priority class may be sent'''
+        tstart = _time.monotonic()
+        ticket = (self.PRIORITIES.index(prio), next(self._seq))
+        stats = self._stats[prio]
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            stats['queued'] += 1
+            while True:
+                if self._waiting[0] != ticket:
+                    self._cond.wait()
+                    continue
+                wait = self._take()
+                if not wait:
+                    break
+                self._cond.wait(wait)
+            heapq.heappop(self._waiting)
+            self._cond.notify_all()
+
+            waited = _time.monotonic() - tstart
+            stats['queued'] -= 1
+            stats['requests'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+
+    def throttle(self, prio):
+        '''Empties the bucket for one second after being rate limited'''
+        with self._cond:
+            self._stats[prio]['throttled'] += 1
+            if self.rate is not None:
+                self._refill()
+                self._tokens = min(self._tokens, -self.rate)
+
+    def stats(self):
+        '''Returns per priority class the count of sent and queued requests,
+        the count of rate limited responses and the wait times in seconds'''
+        with self._cond:
+            res = dict()
+            for prio, stats in self._stats.items():
+                res[prio] = dict(stats)
+                res[prio]['wait_avg'] = (
+                    stats['wait_total'] / stats['requests']
+                    if stats['requests'] else 0.0)
+            return res
+
+    def _refill(self):
+        now = _time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _take(self):
+        '''Takes a token, returns the seconds to wait if there is none'''
+        if self.rate is None:
+            return 0
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
@@ -0,0 +1,110 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+import time as _time
+
+
+class _Flight(object):
+    '''A request in flight, waiters get its result when it is done'''
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OandaSingleFlight(object):
+    '''Shares the results of identical rest reads.
+
+    A read is identified by its priority class, the called api method and
+    its arguments. While a read is in flight, identical reads wait for it and
+    get its result instead of sending a request of their own. A finished
+    result is returned for ``ttl`` seconds to absorb bursts of reads.
+
+    Results are shared by all callers and must not be modified. Reads of a
+    priority class started before ``invalidate`` are neither joined nor
+    cached afterwards.
+
+    Params:
+
+      - ``send``: callable ``send(prio, func, *args, **kwargs)`` sending a
+        request
+
+      - ``ttl`` (default: ``0.0``): seconds a result is returned without a
+        request, ``0`` only shares reads in flight
+    '''
+
+    def __init__(self, send, ttl=0.0):
+        self._send = send
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._flights = dict()  # flight by key
+        self._results = dict()  # (monotonic time, result) by key by prio
+        self._generations = dict()  # invalidation count by prio
+        self._stats = dict()  # counters by prio
+
+    def request(self, prio, func, *args, **kwargs):
+        '''Returns the response of func called with args and kwargs, sends
+        the request only if no identical read is in flight or cached'''
+        key = (prio, func.__module__, func.__name__, args,
+               tuple(sorted(kwargs.items())))
+        leader = False  # this thread sends the request
+        with self._lock:
+            stats = self._stats.setdefault(
+                prio, dict(reads=0, shared=0, cached=0))
+            stats['reads'] += 1
+            entry = self._results.get(prio, {}).get(key)
+            if entry is not None:
+                if _time.monotonic() - entry[0] <= self.ttl:
+                    stats['cached'] += 1
+                    return entry[1]
+                del self._results[prio][key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                stats['shared'] += 1
+            else:
+                flight = _Flight(self._generations.get(prio, 0))
+                self._flights[key] = flight
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._send(prio, func, *args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                # only successful responses are cached
+                if (flight.error is None and self.ttl > 0 and
+                        getattr(flight.result, 'status', 200) == 200 and
+                        flight.generation == self._generations.get(prio, 0)):
+                    self._results.setdefault(prio, {})[key] = (
+                        _time.monotonic(), flight.result)
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, prio):
+        '''Drops the cached results and the reads in flight of a priority
+        class, reads in flight still return to their callers'''
+        with self._lock:
+            self._generations[prio] = self._generations.get(prio, 0) + 1
+            self._results.pop(prio, None)
+            for key in [x for x in self._flights if x[0] == prio]:
+                del self._flights[key]
+
+    def stats(self):
+        '''Returns per priority class the count of reads, of reads sharing a
+        request in flight and of reads returning a cached result'''
+        with self._lock:
+            return dict((prio, dict(stats))
+                        for prio, stats in self._stats.items())
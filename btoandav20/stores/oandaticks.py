@@ -0,0 +1,106 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import threading
+import time as _time
+
+from backtrader.utils.py3 import queue
+
+
+class OandaTickQueue(object):
+    '''Queue of the price stream which conflates prices not yet consumed.
+
+    A consumer slower than the price stream gets the latest price instead
+    of working through all prices since its last get:
+
+      - ``last``: a new price replaces a price not yet consumed, the
+        replaced price is counted in ``dropped``
+
+      - ``ohlc``: a new price is merged into a price not yet consumed and
+        counted in ``merged``. The merged price is the latest price with
+        ``conflated`` holding the open, high, low and close of the bid, ask
+        and mid prices (mid not rounded) and the ``count`` of prices since
+        the last get
+
+    Messages other than prices (errors of the stream) are never conflated.
+    ``get``, ``put``, ``qsize`` and ``empty`` behave like ``queue.Queue``.
+
+    Params:
+
+      - ``mode`` (default: ``last``): ``last`` or ``ohlc``
+    '''
+
+    MODES = ('last', 'ohlc')
+
+    def __init__(self, mode='last'):
+        if mode not in self.MODES:
+            raise ValueError('Unknown conflation mode {}'.format(mode))
+        self.mode = mode
+        self.dropped = 0  # prices replaced by a later price
+        self.merged = 0  # prices merged into a later price
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item, block=True, timeout=None):
+        '''Adds an item, a price replaces or is merged into the last price
+        not yet consumed'''
+        with self._cond:
+            items = self._items
+            if 'bids' in item and items and 'bids' in items[-1]:
+                if self.mode == 'last':
+                    items[-1] = item
+                    self.dropped += 1
+                else:
+                    items[-1] = self._merge(items[-1], item)
+                    self.merged += 1
+            else:
+                items.append(item)
+            self._cond.notify()
+
+    def _merge(self, price, item):
+        # a merged price was created by the queue and can be updated
+        conflated = price.get('conflated') or self._ohlc(price)
+        bid = float(item['bids'][0]['price'])
+        ask = float(item['asks'][0]['price'])
+        for side, value in (('bid', bid), ('ask', ask),
+                            ('mid', (bid + ask) / 2)):
+            x = conflated[side]
+            if value > x[1]:
+                x[1] = value
+            elif value < x[2]:
+                x[2] = value
+            x[3] = value
+        conflated['count'] += 1
+        return dict(item, conflated=conflated)
+
+    @staticmethod
+    def _ohlc(price):
+        bid = float(price['bids'][0]['price'])
+        ask = float(price['asks'][0]['price'])
+        mid = (bid + ask) / 2
+        return {'bid': [bid] * 4, 'ask': [ask] * 4, 'mid': [mid] * 4,
+                'count': 1}
+
+    def get(self, block=True, timeout=None):
+        '''Removes and returns an item, blocks while the queue is empty'''
+        with self._cond:
+            tend = None if timeout is None else _time.monotonic() + timeout
+            while not self._items:
+                if not block:
+                    raise queue.Empty
+                if tend is None:
+                    self._cond.wait()
+                    continue
+                remaining = tend - _time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            return self._items.popleft()
+
+    def qsize(self):
+        '''Returns the count of items held'''
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
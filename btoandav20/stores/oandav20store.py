@@ -2,11 +2,15 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import collections
+import concurrent.futures
+import functools
 import threading
 import copy
 import json
+import os
 import time as _time
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 
 import v20
 
@@ -14,6 +18,16 @@ import backtrader as bt
 from backtrader.metabase import MetaParams
 from backtrader.utils.py3 import queue, with_metaclass
 from .oandaposition import OandaPosition
+from .oandacandlecache import OandaCandleCache
+from .oandacandles import OandaCandles
+from .oandachannel import OandaCandleChannel, OandaChannelClosed
+from .oandascheduler import OandaRequestScheduler
+from .oandasingleflight import OandaSingleFlight
+from .oandacontextpool import OandaContextPool
+from .oandainstruments import OandaInstruments
+from .oandaconversions import OandaHomeConversions
+from .oandaregistry import OandaOrderRegistry
+from .oandadispatcher import OandaOrderDispatcher
 
 class SerializableEvent(object):
     '''A threading.Event that can be serialized.'''
@@ -87,6 +101,76 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
      - ``notif_transactions`` (default: ``False``): notify store of all recieved
          transactions
+
+     - ``oapi_url`` (default: ``None``): url of the rest api to use instead
+         of the OANDA endpoints, ex. ``http://127.0.0.1:8080`` for a local
+         stand-in server
+
+     - ``oapi_stream_url`` (default: ``None``): url of the stream api to use
+         instead of the OANDA endpoints
+
+     - ``candle_cache`` (default: ``None``): directory of a on-disk cache for
+         historical candles, only missing candles will be fetched from OANDA.
+         ``None`` disables the cache
+
+     - ``candle_cache_size`` (default: ``1073741824``): max size in bytes of
+         the candle cache, least recently used instruments get evicted first
+
+     - ``candles_workers`` (default: ``1``): count of concurrent requests
+         when downloading historical candles, with more than one worker the
+         requested range gets split into windows which are fetched
+         concurrently
+
+     - ``candles_window`` (default: ``5000``): size of a download window in
+         candles (5000 is the max count allowed by OANDA per request)
+
+     - ``candles_buffer`` (default: ``50000``): max count of downloaded
+         candles held until the consumer gets them, the download waits while
+         the buffer is full. ``None`` for no limit
+
+     - ``request_rate`` (default: ``100``): max rest requests per second of
+         all threads, ``None`` for no limit. If the limit is reached, waiting
+         requests are sent by priority: orders, cancels, account, pricing,
+         candles (see ``get_request_stats``)
+
+     - ``rest_pool_size`` (default: ``4``): count of rest contexts kept
+         open for reuse, every thread uses its own context. The contexts get
+         connected on start
+
+     - ``request_ttl`` (default: ``0.5``): seconds the response of a rest
+         read (positions, prices, account, instruments, transactions) is
+         shared by identical reads. Identical reads in flight always share
+         one request, account reads are not shared across transactions of
+         the account. ``0`` only shares reads in flight
+
+     - ``instruments_cache`` (default: ``None``): directory to keep the
+         details of all instruments of the account in, ``None`` keeps them
+         in memory only. All instruments are fetched with one request
+
+     - ``instruments_ttl`` (default: ``86400``): seconds after which the
+         instrument details get fetched again
+
+     - ``pricing_staleness`` (default: ``10.0``): max age in seconds of the
+         prices of the price stream returned by ``get_pricing``/
+         ``get_pricings`` without a request, the prices are kept current by
+         the heartbeats of the stream. Prices of instruments not streamed
+         are always requested, ``0`` always requests all prices. Also the
+         max age of the currency conversion factors of ``get_conversion``
+
+     - ``order_retention`` (default: ``1000``): count of done orders
+         (completed, cancelled, rejected, expired) kept by the broker and
+         store, older ones get evicted. ``None`` keeps all orders
+
+     - ``order_retention_age`` (default: ``None``): seconds after which done
+         orders get evicted, ``None`` to only evict by count. The age is
+         also checked on every account poll (``account_poll_freq``)
+
+     - ``order_archive`` (default: ``None``): file to append evicted orders
+         to, one json object per line. ``None`` drops evicted orders
+
+     - ``order_workers`` (default: ``4``): count of threads sending orders.
+         Orders of one instrument are sent one after the other in the order
+         they were created, orders of different instruments in parallel
     '''
 
     params = dict(
@@ -105,6 +189,33 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         reconntimeout=5.0,
         # send store notification with recieved transactions
         notif_transactions=False,
+        # override of oanda api endpoints
+        oapi_url=None,
+        oapi_stream_url=None,
+        # on-disk candle cache
+        candle_cache=None,
+        candle_cache_size=1024 ** 3,
+        # concurrent candle download
+        candles_workers=1,
+        candles_window=5000,
+        candles_buffer=50000,
+        # rate limit of rest requests per second
+        request_rate=100,
+        # count of pooled rest contexts
+        rest_pool_size=4,
+        # seconds identical rest reads share a response
+        request_ttl=0.5,
+        # on-disk cache of instrument details
+        instruments_cache=None,
+        instruments_ttl=60 * 60 * 24,
+        # max age in seconds of prices served without a request
+        pricing_staleness=10.0,
+        # retention of done orders
+        order_retention=1000,
+        order_retention_age=None,
+        order_archive=None,
+        # threads sending orders
+        order_workers=4,
     )
 
     BrokerCls = None  # broker class will auto register
@@ -138,6 +249,15 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         (bt.TimeFrame.Months, 1): 'M',
     }
 
+    # Length of a period in seconds (months are using max days per month)
+    _PERIODS = {
+        bt.TimeFrame.Seconds: 1,
+        bt.TimeFrame.Minutes: 60,
+        bt.TimeFrame.Days: 60 * 60 * 24,
+        bt.TimeFrame.Weeks: 60 * 60 * 24 * 7,
+        bt.TimeFrame.Months: 60 * 60 * 24 * 31,
+    }
+
     # Order type matching with oanda
     _ORDEREXECS = {
         bt.Order.Market: 'MARKET',
@@ -169,6 +289,13 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
     # transactions which can be ignored
     _X_IGNORE_TRANS = ['DAILY_FINANCING',
                        'CLIENT_CONFIGURE']
+    # kind of transaction by transaction type
+    _X_KIND = dict(
+        [(x, 'create') for x in _X_CREATE_TRANS]
+        + [(x, 'fill') for x in _X_FILL_TRANS]
+        + [(x, 'cancel') for x in _X_CANCEL_TRANS]
+        + [(x, 'reject') for x in _X_REJECT_TRANS]
+        + [(x, 'ignore') for x in _X_IGNORE_TRANS])
 
     # Date format used
     _DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f000Z'
@@ -206,28 +333,94 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
         self._env = None  # reference to cerebro for general notifications
         self._evt_acct = SerializableEvent()
-        self._orders = collections.OrderedDict()  # map order.ref to order id
-        self._trades = collections.OrderedDict()  # map order.ref to trade id
+        # indexes between order.ref and order, trade and client ids
+        self._orders = OandaOrderRegistry(self._client_id_prefix)
+        self._order_archive = None  # file of evicted orders
         self._server_positions = collections.defaultdict(OandaPosition)
-        # init oanda v20 api context
-        self.oapi = v20.Context(
-            self._OAPI_URL[int(self.p.practice)],
-            poll_timeout=self.p.poll_timeout,
-            port=443,
-            ssl=True,
-            token=self.p.token,
-            datetime_format='UNIX',
-        )
+        self._account_tid = None  # last transaction id of account state
+        # shared price stream, map instrument to subscribed feed queues
+        self._price_queues = dict()
+        self._price_lock = threading.Lock()
+        self._price_thread = None  # thread running the shared price stream
+        self._price_instruments = ()  # instruments of the running stream
+        self._price_reload = False  # subscriptions changed, reconnect stream
+        self._price_http = None  # http response of the running price stream
+        # latest candles poller, map granularity to subscriptions
+        self._candle_polls = dict()
+        self._candle_wakeups = dict()  # wakes the poller of a granularity
+        self._candle_lock = threading.Lock()
+        # latest prices of the price stream as (monotonic time, price)
+        self._prices = dict()
+        # factors converting currencies into the account currency
+        self._conversions = OandaHomeConversions(
+            self._fetch_conversions, staleness=self.p.pricing_staleness)
+        self._candle_cache = None  # on-disk cache for historical candles
+        if self.p.candle_cache is not None:
+            self._candle_cache = OandaCandleCache(
+                self.p.candle_cache, maxsize=self.p.candle_cache_size)
+        self._candles_pool = None  # worker pool for concurrent downloads
+        # details of all instruments of the account
+        instruments_path = None
+        if self.p.instruments_cache is not None:
+            instruments_path = os.path.join(
+                self.p.instruments_cache,
+                'instruments-{}.json'.format(self.p.account))
+        self._instruments = OandaInstruments(
+            self._fetch_instruments, path=instruments_path,
+            ttl=self.p.instruments_ttl)
+        # all rest requests are scheduled by priority within the rate limit
+        self._scheduler = OandaRequestScheduler(rate=self.p.request_rate)
+        # identical rest reads share one request
+        self._flight = OandaSingleFlight(self._rest, ttl=self.p.request_ttl)
+        # init pool of oanda v20 api contexts, one context per thread
+        self._oapi_pool = OandaContextPool(
+            functools.partial(
+                v20.Context,
+                poll_timeout=self.p.poll_timeout,
+                token=self.p.token,
+                datetime_format='UNIX',
+                **self._get_endpoint(
+                    self.p.oapi_url,
+                    self._OAPI_URL[int(self.p.practice)])),
+            size=self.p.rest_pool_size)
+        self._oapi_warmed = False
 
         # init oanda v20 api stream context
         self.oapi_stream = v20.Context(
-            self._OAPI_STREAM_URL[int(self.p.practice)],
             stream_timeout=self.p.stream_timeout,
-            port=443,
-            ssl=True,
             token=self.p.token,
             datetime_format='UNIX',
-        )
+            **self._get_endpoint(
+                self.p.oapi_stream_url,
+                self._OAPI_STREAM_URL[int(self.p.practice)]))
+
+        # own context for the price stream, the response hook keeps the
+        # http response to close the stream when the subscriptions change
+        self._oapi_prices = v20.Context(
+            stream_timeout=self.p.stream_timeout,
+            token=self.p.token,
+            datetime_format='UNIX',
+            **self._get_endpoint(
+                self.p.oapi_stream_url,
+                self._OAPI_STREAM_URL[int(self.p.practice)]))
+        self._oapi_prices._session.hooks['response'].append(
+            self._price_stream_opened)
+
+    @property
+    def oapi(self):
+        '''Returns the oanda v20 api context of the current thread'''
+        return self._oapi_pool.context()
+
+    def _get_endpoint(self, url, hostname):
+        '''Returns hostname, port and ssl of the endpoint to use'''
+        if url is None:
+            return dict(hostname=hostname, port=443, ssl=True)
+        url = urlparse(url)
+        ssl = url.scheme == 'https'
+        return dict(
+            hostname=url.hostname,
+            port=url.port or (443 if ssl else 80),
+            ssl=ssl)
 
     def start(self, data=None, broker=None):
         # datas require some processing to kickstart data reception
@@ -235,6 +428,11 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
             self.cash = None
             return
 
+        if not self._oapi_warmed:
+            # connect the rest contexts before the first request
+            self._oapi_warmed = True
+            self._oapi_pool.warm(self._warm_context)
+
         if data is not None:
             self._env = data._env
             # For datas simulate a queue with None to kickstart co
@@ -245,8 +443,16 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
         elif broker is not None:
             self.broker = broker
-            self.streaming_events()
+            # get the account state before streaming its changes
             self.broker_threads()
+            self.streaming_events()
+
+    def _warm_context(self, ctx):
+        '''Opens the connection of a rest context'''
+        try:
+            self._rest('account', ctx.account.summary, self.p.account)
+        except (v20.V20ConnectionError, v20.V20Timeout) as e:
+            self.put_notification(str(e))
 
     def stop(self):
         # signal end of thread
@@ -254,6 +460,9 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
             self.q_ordercreate.put(None)
             self.q_orderclose.put(None)
             self.q_account.put(None)
+        if self._order_archive is not None:
+            self._order_archive.close()
+            self._order_archive = None
 
     def put_notification(self, msg, *args, **kwargs):
         '''Adds a notification'''
@@ -264,21 +473,36 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         self.notifs.append(None)  # put a mark / threads could still append
         return [x for x in iter(self.notifs.popleft, None)]
 
+    def get_request_stats(self):
+        '''Returns per priority class (order, cancel, account, pricing,
+        candles) the count of sent and queued requests, the count of rate
+        limited responses and the wait times in seconds
+
+        Priority classes with rest reads also have the count of reads, of
+        reads which shared a request in flight and of reads which got a
+        response within ``request_ttl``, ``saved`` is the count of requests
+        not sent.'''
+        stats = self._scheduler.stats()
+        for prio, reads in self._flight.stats().items():
+            reads['saved'] = reads['shared'] + reads['cached']
+            stats[prio].update(reads)
+        return stats
+
+    def _rest(self, prio, func, *args, **kwargs):
+        '''Sends a rest request through the scheduler'''
+        return self._scheduler.request(prio, func, *args, **kwargs)
+
+    def _rest_read(self, prio, func, *args, **kwargs):
+        '''Sends a rest read through the scheduler, identical reads share
+        one request. The response is shared and must not be modified'''
+        return self._flight.request(prio, func, *args, **kwargs)
+
     def get_positions(self):
         '''Returns the currently open positions'''
         try:
-            response = self.oapi.position.list_open(self.p.account)
-            pos = response.get('positions', 200)
-            # convert positions to dict
-            for idx, val in enumerate(pos):
-                pos[idx] = val.dict()
-            _utc_now = datetime.utcnow()
-            for p in pos:
-                size = float(p['long']['units']) + float(p['short']['units'])
-                price = (
-                    float(p['long']['averagePrice']) if size > 0
-                    else float(p['short']['averagePrice']))
-                self._server_positions[p['instrument']] = OandaPosition(size, price, dt=_utc_now)
+            response = self._rest_read(
+                'account', self.oapi.position.list_open, self.p.account)
+            pos = self._set_positions(response.get('positions', 200))
         except (v20.V20ConnectionError, v20.V20Timeout) as e:
             self.put_notification(str(e))
         except Exception as e:
@@ -303,36 +527,29 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
     def get_instrument(self, dataname):
         '''Returns details about the requested instrument'''
-        try:
-            response = self.oapi.account.instruments(
-                self.p.account,
-                instruments=dataname)
-            inst = response.get('instruments', 200)
-            # convert instruments to dict
-            for idx, val in enumerate(inst):
-                inst[idx] = val.dict()
-        except (v20.V20ConnectionError, v20.V20Timeout) as e:
-            self.put_notification(str(e))
-        except Exception as e:
-            self.put_notification(
-                self._create_error_notif(
-                    e, response))
-
-        try:
-            return inst[0]
-        except NameError:
+        inst = self._instruments.get([dataname])
+        if inst is None:
             return None
+        return inst[0]
 
     def get_instruments(self, dataname):
-        '''Returns details about available instruments'''
+        '''Returns details about available instruments, dataname is a comma
+        separated string or list of instruments or ``None`` for all
+        instruments'''
+        if isinstance(dataname, str):
+            dataname = dataname.split(',')
+        return self._instruments.get(dataname)
+
+    def _fetch_instruments(self, names):
+        '''Fetches details about instruments, all instruments of the account
+        if names is ``None``'''
         try:
-            response = self.oapi.account.instruments(
+            response = self._rest_read(
+                'account', self.oapi.account.instruments,
                 self.p.account,
-                instruments=dataname)
-            inst = response.get('instruments', 200)
+                instruments=','.join(names) if names else None)
             # convert instruments to dict
-            for idx, val in enumerate(inst):
-                inst[idx] = val.dict()
+            inst = [x.dict() for x in response.get('instruments', 200)]
         except (v20.V20ConnectionError, v20.V20Timeout) as e:
             self.put_notification(str(e))
         except Exception as e:
@@ -347,34 +564,52 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
     def get_pricing(self, dataname):
         '''Returns details about current price'''
-        try:
-            response = self.oapi.pricing.get(self.p.account,
-                                             instruments=dataname)
-            prices = response.get('prices', 200)
-            # convert prices to dict
-            for idx, val in enumerate(prices):
-                prices[idx] = val.dict()
-        except (v20.V20ConnectionError, v20.V20Timeout) as e:
-            self.put_notification(str(e))
-        except Exception as e:
-            self.put_notification(
-                self._create_error_notif(
-                    e, response))
-
-        try:
-            return prices[0]
-        except NameError:
+        prices = self.get_pricings(dataname)
+        if not prices:
             return None
+        return prices[0]
 
     def get_pricings(self, dataname):
-        '''Returns details about current prices'''
+        '''Returns details about current prices, dataname is a comma
+        separated string or list of instruments
+
+        Prices of the price stream are used if they are not older than
+        ``pricing_staleness``, the other prices are fetched with one
+        request.'''
+        if isinstance(dataname, str):
+            dataname = dataname.split(',')
+        now = _time.monotonic()
+        prices = dict()
+        missing = []
+        streamed = self._price_instruments
+        for name in dataname:
+            entry = self._prices.get(name) if name in streamed else None
+            if entry is not None and (
+                    now - entry[0] <= self.p.pricing_staleness):
+                prices[name] = entry[1]
+            else:
+                missing.append(name)
+        if missing:
+            fetched = self._fetch_pricings(missing)
+            if fetched is None and not prices:
+                return None
+            for price in fetched or []:
+                prices[price['instrument']] = price
+        return [prices[x] for x in dataname if x in prices]
+
+    def _fetch_pricings(self, names):
+        '''Fetches current prices and updates the conversion factors'''
         try:
-            response = self.oapi.pricing.get(self.p.account,
-                                             instruments=dataname)
-            prices = response.get('prices', 200)
+            response = self._rest_read(
+                'pricing', self.oapi.pricing.get,
+                self.p.account,
+                instruments=','.join(names),
+                includeHomeConversions=True)
             # convert prices to dict
-            for idx, val in enumerate(prices):
-                prices[idx] = val.dict()
+            prices = [x.dict() for x in response.get('prices', 200)]
+            conversions = response.body.get('homeConversions')
+            if conversions:
+                self._conversions.update([x.dict() for x in conversions])
         except (v20.V20ConnectionError, v20.V20Timeout) as e:
             self.put_notification(str(e))
         except Exception as e:
@@ -387,16 +622,31 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         except NameError:
             return None
 
+    def get_conversion(self, dataname, price=None):
+        '''Returns the factor converting amounts in the quote currency of the
+        instrument into the account currency, ``None`` if not available
+
+        Factors of the price stream or of previous requests are used if they
+        are not older than ``pricing_staleness``. With ``price`` the factor
+        is derived from the base currency at this price of the instrument.'''
+        return self._conversions.factor(dataname, price)
+
+    def _fetch_conversions(self, dataname):
+        '''Fetches the conversion factors of all currencies together with
+        the price of the instrument'''
+        self._fetch_pricings([dataname])
+
     def get_transactions_range(self, from_id, to_id, exclude_outer=False):
         '''Returns all transactions between range'''
         try:
-            response = self.oapi.transaction.range(
+            response = self._rest_read(
+                'account', self.oapi.transaction.range,
                 self.p.account,
                 fromID=from_id,
                 toID=to_id)
             transactions = response.get('transactions', 200)
             if exclude_outer:
-                del transactions[0], transactions[-1]
+                transactions = transactions[1:-1]
 
         except (v20.V20ConnectionError, v20.V20Timeout) as e:
             self.put_notification(str(e))
@@ -413,7 +663,8 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
     def get_transactions_since(self, id):
         '''Returns all transactions since id'''
         try:
-            response = self.oapi.transaction.since(
+            response = self._rest_read(
+                'account', self.oapi.transaction.since,
                 self.p.account,
                 id=id)
             transactions = response.get('transactions', 200)
@@ -454,10 +705,12 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         t.daemon = True
         t.start()
 
-        self.q_ordercreate = queue.Queue()
-        t = threading.Thread(target=self._t_order_create)
-        t.daemon = True
-        t.start()
+        # orders are sent in sequence per instrument by a pool of workers
+        self.q_ordercreate = OandaOrderDispatcher(
+            self._order_create,
+            key=lambda msg: msg[1]['instrument'],
+            workers=self.p.order_workers,
+            error=self._order_create_failed)
 
         self.q_orderclose = queue.Queue()
         t = threading.Thread(target=self._t_order_cancel)
@@ -476,15 +729,108 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
         t.start()
         return q
 
-    def streaming_prices(self, dataname):
-        '''Creates threads for price streaming'''
+    def streaming_prices(self, dataname, q=None):
+        '''Subscribes to the shared price stream and returns a queue
+        which receives the prices of the given instrument, ``q`` is used as
+        queue if given
+
+        All subscriptions share one stream connection and one thread. If the
+        instrument is not part of the running stream, the stream will be
+        reconnected with the new set of instruments.'''
+        if q is None:
+            q = queue.Queue()
+        with self._price_lock:
+            self._price_queues[dataname] = (
+                self._price_queues.get(dataname, []) + [q])
+            if dataname not in self._price_instruments:
+                self._reload_price_stream()
+            if self._price_thread is None:
+                t = threading.Thread(target=self._t_streaming_prices)
+                t.daemon = True
+                self._price_thread = t
+                t.start()
+        return q
+
+    def streaming_prices_stop(self, q):
+        '''Removes a queue returned by ``streaming_prices`` from the shared
+        price stream'''
+        with self._price_lock:
+            for dataname, queues in list(self._price_queues.items()):
+                if q not in queues:
+                    continue
+                queues = [x for x in queues if x is not q]
+                if queues:
+                    self._price_queues[dataname] = queues
+                else:
+                    del self._price_queues[dataname]
+                    self._reload_price_stream()
+
+    def _reload_price_stream(self):
+        '''Reconnects the running price stream with the current
+        subscriptions, called with the price lock held
+
+        The response of the stream is closed, which unblocks the stream
+        thread at once instead of on the next message.'''
+        self._price_reload = True
+        http = self._price_http
+        if http is None:
+            return
+        self._price_http = None
+        try:
+            shutdown = getattr(http.raw, 'shutdown', None)  # urllib3 >= 2.3
+            if shutdown is not None:
+                shutdown()
+            http.close()
+        except Exception:
+            pass
+
+    def _price_stream_opened(self, http, *args, **kwargs):
+        '''Response hook of the price stream context, keeps the http response
+        of the running stream'''
+        with self._price_lock:
+            self._price_http = http
+        return http
+
+    def polling_candles(self, dataname, timeframe, compression,
+                        candleFormat, delay=1.0):
+        '''Subscribes to the latest candles poller and returns a queue which
+        receives every new complete candle of the instrument as dict
+
+        One thread per granularity polls the latest candles of all
+        subscribed instruments with one request, ``delay`` seconds after the
+        end of every period (at least every hour). A new subscription is
+        polled at once and receives the latest complete candle. Candles
+        missed by failed or late polls are fetched before the latest one.'''
+        granularity = self.get_granularity(timeframe, compression)
         q = queue.Queue()
-        kwargs = {'q': q, 'dataname': dataname}
-        t = threading.Thread(target=self._t_streaming_prices, kwargs=kwargs)
-        t.daemon = True
-        t.start()
+        sub = dict(q=q, instrument=dataname, price=candleFormat, delay=delay,
+                   last=float('-inf'))
+        with self._candle_lock:
+            subs = self._candle_polls.get(granularity)
+            if subs is None:
+                self._candle_polls[granularity] = subs = []
+                self._candle_wakeups[granularity] = threading.Event()
+                t = threading.Thread(
+                    target=self._t_polling_candles,
+                    args=(granularity,
+                          self._PERIODS[timeframe] * compression))
+                t.daemon = True
+                t.start()
+            subs.append(sub)
+            self._candle_wakeups[granularity].set()
         return q
 
+    def polling_candles_stop(self, q):
+        '''Removes a queue returned by ``polling_candles`` from the latest
+        candles poller'''
+        with self._candle_lock:
+            for granularity, subs in self._candle_polls.items():
+                self._candle_polls[granularity] = [
+                    x for x in subs if x['q'] is not q]
+                if not self._candle_polls[granularity]:
+                    # end the poller without waiting for the next period
+                    self._candle_wakeups[granularity].set()
+
     def order_create(self, order, stopside=None, takeside=None, **kwargs):
         '''Creates an order'''
         okwargs = dict()
@@ -527,7 +873,7 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                         trailamount,
                         '.%df' % order.data.contractdetails['displayPrecision']),
                     clientExtensions=v20.transaction.ClientExtensions(
-                        id=self._oref_to_client_id(stopside.ref),
+                        id=self._orders.new_client_id(stopside.ref),
                         comment=json.dumps(order.info)
                     ).dict()
                 ).dict()
@@ -537,7 +883,7 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                         stopside.price,
                         '.%df' % order.data.contractdetails['displayPrecision']),
                     clientExtensions=v20.transaction.ClientExtensions(
-                        id=self._oref_to_client_id(stopside.ref),
+                        id=self._orders.new_client_id(stopside.ref),
                         comment=json.dumps(order.info)
                     ).dict()
                 ).dict()
@@ -548,14 +894,14 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                     takeside.price,
                     '.%df' % order.data.contractdetails['displayPrecision']),
                 clientExtensions=v20.transaction.ClientExtensions(
-                    id=self._oref_to_client_id(takeside.ref),
+                    id=self._orders.new_client_id(takeside.ref),
                     comment=json.dumps(order.info)
                 ).dict()
             ).dict()
 
         # store backtrader order ref in client extensions
         okwargs['clientExtensions'] = v20.transaction.ClientExtensions(
-            id=self._oref_to_client_id(order.ref),
+            id=self._orders.new_client_id(order.ref),
             comment=json.dumps(order.info)
         ).dict()
 
@@ -571,52 +917,92 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
 
         return order
 
+    def order_evict(self, oref, record=None):
+        '''Removes a done order from the indexes of the store, record is a
+        dict describing the order which is written to ``order_archive``'''
+        if record is not None and self.p.order_archive is not None:
+            record['ids'] = self._orders.ids(oref)
+            record['clientID'] = self._orders.client_id(oref)
+            if self._order_archive is None:
+                self._order_archive = open(self.p.order_archive, 'a')
+            self._order_archive.write(json.dumps(record) + '\n')
+        self._orders.remove(oref)
+
     def order_cancel(self, order):
         '''Cancels a order'''
         self.q_orderclose.put(order.ref)
         return order
 
     def candles(self, dataname, dtbegin, dtend, timeframe, compression,
-                candleFormat, includeFirst=True, onlyComplete=True):
-        '''Returns historical rates'''
-        q = queue.Queue()
+                candleFormat, includeFirst=True, onlyComplete=True,
+                columnar=False):
+        '''Returns historical rates
+
+        The queue receives every candle as dict. With ``columnar`` the queue
+        receives ``OandaCandles`` holding the candles of one response. The
+        queue is a ``OandaCandleChannel`` holding at most ``candles_buffer``
+        candles, closing it stops the download.
+        '''
+        q = OandaCandleChannel(maxsize=self.p.candles_buffer)
         kwargs = {'dataname': dataname, 'dtbegin': dtbegin, 'dtend': dtend,
                   'timeframe': timeframe, 'compression': compression,
                   'candleFormat': candleFormat, 'includeFirst': includeFirst,
-                  'onlyComplete': onlyComplete, 'q': q}
+                  'onlyComplete': onlyComplete, 'columnar': columnar, 'q': q}
         t = threading.Thread(target=self._t_candles, kwargs=kwargs)
         t.daemon = True
         t.start()
         return q
 
     def _oref_to_client_id(self, oref):
-        '''Converts a oref to client id'''
-        id = '{}-{}'.format(self._client_id_prefix, oref)
-        return id
+        '''Converts a oref to client id, ``None`` if the order is unknown'''
+        return self._orders.client_id(oref)
 
     def _client_id_to_oref(self, client_id):
         '''Converts a client id to oref'''
-        oref = None
-        if str(client_id).startswith(self._client_id_prefix):
-            oref = int(str(client_id)[len(self._client_id_prefix)+1:])
-        return oref
+        return self._orders.client_oref(str(client_id))
 
     def _t_account(self):
-        '''Callback method for account request'''
+        '''Callback method for account request
+
+        The first request fetches the full account summary and positions,
+        afterwards only the changes since the last seen transaction are
+        requested. Fills of the transaction stream trigger an immediate
+        request.
+        '''
         while True:
             try:
                 msg = self.q_account.get(timeout=self.p.account_poll_freq)
+                # coalesce pending requests
+                while msg is not None and not self.q_account.empty():
+                    msg = self.q_account.get()
                 if msg is None:
                     break  # end of thread
             except queue.Empty:  # tmout -> time to refresh
                 pass
 
-            try:
-                response = self.oapi.account.summary(self.p.account)
-                accinfo = response.get('account', 200)
+            if self.broker is not None:
+                # evict orders by age also if no more orders are done
+                self.broker._evict()
 
-                response = self.oapi.position.list_open(self.p.account)
-                pos = response.get('positions', 200)
+            try:
+                if self._account_tid is None:
+                    response = self._rest_read(
+                        'account', self.oapi.account.summary, self.p.account)
+                    accinfo = response.get('account', 200)
+                    tid = response.get('lastTransactionID', 200)
+
+                    response = self._rest_read(
+                        'account', self.oapi.position.list_open,
+                        self.p.account)
+                    pos = response.get('positions', 200)
+                else:
+                    response = self._rest_read(
+                        'account', self.oapi.account.changes,
+                        self.p.account,
+                        sinceTransactionID=self._account_tid)
+                    changes = response.get('changes', 200)
+                    state = response.get('state', 200)
+                    tid = response.get('lastTransactionID', 200)
             except (v20.V20ConnectionError, v20.V20Timeout) as e:
                 self.put_notification(str(e))
                 if self.p.reconnections == 0:
@@ -627,33 +1013,69 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                 self.put_notification(
                     self._create_error_notif(
                         e, response))
+                if self._account_tid is not None:
+                    # fetch a full summary on next request
+                    self._account_tid = None
+                    continue
                 return
 
             try:
-                self._cash = accinfo.marginAvailable
-                self._value = accinfo.balance
-                self._currency = accinfo.currency
-                self._leverage = 1/accinfo.marginRate
-
-                #reset
-                self._server_positions = collections.defaultdict(OandaPosition)
-                #Position
-                # convert positions to dict
-                _utc_now = datetime.utcnow()
-                for idx, val in enumerate(pos):
-                    pos[idx] = val.dict()
-                for p in pos:
-                    size = float(p['long']['units']) + float(p['short']['units'])
-                    price = (
-                        float(p['long']['averagePrice']) if size > 0
-                        else float(p['short']['averagePrice']))
-                    self._server_positions[p['instrument']] = OandaPosition(size, price,dt=_utc_now)
+                if self._account_tid is None:
+                    self._cash = accinfo.marginAvailable
+                    self._value = accinfo.balance
+                    self._currency = accinfo.currency
+                    self._leverage = 1/accinfo.marginRate
+
+                    #reset
+                    self._server_positions = collections.defaultdict(
+                        OandaPosition)
+                    self._set_positions(pos)
+                else:
+                    self._cash = state.marginAvailable
+                    for trans in changes.transactions or []:
+                        balance = getattr(trans, 'accountBalance', None)
+                        if balance is not None:
+                            self._value = balance
+                    self._set_positions(changes.positions or [])
+                self._account_tid = tid
             except KeyError:
                 pass
 
             # notify of success, initialization waits for it
             self._evt_acct.set()
 
+    def _set_positions(self, pos):
+        '''Sets the server positions of v20 positions, returns the positions
+        converted to dicts'''
+        # convert positions to dict
+        _utc_now = datetime.utcnow()
+        pos = [x.dict() for x in pos]
+        for p in pos:
+            size = float(p['long']['units']) + float(p['short']['units'])
+            price = (
+                float(p['long']['averagePrice']) if size > 0
+                else float(p['short'].get('averagePrice', 0.0)))
+            self._server_positions[p['instrument']] = OandaPosition(
+                size, price, dt=_utc_now)
+        return pos
+
+    def _update_account(self, trans):
+        '''Updates balance and positions with a transaction of the stream,
+        fills trigger a request of the account changes to update the
+        margin and to reconcile the positions
+
+        The units and price of a fill are the net of its opened, reduced
+        and closed trades.'''
+        # account reads sent before the transaction are outdated
+        self._flight.invalidate('account')
+        balance = trans.get('accountBalance')
+        if balance is not None:
+            self._value = float(balance)
+        if self._X_KIND.get(trans['type']) == 'fill':
+            self._server_positions[trans['instrument']].update(
+                float(trans['units']), float(trans['price']))
+            self.q_account.put(True)
+
     def _t_streaming_events(self, q):
         '''Callback method for streaming events'''
         last_id = None
@@ -677,12 +1099,13 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                                 last_id)
                             for t in old_transactions:
                                 if msg_type == 'transaction.Transaction':
-                                    if t.id > last_id:
+                                    if int(t.id) > int(last_id):
                                         self._transaction(t.dict())
                                         last_id = t.id
                         reconnections = 0
                     if msg_type == 'transaction.Transaction':
-                        if not last_id or msg.id > last_id:
+                        # ids are numeric strings, compare them as numbers
+                        if not last_id or int(msg.id) > int(last_id):
                             self._transaction(msg.dict())
                             last_id = msg.id
 
@@ -705,47 +1128,246 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                     self._create_error_notif(
                         e, response))
 
-    def _t_streaming_prices(self, dataname, q):
-        '''Callback method for streaming prices'''
-        try:
-            response = self.oapi_stream.pricing.stream(
-                self.p.account,
-                instruments=dataname,
-            )
-            # process response
-            for msg_type, msg in response.parts():
-                if msg_type == 'pricing.ClientPrice':
-                    # put price into queue as dict
-                    q.put(msg.dict())
-        except (v20.V20ConnectionError, v20.V20Timeout) as e:
-            self.put_notification(str(e))
-            # notify feed of error
-            q.put({'msg': 'CONNECTION_ISSUE'})
-        except Exception as e:
-            self.put_notification(
-                self._create_error_notif(
-                    e, response))
+    def _t_streaming_prices(self):
+        '''Callback method for the shared price stream'''
+        while True:
+            with self._price_lock:
+                instruments = tuple(sorted(self._price_queues))
+                if not instruments:
+                    # no more subscriptions, end of thread
+                    self._price_thread = None
+                    self._price_instruments = ()
+                    return
+                self._price_instruments = instruments
+                self._price_reload = False
+
+            response = None
+            try:
+                response = self._oapi_prices.pricing.stream(
+                    self.p.account,
+                    instruments=','.join(instruments),
+                )
+                with self._price_lock:
+                    if self._price_reload:
+                        # subscriptions changed while connecting
+                        self._reload_price_stream()
+                        continue
+                # process response
+                for msg_type, msg in response.parts():
+                    if msg_type == 'pricing.ClientPrice':
+                        # put price into the queues of the instrument as dict
+                        price = msg.dict()
+                        self._prices[price['instrument']] = (
+                            _time.monotonic(), price)
+                        self._conversions.update_price(price)
+                        for q in self._price_queues.get(
+                                price['instrument'], ()):
+                            q.put(price)
+                    elif msg_type == 'pricing.PricingHeartbeat':
+                        # prices are only sent on change, the heartbeat
+                        # confirms the latest prices are still current
+                        now = _time.monotonic()
+                        for name in instruments:
+                            entry = self._prices.get(name)
+                            if entry is not None:
+                                self._prices[name] = (now, entry[1])
+                    if self._price_reload:
+                        break  # reconnect with the current subscriptions
+                else:
+                    if self._price_reload:
+                        continue  # closed to reconnect
+                    # stream was closed by the server
+                    self._streaming_prices_broken()
+                    return
+            except (v20.V20ConnectionError, v20.V20Timeout) as e:
+                if self._price_reload:
+                    continue  # closed to reconnect
+                self.put_notification(str(e))
+                self._streaming_prices_broken()
+                return
+            except Exception as e:
+                if self._price_reload:
+                    continue  # closed to reconnect
+                self.put_notification(
+                    self._create_error_notif(
+                        e, response))
+                self._streaming_prices_broken()
+                return
+            finally:
+                with self._price_lock:
+                    if self._price_http is not None:
+                        self._price_http.close()
+                        self._price_http = None
+
+    def _streaming_prices_broken(self):
+        '''Notifies all subscribed feeds of a broken price stream, feeds
+        will subscribe again when reconnecting'''
+        with self._price_lock:
+            price_queues = self._price_queues
+            self._price_queues = dict()
+            self._price_thread = None
+            self._price_instruments = ()
+        for queues in price_queues.values():
+            for q in queues:
+                q.put({'msg': 'CONNECTION_ISSUE'})
 
     def _t_candles(self, dataname, dtbegin, dtend, timeframe, compression,
-                   candleFormat, includeFirst, onlyComplete, q):
+                   candleFormat, includeFirst, onlyComplete, columnar, q):
         '''Callback method for candles request'''
         granularity = self.get_granularity(timeframe, compression)
         if granularity is None:
             q.put(None)
             return
 
+        if columnar:
+            put = q.put
+        else:
+            def put(page):
+                for candle in page.rows():
+                    q.put(candle)
+
+        fetch = functools.partial(
+            self._get_candles, dataname, granularity, candleFormat)
+        if self.p.candles_workers > 1:
+            window = timedelta(seconds=(
+                self._PERIODS[timeframe] * compression
+                * self.p.candles_window))
+            fetch = functools.partial(
+                self._get_candles_concurrent, fetch, window)
+        try:
+            if self._candle_cache is not None and dtbegin is not None:
+                # serve from disk, only fetch missing candles
+                ok = self._candle_cache.candles(
+                    (dataname, granularity, candleFormat),
+                    dtbegin, dtend, includeFirst, onlyComplete, fetch, put)
+            else:
+                ok = fetch(dtbegin, dtend, includeFirst, onlyComplete, put)
+            if ok:
+                q.put({})  # end of transmission
+            else:
+                q.put(None)  # gave up fetching candles
+        except OandaChannelClosed:
+            pass  # consumer is gone
+
+    def iter_candles(self, dataname, dtbegin, dtend, timeframe, compression,
+                     candleFormat='M', includeFirst=True, onlyComplete=True,
+                     columnar=False):
+        '''Yields historical candles as dicts, with ``columnar`` as
+        ``OandaCandles`` holding the candles of one response
+
+        The candles are downloaded in the background while iterating, at
+        most ``candles_buffer`` candles are held. Closing the generator stops
+        the download. The iteration ends early if fetching candles was given
+        up, see ``get_notifications``.'''
+        q = self.candles(dataname, dtbegin, dtend, timeframe, compression,
+                         candleFormat, includeFirst=includeFirst,
+                         onlyComplete=onlyComplete, columnar=columnar)
+        try:
+            while True:
+                msg = q.get()
+                if msg is None or (isinstance(msg, dict) and not msg):
+                    return  # end of transmission or given up
+                yield msg
+        finally:
+            q.close()
+
+    def _get_candles_concurrent(self, fetch, window, dtbegin, dtend,
+                                includeFirst, onlyComplete, put):
+        '''Splits the range into windows which are fetched concurrently,
+        the candles are passed to put in order and without duplicates'''
+        if dtbegin is None:
+            return fetch(dtbegin, dtend, includeFirst, onlyComplete, put)
+        if self._candles_pool is None:
+            self._candles_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.p.candles_workers)
+
+        def naive(dt):
+            if dt is not None and dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+            return dt
+
+        def windows():
+            wbegin = naive(dtbegin)
+            last = naive(dtend) or datetime.utcnow()
+            while wbegin < last:
+                wend = wbegin + window
+                if wend >= last:
+                    # the last window without an end time fetches until now
+                    yield wbegin, dtend, dtend is not None
+                    return
+                yield wbegin, wend, True
+                wbegin = wend
+
+        def fetch_window(wbegin, wend, single, first):
+            pages = []
+            ok = fetch(wbegin, wend, includeFirst if first else True,
+                       onlyComplete, pages.append, single=single)
+            return ok, pages
+
+        # keep a bounded count of windows in flight, consume them in order
+        pending = collections.deque()
+        lasttime = None
+        try:
+            for idx, (wbegin, wend, single) in enumerate(windows()):
+                pending.append(self._candles_pool.submit(
+                    fetch_window, wbegin, wend, single, idx == 0))
+                if len(pending) < self.p.candles_workers * 2:
+                    continue
+                lasttime = self._put_candles(pending.popleft(), lasttime, put)
+                if lasttime is False:
+                    return False
+            while pending:
+                lasttime = self._put_candles(pending.popleft(), lasttime, put)
+                if lasttime is False:
+                    return False
+            return True
+        finally:
+            # windows not yet started are not needed after an error
+            for future in pending:
+                future.cancel()
+
+    def _put_candles(self, future, lasttime, put):
+        '''Passes the pages of a window to put, skipping candles already
+        seen at the window boundary. Returns the time of the last candle or
+        ``False`` if the window could not be fetched'''
+        ok, pages = future.result()
+        if not ok:
+            return False
+        for page in pages:
+            if lasttime is not None and page.time[0] <= lasttime:
+                page = page.take(
+                    [i for i, t in enumerate(page.time) if t > lasttime])
+                if not len(page):
+                    continue
+            put(page)
+            lasttime = page.time[-1]
+        return lasttime
+
+    def _get_candles(self, dataname, granularity, candleFormat, dtbegin,
+                     dtend, includeFirst, onlyComplete, put, single=False):
+        '''Fetches candles page by page and passes the candles of every page
+        as ``OandaCandles`` to put, returns ``False`` when giving up fetching
+        candles. With ``single`` the range is fetched with one request.'''
         dtkwargs = {}
         if dtbegin is not None:
-            dtkwargs['fromTime'] = dtbegin.strftime(self._DATE_FORMAT)
+            dtkwargs['from'] = dtbegin.strftime(self._DATE_FORMAT)
             dtkwargs['includeFirst'] = includeFirst
+        if single and dtend is not None:
+            dtkwargs['to'] = dtend.strftime(self._DATE_FORMAT)
+        tsend = None
+        if dtend is not None:
+            tzend = dtend if dtend.tzinfo else dtend.replace(
+                tzinfo=timezone.utc)
+            tsend = tzend.timestamp()
 
         count = 0
         reconnections = 0
         while True:
-            if count > 1:
+            if count >= 1:
+                # the last candle of the previous page starts the next one
                 dtkwargs['includeFirst'] = False
             try:
-                response = self.oapi.instrument.candles(
+                response = self._request_candles(
                     dataname,
                     granularity=granularity,
                     price=candleFormat,
@@ -758,7 +1380,7 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                 if (self.p.reconnections == 0 or self.p.reconnections > 0
                         and reconnections > self.p.reconnections):
                     self.put_notification('Giving up fetching candles')
-                    return
+                    return False
                 reconnections += 1
                 if self.p.reconntimeout is not None:
                     _time.sleep(self.p.reconntimeout)
@@ -773,36 +1395,152 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                         e, response))
                 continue
 
-            dtobj = None
+            page = OandaCandles()
+            ctime = None
             for candle in candles:
                 # get current candle time
-                dtobj = datetime.utcfromtimestamp(float(candle.time))
+                ctime = float(candle['time'])
                 # if end time is provided, check if time is reached for
                 # every candle
-                if dtend is not None and dtobj > dtend:
+                if tsend is not None and ctime > tsend:
                     break
                 # add candle
-                if not onlyComplete or candle.complete:
-                    q.put(candle.dict())
+                if not onlyComplete or candle['complete']:
+                    page.append(candle)
+            if len(page):
+                put(page)
 
-            if dtobj is not None:
-                dtkwargs['fromTime'] = dtobj.strftime(self._DATE_FORMAT)
-            elif dtobj is None:
+            if single:
                 break
-            if dtend is not None and dtobj > dtend:
+            if ctime is not None:
+                dtkwargs['from'] = datetime.utcfromtimestamp(
+                    ctime).strftime(self._DATE_FORMAT)
+            elif ctime is None:
+                break
+            if tsend is not None and ctime > tsend:
                 break
             if len(candles) == 0:
                 break
 
-        q.put({})  # end of transmission'''
+        return True
+
+    def _t_polling_candles(self, granularity, period):
+        '''Callback method for the latest candles poller of a granularity'''
+        # longer periods start at full hours depending on the alignment
+        interval = min(period, 60 * 60)
+        with self._candle_lock:
+            wakeup = self._candle_wakeups[granularity]
+        while True:
+            with self._candle_lock:
+                subs = self._candle_polls[granularity]
+                delay = max([x['delay'] for x in subs] or [0.0])
+            now = _time.time()
+            # new subscriptions wake the poller before the end of the period
+            wakeup.wait(interval - now % interval + delay)
+            wakeup.clear()
+
+            with self._candle_lock:
+                subs = self._candle_polls[granularity]
+                if not subs:
+                    # no more subscriptions, end of thread
+                    del self._candle_polls[granularity]
+                    del self._candle_wakeups[granularity]
+                    return
+                # one specification per instrument with all price components
+                prices = dict()
+                for sub in subs:
+                    prices[sub['instrument']] = ''.join(sorted(
+                        set(prices.get(sub['instrument'], '') + sub['price'])))
+
+            response = None
+            try:
+                response = self._request_latest_candles([
+                    '{}:{}:{}'.format(name, granularity, price)
+                    for name, price in sorted(prices.items())])
+                latest = response.get('latestCandles', 200)
+            except (v20.V20ConnectionError, v20.V20Timeout) as e:
+                self.put_notification(str(e))
+                continue
+            except Exception as e:
+                self.put_notification(
+                    self._create_error_notif(
+                        e, response))
+                continue
+
+            candles = dict((x['instrument'], x['candles']) for x in latest)
+            with self._candle_lock:
+                subs = list(self._candle_polls[granularity])
+            for sub in subs:
+                for candle in candles.get(sub['instrument'], ()):
+                    ctime = float(candle['time'])
+                    if not candle['complete'] or ctime <= sub['last']:
+                        continue
+                    if sub['last'] > float('-inf') and \
+                            ctime > sub['last'] + period:
+                        # polls failed or ran late, fetch the candles between
+                        missed = self._get_missed_candles(
+                            sub, granularity, ctime)
+                        if missed is None:
+                            # the feed backfills up to the next candle
+                            sub['q'].put({'msg': 'CONNECTION_ISSUE'})
+                        for x in missed or ():
+                            sub['q'].put(x)
+                    sub['last'] = ctime
+                    # prices as floats like the candles of ``candles``
+                    candle = dict(candle, volume=int(candle['volume']))
+                    for side in OandaCandles.SIDES:
+                        if side in candle:
+                            candle[side] = dict(
+                                (k, float(v))
+                                for k, v in candle[side].items())
+                    sub['q'].put(candle)
+
+    def _get_missed_candles(self, sub, granularity, ctime):
+        '''Returns the complete candles of a poll subscription after its last
+        candle and before ctime as dicts, ``None`` if fetching them was given
+        up'''
+        pages = []
+        if not self._get_candles(
+                sub['instrument'], granularity, sub['price'],
+                datetime.utcfromtimestamp(sub['last']),
+                datetime.utcfromtimestamp(ctime),
+                includeFirst=False, onlyComplete=True, put=pages.append):
+            return None
+        return [candle for page in pages for candle in page.rows()
+                if sub['last'] < float(candle['time']) < ctime]
+
+    def _request_latest_candles(self, specs):
+        '''Requests the latest candles of instrument:granularity:price
+        specifications, the body of the response is the parsed json'''
+        request = v20.request.Request(
+            'GET', '/v3/accounts/{accountID}/candles/latest')
+        request.set_path_param('accountID', self.p.account)
+        request.set_param('candleSpecifications', ','.join(specs))
+        response = self._rest('pricing', self.oapi.request, request)
+        response.body = json.loads(response.raw_body or '{}')
+        return response
+
+    def _request_candles(self, dataname, **kwargs):
+        '''Requests candles without creating v20 model objects, the body of
+        the response is the parsed json'''
+        request = v20.request.Request(
+            'GET', '/v3/instruments/{instrument}/candles')
+        request.set_path_param('instrument', dataname)
+        for key, value in kwargs.items():
+            request.set_param(key, value)
+        response = self._rest('candles', self.oapi.request, request)
+        response.body = json.loads(response.raw_body or '{}')
+        return response
 
     def _transaction(self, trans):
         if self.p.notif_transactions:
             self.put_notification(str(trans))
+        self._update_account(trans)
         oid = None
         ttype = trans['type']
+        kind = self._X_KIND.get(ttype)
 
-        if ttype in self._X_CREATE_TRANS:
+        if kind == 'create':
             # get order id (matches transaction id)
             oid = trans['id']
             oref = None
@@ -812,21 +1550,21 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                 # assume backtrader created the order for this transaction
                 oref = self._client_id_to_oref(trans['clientExtensions']['id'])
             if oref is not None:
-                self._orders[oid] = oref
+                self._orders.add(oid, oref)
 
-        elif ttype in self._X_FILL_TRANS:
+        elif kind == 'fill':
             # order was filled, notify backtrader of it
             oid = trans['orderID']
 
-        elif ttype in self._X_CANCEL_TRANS:
+        elif kind == 'cancel':
             # order was cancelled, notify backtrader of it
             oid = trans['orderID']
 
-        elif ttype in self._X_REJECT_TRANS:
+        elif kind == 'reject':
             # transaction was rejected, notify backtrader of it
             oid = trans['requestID']
 
-        elif ttype in self._X_IGNORE_TRANS:
+        elif kind == 'ignore':
             # transaction can be ignored
             msg = 'Received transaction {} with id {}. Ignoring transaction.'
             msg = msg.format(ttype, trans['id'])
@@ -838,21 +1576,24 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
             self.put_notification(msg, trans)
             return
 
-        if oid in self._orders:
+        oref = self._orders.oref(oid)
+        if oref is not None:
             # when an order id exists process transaction
-            self._process_transaction(oid, trans)
-            self._process_trades(self._orders[oid], trans)
+            self._process_transaction(oref, kind, trans)
+            self._process_trades(oref, trans)
         else:
-            # external order created this transaction
-            self.get_server_position(update_latest=True)
-            if self.broker.p.use_positions and ttype in self._X_FILL_TRANS:
+            # external order created this transaction, the server positions
+            # were updated by the fill, the account thread reconciles them
+            # with the account changes without blocking the stream
+            self.q_account.put(True)
+            if self.broker.p.use_positions and kind == 'fill':
                 size = float(trans['units'])
                 price = float(trans['price'])
                 for data in self.datas:
                     if data._name == trans['instrument']:
                         self.broker._fill_external(data, size, price)
                         break
-            elif ttype not in self._X_IGNORE_TRANS:
+            elif kind != 'ignore':
                 # notify about unknown transaction
                 if self.broker.p.use_positions:
                     msg = 'Received external transaction {} with id {}. Skipping transaction.'
@@ -861,86 +1602,88 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
                 msg = msg.format(ttype, trans['id'])
                 self.put_notification(msg, trans)
 
-    def _process_transaction(self, oid, trans):
-        try:
-            # get a reference to a backtrader order based on
-            # the order id / trade id
-            oref = self._orders[oid]
-        except KeyError:
-            return
-
-        ttype = trans['type']
-        if ttype in self._X_CREATE_TRANS:
+    def _process_transaction(self, oref, kind, trans):
+        if kind == 'create':
             self.broker._accept(oref)
 
-        elif ttype in self._X_FILL_TRANS:
+        elif kind == 'fill':
             size = float(trans['units'])
             price = float(trans['price'])
             self.broker._fill(oref, size, price, reason=trans['reason'])
             # store order ids which generated by the order
             if 'tradeOpened' in trans:
-                self._orders[trans['tradeOpened']['tradeID']] = oref
+                self._orders.add(trans['tradeOpened']['tradeID'], oref)
             if 'tradeReduced' in trans:
-                self._orders[trans['tradeReduced']['tradeID']] = oref
+                self._orders.add(trans['tradeReduced']['tradeID'], oref)
 
-        elif ttype in self._X_CANCEL_TRANS:
+        elif kind == 'cancel':
             reason = trans['reason']
             if reason == 'TIME_IN_FORCE_EXPIRED':
                 self.broker._expire(oref)
             else:
                 self.broker._cancel(oref)
 
-        elif ttype in self._X_REJECT_TRANS:
+        elif kind == 'reject':
             self.broker._reject(oref)
 
     def _process_trades(self, oref, trans):
         if 'tradeID' in trans:
-            self._trades[oref] = trans['tradeID']
+            self._orders.set_trade(oref, trans['tradeID'])
         if 'tradeOpened' in trans:
-            self._trades[oref] = trans['tradeOpened']['tradeID']
+            self._orders.set_trade(oref, trans['tradeOpened']['tradeID'])
         if 'tradeClosed' in trans:
-            self._trades[oref] = trans['tradeClosed']['tradeID']
+            self._orders.set_trade(oref, trans['tradeClosed']['tradeID'])
         if 'tradesClosed' in trans:
             for t in trans['tradesClosed']:
-                for key, value in self._trades.copy().items():
-                    if value == t['tradeID']:
-                        del self._trades[key]
+                self._orders.close_trade(t['tradeID'])
 
-    def _t_order_create(self):
-        while True:
-            msg = self.q_ordercreate.get()
-            if msg is None:
-                break
+    def _order_create(self, msg):
+        '''Sends an order of ``q_ordercreate``'''
+        oref, okwargs = msg
+        response = None
+        try:
+            if okwargs['replace']:
+                client_id = self._oref_to_client_id(okwargs['replace'])
+                if client_id is None:
+                    # the replaced order is done and was evicted
+                    self.put_notification(
+                        'Order {} to replace is unknown'.format(
+                            okwargs['replace']))
+                    self.broker._reject(oref)
+                    return
+                oid = '@{}'.format(client_id)
+                trade_id = self._orders.trade(okwargs['replace'])
+                if trade_id is not None:
+                    okwargs['tradeID'] = trade_id
+                if okwargs['replace_type']:
+                    okwargs['type'] = okwargs['replace_type']
+                response = self._rest(
+                    'order', self.oapi.order.replace,
+                    self.p.account,
+                    oid,
+                    order=okwargs)
+            else:
+                response = self._rest(
+                    'order', self.oapi.order.create,
+                    self.p.account,
+                    order=okwargs)
+            # get the transaction which created the order
+            o = response.get('orderCreateTransaction', 201)
+        except (v20.V20ConnectionError, v20.V20Timeout) as e:
+            self.put_notification(str(e))
+            self.broker._reject(oref)
+        except Exception as e:
+            self.put_notification(
+                self._create_error_notif(
+                    e, response))
+            self.broker._reject(oref)
 
-            oref, okwargs = msg
-            try:
-                if okwargs['replace']:
-                    oid = '@{}'.format(
-                        self._oref_to_client_id(okwargs['replace']))
-                    if okwargs['replace'] in self._trades:
-                        okwargs['tradeID'] = self._trades[okwargs['replace']]
-                    if okwargs['replace_type']:
-                        okwargs['type'] = okwargs['replace_type']
-                    response = self.oapi.order.replace(
-                        self.p.account,
-                        oid,
-                        order=okwargs)
-                else:
-                    response = self.oapi.order.create(
-                        self.p.account,
-                        order=okwargs)
-                # get the transaction which created the order
-                o = response.get('orderCreateTransaction', 201)
-            except (v20.V20ConnectionError, v20.V20Timeout) as e:
-                self.put_notification(str(e))
-                self.broker._reject(oref)
-                continue
-            except Exception as e:
-                self.put_notification(
-                    self._create_error_notif(
-                        e, response))
-                self.broker._reject(oref)
-                continue
+    def _order_create_failed(self, msg, e):
+        '''Rejects an order of ``q_ordercreate`` which failed with an
+        unexpected error'''
+        oref, okwargs = msg
+        self.put_notification('Order {} failed: {}'.format(oref, e))
+        self.broker._reject(oref)
 
     def _t_order_cancel(self):
         while True:
@@ -948,17 +1691,13 @@ class OandaV20Store(with_metaclass(MetaSingleton, object)):
             if oref is None:
                 break
 
-            oid = None
-            for key, value in self._orders.items():
-                if value == oref:
-                    oid = key
-                    break
-
+            oid = self._orders.oid(oref)
             if oid is None:
                 continue  # the order is no longer there
             try:
                 # TODO either close pending orders or filled trades
-                response = self.oapi.order.cancel(self.p.account, oid)
+                response = self._rest(
+                    'cancel', self.oapi.order.cancel, self.p.account, oid)
             except (v20.V20ConnectionError, v20.V20Timeout) as e:
                 self.put_notification(str(e))
                 continue
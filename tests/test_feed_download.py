@@ -0,0 +1,126 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+from datetime import datetime, timezone
+
+import backtrader as bt
+
+import btoandav20
+from btoandav20.stores import OandaCandles
+from btoandav20.stores.oandachannel import OandaCandleChannel
+
+CONTRACTDETAILS = {
+    'name': 'EUR_USD',
+    'displayPrecision': 5,
+    'pipLocation': -4,
+}
+
+
+def make_page(count, start=1600000000):
+    page = OandaCandles()
+    for i in range(count):
+        candle = {'time': '{}.000000000'.format(start + i * 60),
+                  'volume': 10, 'complete': True}
+        for side in OandaCandles.SIDES:
+            candle[side] = {'o': 1.1, 'h': 1.2, 'l': 1.0, 'c': 1.15}
+        page.append(candle)
+    return page
+
+
+class FakeCandlesResponse(object):
+    def __init__(self, candles):
+        self.candles = candles
+
+    def get(self, name, status):
+        return self.candles
+
+
+def make_store(times, pagesize):
+    '''Returns a store serving candles at the epoch times page by page like
+    the candles endpoint of OANDA'''
+    btoandav20.stores.OandaV20Store._singleton = None
+    store = btoandav20.stores.OandaV20Store(token='', account='test')
+    requests = []
+
+    def request_candles(dataname, **kwargs):
+        requests.append(kwargs)
+        begin = datetime.strptime(
+            kwargs['from'][:-4], '%Y-%m-%dT%H:%M:%S.%f').replace(
+                tzinfo=timezone.utc).timestamp()
+        if kwargs.get('includeFirst', True):
+            page = [t for t in times if t >= begin]
+        else:
+            page = [t for t in times if t > begin]
+        return FakeCandlesResponse([
+            {'time': '{:.9f}'.format(t), 'volume': 10, 'complete': True,
+             'mid': {'o': '1.1', 'h': '1.2', 'l': '1.0', 'c': '1.15'}}
+            for t in page[:pagesize]])
+
+    store._request_candles = request_candles
+    return store, requests
+
+
+def make_feed(items, **kwargs):
+    '''Returns a historical feed downloading items, the store does not
+    connect to OANDA'''
+    btoandav20.stores.OandaV20Store._singleton = None
+    data = btoandav20.feeds.OandaV20Data(
+        dataname='EUR_USD', timeframe=bt.TimeFrame.Minutes, compression=1,
+        historical=True, fromdate=datetime(2020, 1, 1), **kwargs)
+    store = data.o
+    channel = OandaCandleChannel()
+    for item in items:
+        channel.put(item)
+    store.start = lambda data=None, broker=None: None
+    store.stop = lambda: None
+    store.get_instrument = lambda dataname: CONTRACTDETAILS
+    store.candles = lambda *args, **kwargs: channel
+    data.setenvironment(bt.Cerebro())
+    data._start()
+    return data
+
+
+def run(func, timeout=5.0):
+    '''Returns if func returned within timeout'''
+    t = threading.Thread(target=func)
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    return not t.is_alive()
+
+
+def test_preload_returns_on_failed_download():
+    data = make_feed([make_page(10), None])
+    assert run(data.preload)
+    assert data.buflen() == 10
+    assert data._laststatus == data.DISCONNECTED
+
+
+def test_load_ends_on_failed_download():
+    data = make_feed([make_page(10), None], reconnect=False)
+    loaded = []
+
+    def load():
+        while data.load():
+            loaded.append(data.datetime[0])
+
+    assert run(load)
+    assert len(loaded) == 10
+    assert data._laststatus == data.DISCONNECTED
+
+
+def test_preload_of_complete_download():
+    data = make_feed([make_page(10), make_page(5, 1600000600), {}])
+    assert run(data.preload)
+    assert data.buflen() == 15
+
+
+def test_iter_candles_pages_without_duplicates():
+    times = [1600000000.0 + i * 60 for i in range(25)]
+    store, requests = make_store(times, pagesize=10)
+    candles = list(store.iter_candles(
+        'EUR_USD', datetime.utcfromtimestamp(times[0]), None,
+        bt.TimeFrame.Minutes, 1))
+    assert [float(x['time']) for x in candles] == times
+    assert len(requests) > 2  # the download crossed page boundaries
@@ -0,0 +1,159 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import calendar
+import random
+from datetime import datetime, time, timedelta, timezone
+
+import backtrader as bt
+import pytest
+
+from btoandav20.stores import OandaV20Store
+from btoandav20.stores.oandaperiods import OandaPeriods
+
+SESSIONS = (time(22), time(0), time(21), time(23), time(7))
+# checked against the properties only, the reference uses the full hour
+SESSIONS_PROPERTIES = (time(22, 30), time(21, 15, 30), time(0, 0, 1))
+
+
+def reference_starttime(timeframe, compression, dt, offset=0,
+                        sessionstart=None):
+    '''Period start of the data feed before ``OandaPeriods``'''
+    if sessionstart is None:
+        sessionstart = time(hour=22, minute=0, second=0)
+    if timeframe == bt.TimeFrame.Seconds:
+        dt = dt.replace(
+            second=(dt.second // compression) * compression,
+            microsecond=0)
+        if offset:
+            dt = dt - timedelta(seconds=compression*offset)
+    elif timeframe == bt.TimeFrame.Minutes:
+        if compression >= 60:
+            dtstart = reference_starttime(
+                bt.TimeFrame.Days, 1, dt, sessionstart=sessionstart)
+            dtdiff = dt - dtstart
+            hours = dtdiff.seconds//((60*60)*(compression//60))
+            hours = hours * (compression//60)
+            minutes = compression % 60
+            dt = dtstart + timedelta(hours=hours, minutes=minutes)
+        else:
+            dt = dt.replace(
+                minute=(dt.minute // compression) * compression,
+                second=0,
+                microsecond=0)
+        if offset:
+            dt = dt - timedelta(minutes=compression*offset)
+    elif timeframe == bt.TimeFrame.Days:
+        if dt.hour < sessionstart.hour:
+            dt = dt - timedelta(days=1)
+        if offset:
+            dt = dt - timedelta(days=offset)
+        dt = dt.replace(
+            hour=sessionstart.hour,
+            minute=sessionstart.minute,
+            second=sessionstart.second,
+            microsecond=sessionstart.microsecond)
+    elif timeframe == bt.TimeFrame.Weeks:
+        if dt.weekday() != 6:
+            dt = dt - timedelta(days=dt.weekday() + 1)
+        elif dt.time() < sessionstart:
+            dt = dt - timedelta(days=7)
+        if offset:
+            dt = dt - timedelta(days=offset * 7)
+        dt = dt.replace(
+            hour=sessionstart.hour,
+            minute=sessionstart.minute,
+            second=sessionstart.second,
+            microsecond=sessionstart.microsecond)
+    elif timeframe == bt.TimeFrame.Months:
+        first = dt.replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
+        dtstart = reference_starttime(
+            bt.TimeFrame.Days, 1, first, sessionstart=sessionstart)
+        dtnext = reference_starttime(
+            bt.TimeFrame.Days, 1, (first + timedelta(days=32)).replace(day=1),
+            sessionstart=sessionstart)
+        dt = dtnext if dt >= dtnext else dtstart
+        for _ in range(abs(offset)):
+            if offset > 0:
+                dt = reference_starttime(
+                    timeframe, compression, dt - timedelta(microseconds=1),
+                    sessionstart=sessionstart)
+            else:
+                dt = reference_starttime(
+                    timeframe, compression, dt + timedelta(days=32),
+                    sessionstart=sessionstart)
+    return dt
+
+
+def epoch(dt):
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def make_times(count, seed):
+    '''Returns random epoch times and times around period boundaries, month
+    ends, leap days and the session start on sundays'''
+    rnd = random.Random(seed)
+    begin, end = epoch(datetime(1990, 1, 1)), epoch(datetime(2040, 1, 1))
+    times = [rnd.uniform(begin, end) for _ in range(count)]
+    times += [float(int(x)) for x in times[:count // 4]]
+    days = [datetime(y, m, d) for y in (1999, 2000, 2020, 2023, 2024, 2100)
+            for m, d in ((1, 1), (2, 28), (2, 29), (3, 1), (12, 31))
+            if not (m == 2 and d == 29 and not calendar.isleap(y))]
+    days += [datetime(2024, 3, 3) + timedelta(days=7 * x) for x in range(4)]
+    for day in days:
+        for hours in (0, 7, 21, 22, 23):
+            ts = epoch(day + timedelta(hours=hours))
+            times += [ts - 1e-6, ts, ts + 1e-6, ts - 1.0, ts + 59.999]
+    return times
+
+
+TIMES = make_times(2000, 0)
+
+
+def failures(periods, times, reference):
+    '''Returns descriptions of the failed checks of the times'''
+    tf, comp = periods.timeframe, periods.compression
+    failed = []
+
+    def fail(what, ts):
+        failed.append('{}: {} at {}'.format(
+            periods.sessionstart, what,
+            datetime.utcfromtimestamp(ts).isoformat()))
+
+    starts, ends = periods.starts(times), periods.ends(times)
+    for ts, vstart, vend in zip(times, starts, ends):
+        start, end = periods.period(ts)
+        if (vstart, vend) != (start, end):
+            fail('vectorized {} != {}'.format((vstart, vend), (start, end)),
+                 ts)
+        tsus = round(ts * 1e6) / 1e6  # times are handled in microseconds
+        if not start <= tsus < end:
+            fail('not in period {} - {}'.format(start, end), ts)
+        if periods.period(start) != (start, end):
+            fail('start not in own period', ts)
+        if periods.start(end) != end or periods.end(end - 1e-6) != end:
+            fail('end not start of next period', ts)
+        if (periods.start(ts, 1) != periods.start(start - 1e-6) or
+                periods.start(ts, -2) != periods.end(end)):
+            fail('offset not moving by periods', ts)
+
+        if not reference:
+            continue
+        dt = datetime.utcfromtimestamp(ts)
+        for offset in (0, 1, -1, 2):
+            ref = epoch(reference_starttime(tf, comp, dt, offset,
+                                            periods.sessionstart))
+            if periods.start(ts, offset) != ref:
+                fail('offset {}: {} != reference {}'.format(
+                    offset, periods.start(ts, offset), ref), ts)
+    return failed
+
+
+@pytest.mark.parametrize('granularity', sorted(OandaV20Store._GRANULARITIES),
+                         ids=OandaV20Store._GRANULARITIES.get)
+@pytest.mark.parametrize('session', SESSIONS + SESSIONS_PROPERTIES, ids=str)
+def test_periods(granularity, session):
+    periods = OandaPeriods(granularity[0], granularity[1], session)
+    failed = failures(periods, TIMES, session in SESSIONS)
+    assert not failed, failed[:10]